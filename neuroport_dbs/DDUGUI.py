@@ -1,5 +1,6 @@
-import re
+import math
 import sys
+import time
 
 import serial
 import serial.tools.list_ports
@@ -14,6 +15,9 @@ from qtpy.QtCore import QTimer
 from cerebuswrapper import CbSdkConnection
 import pylsl
 
+from neuroport_dbs.dbsgui.workers.ddu import DDUReader  # Not re-exported: only this GUI needs pyserial.
+from neuroport_dbs.dbsgui.my_models.depth_timeline import DepthTimeline, DepthTimelineSharedMemory
+
 # settings
 from neuroport_dbs.settings.defaults import WINDOWDIMS_DEPTH, DDUSCALEFACTOR
 
@@ -25,9 +29,12 @@ class DepthGUI(QMainWindow):
 
         self.display_string = None
 
-        # Serial port config
-        self.ser = serial.Serial(timeout=1)
-        self.ser.baudrate = 19200
+        # The serial port is read on a background thread; new depths arrive through on_ddu_depth.
+        self.ddu_reader = None
+        self._last_reading = None  # (raw DDU value, host time) of the latest depth
+        # Every depth change with its NSP timestamp, shared with the other GUIs.
+        self.depth_timeline = DepthTimeline()
+        self.depth_timeline_mem = DepthTimelineSharedMemory(owner=True)
 
         self._is_v2 = False
         self._gain = 1.000
@@ -183,8 +190,9 @@ class DepthGUI(QMainWindow):
     def _do_close(self, from_port):
         if from_port == "cbsdk playback":
             CbSdkConnection().disconnect()
-        else:
-            self.ser.close()
+        elif self.ddu_reader is not None:
+            self.ddu_reader.stop()
+            self.ddu_reader = None
         self.pushButton_open.setText("Open")
 
     def on_comboBox_com_port_changed(self, new_ix):
@@ -224,33 +232,78 @@ class DepthGUI(QMainWindow):
                     CbSdkConnection().connect()
                     CbSdkConnection().cbsdk_config = {'reset': True, 'get_events': False, 'get_comments': False}
 
-                if not self.ser.is_open:
-                    self.ser.port = com_port
+                if self.ddu_reader is None:
+                    # The version probe and all reads happen on the reader thread.
+                    self.ddu_reader = DDUReader(com_port, baudrate=19200, nsp_clock=self.nsp_time, parent=self)
+                    self.ddu_reader.version_detected.connect(self.on_ddu_version)
+                    self.ddu_reader.depth_changed.connect(self.on_ddu_depth)
+                    self.ddu_reader.stopped.connect(self.on_ddu_stopped)
                     try:
-                        self.ser.open()  # TODO: Add error handling.
-                        # Quiety printing for a minute
-                        self.ser.write("AXON-\r".encode())
-                        self.ser.write("V\r".encode())
-                        # readlines will capture until timeout
-                        pattern = "([0-9]+\.[0-9]+)"
-                        for line in self.ser.readlines():
-                            match = re.search(pattern, line.decode("utf-8").strip())
-                            if match is not None:
-                                v = match.group()  # e.g., "2.20"
-                                v_maj = int(v.split(".")[0])
-                                self.is_v2 = v_maj >= 2
-                                break
-                        # Resume printing
-                        self.ser.write("AXON+\r".encode())
-                        _ = self.ser.readline()  # Clear out the first response to AXON+
+                        self.ddu_reader.start()
                     except serial.serialutil.SerialException:
                         print("Could not open serial port")
+                        self.ddu_reader = None
                     finally:
-                        self.pushButton_open.setText("Close" if self.ser.is_open else "Open")
+                        self.pushButton_open.setText("Close" if self.ddu_reader is not None else "Open")
         else:
             self._do_close(com_port)
 
+    @staticmethod
+    def nsp_time():
+        # Called on the reader thread.
+        cbsdk_conn = CbSdkConnection()
+        return cbsdk_conn.time() if cbsdk_conn.is_connected else float('nan')
+
+    def on_ddu_version(self, v):
+        # e.g., "2.20"
+        v_maj = int(v.split(".")[0])
+        self.is_v2 = v_maj >= 2
+
+    def on_ddu_stopped(self, reason):
+        # Only a reader that failed (e.g., the DDU was unplugged), not one we closed.
+        if reason and self.sender() is self.ddu_reader:
+            print("DDU connection lost: {}".format(reason))
+            self.ddu_reader.stop()
+            self.ddu_reader = None
+            self.pushButton_open.setText("Open")
+
+    def on_ddu_depth(self, in_value, host_time, nsp_time):
+        self._last_reading = (in_value, host_time)
+        in_value *= self._gain  # Uncomment this for FHC DDU V2.
+
+        self.raw_ddu.display("{0:.3f}".format(in_value))
+
+        out_value = in_value + self.doubleSpinBox_DTT.value() + self.doubleSpinBox_offset.value()
+        display_string = "{0:.3f}".format(out_value)
+        self.offset_ddu.display(display_string)
+
+        # Check if new value
+        if display_string == self.display_string:
+            return
+        self.display_string = display_string
+
+        # Push to NSP
+        cbsdk_conn = CbSdkConnection()
+        if cbsdk_conn.is_connected:
+            if self.chk_NSP.isChecked() and self.chk_NSP.isEnabled():
+                cbsdk_conn.set_comments("DTT:" + display_string)
+        else:
+            # try connecting if not connected but button is active
+            if self.chk_NSP.isChecked() and self.chk_NSP.isEnabled():
+                cbsdk_conn.connect()
+                cbsdk_conn.cbsdk_config = {'reset': True, 'get_events': False, 'get_comments': False}
+            # set button to connection status
+            self.chk_NSP.setChecked(cbsdk_conn.is_connected)
+
+        if not math.isnan(nsp_time) and self.depth_timeline.append(int(nsp_time), out_value):
+            self.depth_timeline_mem.write(self.depth_timeline)
+
+        # Push to LSL, stamped with the time the line was received.
+        if self.depth_stream is not None:
+            self.depth_stream.push_sample([out_value], pylsl.local_clock() - (time.time() - host_time))
+
     def update(self):
+        # Serial DDU readings are pushed by the reader thread (on_ddu_depth); only playback is polled here.
         # Added new_value handling for playback if we ever want to post-process depth
         # on previously recorded sessions.
         new_value = False
@@ -260,6 +313,8 @@ class DepthGUI(QMainWindow):
             cbsdk_conn = CbSdkConnection()
             if cbsdk_conn.is_connected:
                 comments = cbsdk_conn.get_comments()
+                if comments and self.depth_timeline.add_comments(comments):
+                    self.depth_timeline_mem.write(self.depth_timeline)
                 if comments:
                     comment_strings = [x[1].decode("utf8") for x in comments]
                 else:
@@ -275,47 +330,16 @@ class DepthGUI(QMainWindow):
                     offset = self.doubleSpinBox_offset.value()
                     self.raw_ddu.display("{0:.3f}".format(out_value - offset))
 
-        elif self.ser.is_open:
-            in_str = self.ser.readline().decode("utf-8").strip()
-            if in_str:
-                try:
-                    in_value = float(in_str)
-                    in_value *= self._gain  # Uncomment this for FHC DDU V2.
-
-                    self.raw_ddu.display("{0:.3f}".format(in_value))
-
-                    out_value = in_value + self.doubleSpinBox_DTT.value() + self.doubleSpinBox_offset.value()
-                    display_string = "{0:.3f}".format(out_value)
-                    self.offset_ddu.display(display_string)
-
-                    # Check if new value
-                    if display_string != self.display_string:
-                        new_value = True
-                        self.display_string = display_string
-
-                    # Push to NSP
-                    cbsdk_conn = CbSdkConnection()
-                    if cbsdk_conn.is_connected:
-                        if self.chk_NSP.isChecked() and self.chk_NSP.isEnabled() and new_value:
-                            cbsdk_conn.set_comments("DTT:" + display_string)
-                    else:
-                        # try connecting if not connected but button is active
-                        if self.chk_NSP.isChecked() and self.chk_NSP.isEnabled():
-                            cbsdk_conn.connect()
-                            cbsdk_conn.cbsdk_config = {'reset': True, 'get_events': False, 'get_comments': False}
-                        # set button to connection status
-                        self.chk_NSP.setChecked(cbsdk_conn.is_connected)
-
-                except ValueError:
-                    print("DDU result: {}".format(in_str))
-
         # Push to LSL
         if self.depth_stream is not None and new_value:
             self.depth_stream.push_sample([out_value])
 
     def send(self):
-        self.display_string = None  # make sure the update function runs
-        self.update()
+        self.display_string = None  # make sure the value is pushed again
+        if self.ddu_reader is not None and self._last_reading is not None:
+            self.on_ddu_depth(self._last_reading[0], self._last_reading[1], self.nsp_time())
+        else:
+            self.update()
 
 
 def main():
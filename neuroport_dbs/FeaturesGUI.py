@@ -1,5 +1,7 @@
 import os
 import sys
+import time
+import collections
 import numpy as np
 import qtpy.QtCore
 from qtpy.QtWidgets import QApplication
@@ -14,12 +16,24 @@ from cerebuswrapper import CbSdkConnection
 from neuroport_dbs.dbsgui.my_widgets.custom import CustomGUI, CustomWidget, SAMPLINGGROUPS
 from neuroport_dbs.feature_plots import *
 from neuroport_dbs.SettingsDialog import SettingsDialog
+from neuroport_dbs.dbsgui.my_models.feature_cache import FeatureDataCache, FeatureChangeFeed
+from neuroport_dbs.dbsgui.workers import FeaturePrefetch, DBLookup
 
 from serf.tools.db_wrap import DBWrapper, ProcessWrapper
 
 # Settings
 from neuroport_dbs.settings.defaults import WINDOWDIMS_FEATURES, XRANGE_FEATURES, uVRANGE, BASEPATH, SAMPLINGRATE, \
-                                            BUFFERLENGTH, SAMPLELENGTH, DELAYBUFFER, OVERWRITEDEPTH, DEPTHSETTINGS
+                                            BUFFERLENGTH, SAMPLELENGTH, DELAYBUFFER, OVERWRITEDEPTH, DEPTHSETTINGS, \
+                                            FEATURES_PROBE_INTERVAL, FEATURES_MAX_PLOTS
+
+
+def load_feature_data(chan_lbl, category, gt=0, do_hp=True):
+    # Returns {datum_id: data} for all datums > gt.
+    if category == 'Raw':
+        return DBWrapper().load_depth_data(chan_lbl=chan_lbl, gt=gt, do_hp=do_hp, return_uV=True)
+    elif category == 'Mapping':
+        return DBWrapper().load_mapping_response(chan_lbl=chan_lbl, gt=gt)
+    return DBWrapper().load_features_data(category=category, chan_lbl=chan_lbl, gt=gt)
 
 
 class FeaturesGUI(CustomGUI):
@@ -135,6 +149,8 @@ class FeaturesGUI(CustomGUI):
             self.subject_settings['subject_id'] = sub_id
             self.procedure_settings['subject_id'] = sub_id
             proc_id = self.db_wrapper.load_or_create_procedure(self.procedure_settings)
+            # The settings dialog's cached subject and procedure lists may be out of date.
+            DBLookup.invalidate()
 
             self.buffer_settings['procedure_id'] = proc_id
             self.features_settings['procedure_id'] = proc_id
@@ -177,8 +193,24 @@ class FeaturesPlotWidget(CustomWidget):
         self.plot_config = {}
         self.y_range = uVRANGE
         self.plot_stack = QStackedWidget()
-        # generate a dict {chan_label: {Feature:[stack idx, latest_datum]}}
+        # generate a dict {chan_label: {Feature:[plot widget or None, latest_datum]}}
+        # Plot widgets are only created when their (channel, feature) is first selected and the least recently
+        #  selected ones are deleted beyond FEATURES_MAX_PLOTS. The data stay in the feature cache.
         self.stack_dict = {}
+        self.live_plots = collections.OrderedDict()  # (chan_label, feature) -> None, in LRU order
+        self.null_plot = NullPlotWidget({'do_hp': True, 'y_range': uVRANGE})
+        self.plot_stack.addWidget(self.null_plot)
+
+        # Depth and feature data are read through a cache. The database is only queried for a series when the
+        #  change feed (or the slow fallback probe) says it has new data.
+        self.feature_cache = FeatureDataCache(load_feature_data)
+        self.change_feed = FeatureChangeFeed()
+        self.change_feed.changed.connect(self.feature_cache.mark_stale)
+        self._last_probe_time = 0.
+        self._last_depth_status = 0
+        # Every (channel, feature) series is kept warm in the background so switching views is instant.
+        self.prefetch = FeaturePrefetch(self.feature_cache)
+        self.prefetch.start()
 
         # shared memory to display the currently monitored electrode
         self.monitored_channel_mem = QSharedMemory()
@@ -343,8 +375,14 @@ class FeaturesPlotWidget(CustomWidget):
 
     # GUI Callbacks
     def manage_feat_chan_select(self):
-        self.plot_stack.setCurrentIndex(
-            self.stack_dict[self.chan_select.currentText()][self.feature_select.currentText()][0])
+        chan_lbl = self.chan_select.currentText()
+        feat = self.feature_select.currentText()
+        widget = self.get_plot_widget(chan_lbl, feat)
+        if widget is None and feat in self.stack_dict.get(chan_lbl, {}):
+            widget = self.create_plot_widget(chan_lbl, feat)
+            self.reload_series(chan_lbl, feat)
+        self.plot_stack.setCurrentWidget(widget if widget is not None else self.null_plot)
+        self.prefetch.set_current(chan_lbl, feat, self.do_hp.isChecked())
 
     def manage_sweep_control(self):
         if self.sweep_control.isChecked() and self.monitored_channel_mem.isAttached():
@@ -422,9 +460,30 @@ class FeaturesPlotWidget(CustomWidget):
             self.features_process_running = False
 
     def manage_refresh(self):
-        self.plot_stack.widget(
-            self.stack_dict[self.chan_select.currentText()][self.feature_select.currentText()][0]).clear_plot()
-        self.stack_dict[self.chan_select.currentText()][self.feature_select.currentText()][1] = 0
+        self.reload_series(self.chan_select.currentText(), self.feature_select.currentText())
+
+    def reload_series(self, chan_lbl, feat):
+        # Redraw from what is cached right away; the prefetch worker sends anything newer.
+        stack_item = self.stack_dict[chan_lbl][feat]
+        widget = stack_item[0]
+        if widget is None:
+            return
+        # Clearing and refilling is one update of the widget.
+        widget.begin_update()
+        widget.clear_plot()
+        stack_item[1] = 0
+        do_hp = self.do_hp.isChecked()
+        all_data = self.feature_cache.get(self.features_settings['procedure_id'], chan_lbl, feat, do_hp=do_hp,
+                                          load=False)
+        if all_data:
+            widget.update_plot(dict(all_data))
+            stack_item[1] = max(all_data.keys())
+        widget.commit_update()
+        self.prefetch.request(chan_lbl, feat, do_hp)
+
+    def all_series(self):
+        do_hp = self.do_hp.isChecked()
+        return [(lbl, feat, do_hp) for lbl in self.stack_dict for feat in self.stack_dict[lbl]]
 
     def process_settings(self, sub_sett, proc_sett, depth_sett, feat_sett):
         self.subject_settings = dict(sub_sett)
@@ -440,6 +499,11 @@ class FeaturesPlotWidget(CustomWidget):
                 self.depth_settings['electrode_settings'][lbl] = DEPTHSETTINGS
             CbSdkConnection().is_simulating = True
 
+        # clear and update stacked widget
+        for chan_lbl, feat in list(self.live_plots.keys()):
+            self.evict_plot_widget(chan_lbl, feat)
+        self.stack_dict = {}
+
         # set new features
         self.feature_select.setCurrentIndex(0)  # Raw
         while self.feature_select.count() > 2:  # Raw and Mapping
@@ -452,14 +516,9 @@ class FeaturesPlotWidget(CustomWidget):
             self.chan_select.removeItem(1)
         self.chan_select.addItems(self.depth_settings['electrode_settings'].keys())
 
-        # clear and update stacked widget
-        to_delete = [self.plot_stack.widget(x) for x in range(self.plot_stack.count())]
-        for wid in to_delete:
-            self.plot_stack.removeWidget(wid)
-            wid.deleteLater()
-            wid = None
-        self.stack_dict = {}
+        self.feature_cache.clear()
         self.create_plots()
+        self.prefetch.set_series(self.features_settings['procedure_id'], self.all_series())
 
         self.depth_wrapper.send_settings(self.depth_settings)
         self.features_wrapper.send_settings(self.features_settings)
@@ -487,44 +546,79 @@ class FeaturesPlotWidget(CustomWidget):
         for ii in range(0, self.feature_select.count()):
             features.append(self.feature_select.itemText(ii))
 
-        stack_idx = 0
-        for lbl_idx, lbl in enumerate(labels):
-            self.stack_dict[lbl] = {}
-            self.plot_config['color_iterator'] = lbl_idx - 1
-            self.plot_config['title'] = lbl
-            for feat in features:
-                self.stack_dict[lbl][feat] = [stack_idx, 0]
-                # TODO: not hard-coding??
-                if feat == 'Raw':
-                    self.plot_stack.addWidget(RawPlots(dict(self.plot_config)))
-                elif feat == 'Mapping':
-                        self.plot_stack.addWidget(MappingPlots(dict(self.plot_config)))
-                elif feat == 'STN':
-                    self.plot_stack.addWidget(STNPlots(dict(self.plot_config)))
-                elif feat == 'LFP':
-                    self.plot_stack.addWidget(LFPPlots(dict(self.plot_config)))
-                elif feat == 'Spikes':
-                    self.plot_stack.addWidget(SpikePlots(dict(self.plot_config)))
-                else:
-                    self.plot_stack.addWidget(NullPlotWidget(dict(self.plot_config)))
-                stack_idx += 1
-
-        self.plot_stack.setCurrentIndex(0)
+        # Only the bookkeeping; the widgets are created by create_plot_widget when first selected.
+        for lbl in labels:
+            if lbl == 'None':
+                continue
+            self.stack_dict[lbl] = {feat: [None, 0] for feat in features}
+
+        self.plot_stack.setCurrentWidget(self.null_plot)
+
+    def create_plot_widget(self, chan_lbl, feat):
+        plot_config = {**self.plot_config,
+                       'color_iterator': self.chan_select.findText(chan_lbl) - 1,
+                       'title': chan_lbl}
+        # TODO: not hard-coding??
+        if feat == 'Raw':
+            widget = RawPlots(plot_config)
+        elif feat == 'Mapping':
+            widget = MappingPlots(plot_config)
+        elif feat == 'STN':
+            widget = STNPlots(plot_config)
+        elif feat == 'LFP':
+            widget = LFPPlots(plot_config)
+        elif feat == 'Spikes':
+            widget = SpikePlots(plot_config)
+        else:
+            widget = NullPlotWidget(plot_config)
+        self.plot_stack.addWidget(widget)
+        self.stack_dict[chan_lbl][feat] = [widget, 0]
+        self.live_plots[(chan_lbl, feat)] = None
+
+        # Evict the least recently selected widgets.
+        while len(self.live_plots) > max(1, FEATURES_MAX_PLOTS):
+            old_lbl, old_feat = next(iter(self.live_plots))
+            self.evict_plot_widget(old_lbl, old_feat)
+        return widget
+
+    def get_plot_widget(self, chan_lbl, feat):
+        # Returns the widget of (chan_lbl, feat) if it exists, and marks it as recently used.
+        widget = self.stack_dict.get(chan_lbl, {}).get(feat, [None])[0]
+        if widget is not None:
+            self.live_plots.move_to_end((chan_lbl, feat))
+        return widget
+
+    def evict_plot_widget(self, chan_lbl, feat):
+        self.live_plots.pop((chan_lbl, feat), None)
+        stack_item = self.stack_dict.get(chan_lbl, {}).get(feat)
+        if stack_item is None or stack_item[0] is None:
+            return
+        widget = stack_item[0]
+        if self.plot_stack.currentWidget() is widget:
+            self.plot_stack.setCurrentWidget(self.null_plot)
+        widget.clear_plot()
+        self.plot_stack.removeWidget(widget)
+        widget.deleteLater()
+        stack_item[0] = None
+        stack_item[1] = 0
 
     def refresh_axes(self):
         pass
 
     def clear(self):
         # set the current datum of all stacks to 0
-        for lbl in self.stack_dict:
-            for feat in self.stack_dict[lbl]:
-                self.stack_dict[lbl][feat][1] = 0
-                self.plot_stack.widget(self.stack_dict[lbl][feat][0]).clear_plot()
+        for lbl, feat in self.live_plots:
+            self.stack_dict[lbl][feat][1] = 0
+            self.stack_dict[lbl][feat][0].clear_plot()
 
     def update(self):
         # Depth process
         output = self.depth_wrapper.worker_status()
         self.status_label.setPixmap(self.status_icons[output])
+        # A depth that just finished recording means new data in every series.
+        if output == 1 and self._last_depth_status != 1:
+            self.feature_cache.mark_stale()
+        self._last_depth_status = output
 
         if self.depth_wrapper.is_running():
             self.depth_process_btn.setStyleSheet("QPushButton { color: white; "
@@ -555,35 +649,50 @@ class FeaturesPlotWidget(CustomWidget):
 
         # features plot
         curr_chan_lbl = self.chan_select.currentText()
-        if curr_chan_lbl != 'None':
-            curr_feat = self.feature_select.currentText()
+        curr_feat = self.feature_select.currentText()
+        curr_widget = self.get_plot_widget(curr_chan_lbl, curr_feat)
+        if curr_widget is not None:
             do_hp = self.do_hp.isChecked()
 
-            if do_hp != self.plot_stack.currentWidget().plot_config['do_hp'] or \
-                    self.y_range != self.plot_stack.currentWidget().plot_config['y_range']:
-                self.plot_stack.currentWidget().clear_plot()
-                self.stack_dict[curr_chan_lbl][curr_feat][1] = 0
-                self.plot_stack.currentWidget().plot_config['do_hp'] = do_hp
-                self.plot_stack.currentWidget().plot_config['y_range'] = self.y_range
-
-            curr_datum = self.stack_dict[curr_chan_lbl][curr_feat][1]
-            if curr_feat == 'Raw':
-                all_data = DBWrapper().load_depth_data(chan_lbl=curr_chan_lbl,
-                                                       gt=curr_datum,
-                                                       do_hp=do_hp,
-                                                       return_uV=True)
-            elif curr_feat == 'Mapping':
-                all_data = DBWrapper().load_mapping_response(chan_lbl=curr_chan_lbl,
-                                                             gt=curr_datum)
-            else:
-                all_data = DBWrapper().load_features_data(category=curr_feat,
-                                                          chan_lbl=curr_chan_lbl,
-                                                          gt=curr_datum)
-            if all_data:
-                self.plot_stack.currentWidget().update_plot(dict(all_data))
-                self.stack_dict[curr_chan_lbl][curr_feat][1] = max(all_data.keys())
+            if do_hp != curr_widget.plot_config['do_hp'] or \
+                    self.y_range != curr_widget.plot_config['y_range']:
+                curr_widget.plot_config['do_hp'] = do_hp
+                curr_widget.plot_config['y_range'] = self.y_range
+                self.prefetch.set_series(self.features_settings['procedure_id'], self.all_series())
+                self.prefetch.set_current(curr_chan_lbl, curr_feat, do_hp)
+                self.reload_series(curr_chan_lbl, curr_feat)
+
+            # Fallback for writers that do not send notifications (e.g., the features process).
+            if time.monotonic() - self._last_probe_time > FEATURES_PROBE_INTERVAL:
+                self.feature_cache.mark_stale(curr_chan_lbl, curr_feat)
+                self._last_probe_time = time.monotonic()
+
+        # Push the datums prefetched since the last update to their plot widgets, visible or not.
+        #  Each widget redraws once, after all its new datums are in.
+        updated = []
+        for (chan_lbl, feat, do_hp), all_data in self.prefetch.take_deltas().items():
+            if chan_lbl not in self.stack_dict or feat not in self.stack_dict[chan_lbl]:
+                continue
+            stack_item = self.stack_dict[chan_lbl][feat]
+            widget = stack_item[0]
+            if widget is None:
+                # Not displayed since its creation or eviction; it is filled from the cache when selected.
+                continue
+            if feat == 'Raw' and widget.plot_config.get('do_hp', True) != do_hp:
+                continue
+            new_data = {k: v for k, v in all_data.items() if k > stack_item[1]}
+            if new_data:
+                if widget not in updated:
+                    widget.begin_update()
+                    updated.append(widget)
+                widget.update_plot(new_data)
+                stack_item[1] = max(new_data.keys())
+        for widget in updated:
+            widget.commit_update()
 
     def kill_processes(self):
+        self.prefetch.stop()
+        RawPlots.shutdown_pyramids()
         self.manage_depth_process(False)
         self.manage_feature_process(False)
 
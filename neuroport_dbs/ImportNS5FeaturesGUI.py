@@ -1,7 +1,6 @@
 # Imports
 from neo.rawio import BlackrockRawIO
 import os
-import sys
 import datetime
 import regex as re
 import numpy as np
@@ -9,12 +8,42 @@ from neuroport_dbs.SettingsDialog import SettingsDialog
 from qtpy.QtWidgets import QProgressDialog
 from qtpy.QtCore import Qt
 from serf.tools.db_wrap import DBWrapper
+from neuroport_dbs.dbsgui.my_models.feature_cache import notify_feature_change
+from neuroport_dbs.dbsgui.my_models.depth_timeline import DepthTimeline
+from neuroport_dbs.dbsgui.workers.db_lookup import DBLookup
+from neuroport_dbs.dbsgui.workers.db_writer import DBBatchWriter
+from neuroport_dbs.nsx_reader import NSxReader, UnsupportedFileError, read_nev_comments
 
 
 class NS5OfflinePlayback:
-    def __init__(self, sub_id, proc_id, f_name):
+    def __init__(self, sub_id, proc_id, f_name, show_progress=True, skip_depths=(), on_depth_done=None,
+                 settings=None, native_reader=True):
+        """
+        :param show_progress: show a modal progress dialog.
+        :param settings: None to complete the settings with a SettingsDialog, as in the GUI. Otherwise a dict with
+            optional 'subject', 'procedure', 'buffer' and 'features' dicts that override the defaults; the settings
+            are then completed without Qt (e.g., on a headless server).
+        :param skip_depths: depths already imported (e.g., by an interrupted batch run), as "{:.3f}" strings.
+        :param on_depth_done: callable(depth) called after each depth is saved.
+        :param native_reader: memory-map the .ns5 file (NSx 2.2/2.3) instead of reading it through neo. Files that
+            the native reader does not support are read through neo.
+        """
         self.f_name = f_name
-        self.reader = BlackrockRawIO(f_name, nsx_to_load=5)
+        self.nsx = None  # native reader
+        self.reader = None  # neo reader
+        if native_reader:
+            try:
+                self.nsx = NSxReader(f_name + '.ns5')
+            except UnsupportedFileError as e:
+                print("{}; reading with neo.".format(e))
+        if self.nsx is None:
+            self.reader = BlackrockRawIO(f_name, nsx_to_load=5)
+        self.show_progress = show_progress
+        self.skip_depths = set(skip_depths)
+        self.on_depth_done = on_depth_done
+        self.headless = settings is not None
+        self.bytes_read = 0
+        self.n_depths_done = 0
 
         self.db_wrapper = DBWrapper()
 
@@ -27,9 +56,8 @@ class NS5OfflinePlayback:
         self.prepare_depth_values()
 
         # settings
-        self.subject_settings = {'id': sub_id}
-        self.procedure_settings = {'target_name': None,
-                                   'type': 'surgical'}
+        self.subject_settings, self.procedure_settings, self.procedure_name = \
+            self.default_procedure_settings(sub_id, proc_id, settings)
         self.buffer_settings = {'sampling_rate': 30000,
                                 'buffer_length': '6.000',
                                 'sample_length': '4.000',
@@ -37,59 +65,180 @@ class NS5OfflinePlayback:
                                 'overwrite_depth': True,
                                 'run_buffer': False,
                                 'electrode_settings': {}}
-        self.procedure_name = 'Proc' + str(proc_id)
 
         for electrode in self.channels:
             self.buffer_settings['electrode_settings'][electrode] = {'threshold': True,
                                                                      'validity': 90.0}
         self.features_settings = {}
 
+        if self.headless:
+            buffer_overrides = dict(settings.get('buffer', {}))
+            validity = buffer_overrides.pop('validity', None)
+            self.buffer_settings.update(buffer_overrides)
+            if validity is not None:
+                for electrode_settings in self.buffer_settings['electrode_settings'].values():
+                    electrode_settings['validity'] = float(validity)
+            self.features_settings.update(settings.get('features', {}))
+
         # manage settings and start process
         self.manage_settings()
 
     def prepare_depth_values(self):
-        self.reader.parse_header()
-
-        # channels
-        self.channels = [x[0] for x in self.reader.header['signal_channels']]
-        self.SR = self.reader.header['signal_channels'][0][2]
-        self.rec_start_time = self.reader.raw_annotations['blocks'][0]['rec_datetime']
-
-        # comments
-        rexp = re.compile(r'[a-zA-Z]*\:?(?P<depth>\-?\d*\.\d*)')
-        for com in self.reader.nev_data['Comments'][0]:
-            # some comments aren't depth related
-            tmp_match = rexp.match(com[5].decode('utf-8'))
-            if tmp_match:
-                # older files marked depths at regular intervals and not only when it changed
-                # we need to keep only new depth values
-                d = float(tmp_match.group('depth'))
-                if len(self.depths) == 0 or d != self.depths[-1]:
-                    self.depth_times.append(com[0])
-                    self.depths.append(d)
+        if self.nsx is not None:
+            self.channels = self.nsx.channel_labels
+            self.SR = self.nsx.sampling_rate
+            self.rec_start_time = self.nsx.rec_datetime
+        else:
+            self.reader.parse_header()
 
-    def manage_settings(self):
-        win = SettingsDialog(self.subject_settings,
-                             self.procedure_settings,
-                             self.buffer_settings,
-                             self.features_settings)
+            # channels
+            self.channels = [x[0] for x in self.reader.header['signal_channels']]
+            self.SR = self.reader.header['signal_channels'][0][2]
+            self.rec_start_time = self.reader.raw_annotations['blocks'][0]['rec_datetime']
+
+        # Depth changes, read from the comments once and then kept next to the recording.
+        timeline_path = DepthTimeline.file_path(self.f_name)
+        if os.path.exists(timeline_path):
+            timeline = DepthTimeline.load(timeline_path)
+        else:
+            # older files marked depths at regular intervals and not only when it changed;
+            #  the timeline only keeps new depth values. Some comments aren't depth related.
+            timeline = DepthTimeline()
+            rexp = re.compile(r'[a-zA-Z]*\:?(?P<depth>\-?\d*\.\d*)')
+            timeline.add_comments(self.read_comments(), pattern=rexp)
+            try:
+                timeline.save(timeline_path)
+            except OSError:
+                pass  # e.g., read-only archive
+        self.depth_times = timeline.times.tolist()
+        self.depths = timeline.depths.tolist()
+
+    def read_comments(self):
+        """
+        :return: list of (timestamp, text) of the .nev comments.
+        """
+        if self.nsx is not None:
+            try:
+                return read_nev_comments(self.f_name + '.nev')
+            except (UnsupportedFileError, OSError) as e:
+                print("{}; reading comments with neo.".format(e))
+                self.reader = BlackrockRawIO(self.f_name, nsx_to_load=5)
+                self.reader.parse_header()
+        return [(com[0], com[5]) for com in self.reader.nev_data['Comments'][0]]
 
-        win.update_settings()
-        win.close()
+    def read_window(self, i_start, i_stop):
+        """
+        :return: (channels, samples) int16 window of the first segment, clipped at the end of the data.
+            Zero-copy with the native reader.
+        """
+        if self.nsx is not None:
+            return self.nsx.get_chunk(i_start, i_stop).T
+        return self.reader.get_analogsignal_chunk(i_start=i_start, i_stop=i_stop).T
 
-        sub_id = self.db_wrapper.load_or_create_subject(self.subject_settings)
+    @staticmethod
+    def default_procedure_settings(sub_id, proc_id, settings=None):
+        """
+        :param settings: dict with optional 'subject' and 'procedure' overrides.
+        :return: (subject settings, procedure settings, procedure name) before they are completed.
+        """
+        settings = settings or {}
+        subject_settings = {'id': sub_id, **settings.get('subject', {})}
+        procedure_settings = {'target_name': None, 'type': 'surgical', **settings.get('procedure', {})}
+        return subject_settings, procedure_settings, procedure_settings['target_name'] or 'Proc' + str(proc_id)
 
+    @staticmethod
+    def complete_procedure_settings(db_wrapper, subject_settings, procedure_settings):
+        """
+        Fill what the SettingsDialog would have filled, with the same defaults, without Qt.
+        :return: (subject settings, procedure settings)
+        """
+        subject_enums = db_wrapper.return_enums('subject')
+        details = db_wrapper.load_subject_details(subject_settings['id'])
+        subject_settings = {**{k: v for k, v in details.items() if v is not None}, **subject_settings}
+        subject_settings.setdefault('name', '')
+        subject_settings.setdefault('sex', subject_enums['sex'][0] if subject_enums.get('sex') else '')
+        subject_settings.setdefault('NSP_comment', '')
+        dob = subject_settings.get('birthday')
+        if isinstance(dob, str):
+            try:
+                dob = datetime.datetime.strptime(dob, '%Y-%m-%d').date()
+            except ValueError:
+                dob = None
+        subject_settings['birthday'] = dob or datetime.date.today()
+
+        proc_enums = db_wrapper.return_enums('procedure')
+        defaults = db_wrapper.load_procedure_details(-1, exclude=['subject', 'procedure_id'])
+        procedure_settings = {**defaults, **procedure_settings}
+        for key in ['type', 'recording_config', 'electrode_config', 'medication_status', 'offset_direction']:
+            if procedure_settings.get(key) in [None, ''] and proc_enums.get(key):
+                # The dialog's combo boxes default to 'none' when it is an option.
+                procedure_settings[key] = 'none' if 'none' in proc_enums[key] else proc_enums[key][0]
+        for key in ['a', 'e', 'entry', 'target']:
+            value = procedure_settings.get(key)
+            procedure_settings[key] = np.array(value if value is not None else [0., 0., 0.], dtype=float)
+        for key in ['distance_to_target', 'offset_size']:
+            procedure_settings[key] = float(procedure_settings.get(key) or 0.)
+        return subject_settings, procedure_settings
+
+    @staticmethod
+    def create_procedure(db_wrapper, subject_settings, procedure_settings, procedure_name):
+        """
+        Load or create the subject and the procedure, and add their ids to the settings.
+        :return: False if the subject could not be created.
+        """
+        sub_id = db_wrapper.load_or_create_subject(subject_settings)
         if sub_id == -1:
             print("Subject not created.")
             return False
+        subject_settings['subject_id'] = sub_id
+        procedure_settings['subject_id'] = sub_id
+        procedure_settings['target_name'] = procedure_name
+        procedure_settings['procedure_id'] = db_wrapper.load_or_create_procedure(procedure_settings)
+        # The settings dialog's cached subject and procedure lists may be out of date.
+        DBLookup.invalidate()
+        return True
+
+    @classmethod
+    def resolve_procedure(cls, db_wrapper, sub_id, proc_id, settings=None):
+        """
+        Complete, then load or create, the subject and procedure of a headless import. Batch imports resolve each
+        procedure once, before its files are imported in parallel, so that the imports do not race to create it.
+        :return: settings with the resolved 'subject' and 'procedure', or None if the subject could not be created.
+        """
+        subject_settings, procedure_settings, procedure_name = cls.default_procedure_settings(sub_id, proc_id,
+                                                                                              settings)
+        subject_settings, procedure_settings = cls.complete_procedure_settings(db_wrapper, subject_settings,
+                                                                               procedure_settings)
+        if not cls.create_procedure(db_wrapper, subject_settings, procedure_settings, procedure_name):
+            return None
+        return {**(settings or {}), 'subject': subject_settings, 'procedure': procedure_settings}
+
+    def manage_settings(self):
+        if self.headless:
+            if 'procedure_id' not in self.procedure_settings:
+                # Not resolved by the caller.
+                self.subject_settings, self.procedure_settings = self.complete_procedure_settings(
+                    self.db_wrapper, self.subject_settings, self.procedure_settings)
+                if not self.create_procedure(self.db_wrapper, self.subject_settings, self.procedure_settings,
+                                             self.procedure_name):
+                    return False
+            if 'features' not in self.features_settings:
+                self.features_settings['features'] = {cat: True for cat in self.db_wrapper.all_features.keys()}
         else:
-            self.subject_settings['subject_id'] = sub_id
-            self.procedure_settings['subject_id'] = sub_id
-            self.procedure_settings['target_name'] = self.procedure_name
-            proc_id = self.db_wrapper.load_or_create_procedure(self.procedure_settings)
+            win = SettingsDialog(self.subject_settings,
+                                 self.procedure_settings,
+                                 self.buffer_settings,
+                                 self.features_settings)
+
+            win.update_settings()
+            win.close()
 
-            self.buffer_settings['procedure_id'] = proc_id
-            self.features_settings['procedure_id'] = proc_id
+            if not self.create_procedure(self.db_wrapper, self.subject_settings, self.procedure_settings,
+                                         self.procedure_name):
+                return False
+
+        self.buffer_settings['procedure_id'] = self.procedure_settings['procedure_id']
+        self.features_settings['procedure_id'] = self.procedure_settings['procedure_id']
 
         self.process_data()
 
@@ -100,42 +249,88 @@ class NS5OfflinePlayback:
         valid_thresh = [int(x['validity'] / 100 * sample_length)
                         for x in self.buffer_settings['electrode_settings'].values()]
 
-        bar = QProgressDialog('Processing', 'Stop', 0, len(self.depths), None)
-        bar.setWindowModality(Qt.WindowModal)
-        bar.show()
+        bar = None
+        if self.show_progress:
+            bar = QProgressDialog('Processing', 'Stop', 0, len(self.depths), None)
+            bar.setWindowModality(Qt.WindowModal)
+            bar.show()
+        # Depths are written in batches on a background thread while the next ones are read.
+        writer = DBBatchWriter(self.db_wrapper)
+        try:
+            self._process_depths(writer, bar, buffer_length, sample_length, valid_thresh)
+        finally:
+            writer.close()
+            if bar is not None:
+                bar.close()
+
+    def _depth_saved(self, depth):
+        # Called by the writer once the depth is committed.
+        # Let a running FeaturesGUI know there is a new depth.
+        notify_feature_change(category='Raw')
+        self.n_depths_done += 1
+        if self.on_depth_done is not None:
+            self.on_depth_done(depth)
+
+    def _process_depths(self, writer, bar, buffer_length, sample_length, valid_thresh):
         # loop through each comment time and check whether segment is long enough
         for idx, (time, depth) in enumerate(zip(self.depth_times[:-1], self.depths[:-1])):
-            bar.setValue(idx)
-            bar.setLabelText(self.f_name + "  " + str(depth))
-            if bar.wasCanceled():
-                break
+            if bar is not None:
+                bar.setValue(idx)
+                bar.setLabelText(self.f_name + "  " + str(depth))
+                if bar.wasCanceled():
+                    break
+
+            if "{:.3f}".format(depth) in self.skip_depths:
+                continue
 
             if self.depth_times[idx + 1] - time >= sample_length:
                 # get sample first, if doesn't pass validation, move forward until it does
                 # or until buffer_length is elapsed.
-                data = self.reader.get_analogsignal_chunk(i_start=time, i_stop=time + sample_length).T
+                # All candidate windows are in one read; their validity comes from cumulative sums.
+                offsets = self.candidate_offsets(time, self.depth_times[idx + 1], sample_length, buffer_length)
+                window = self.read_window(time, time + offsets[-1] + sample_length)
+                self.bytes_read += window.nbytes
+                offsets = offsets[offsets + sample_length <= window.shape[1]]  # End of file
+                t_offset = self.first_valid_offset(self.validate_data_sample(window), offsets, sample_length,
+                                                   valid_thresh)
+                data = window[:, t_offset:t_offset + sample_length]
                 valid = self.validate_data_sample(data)
-                t_offset = 0
-                while not all(np.sum(valid, axis=1) > valid_thresh) and \
-                        t_offset + sample_length < buffer_length and \
-                        time + t_offset + sample_length < self.depth_times[idx + 1]:
-                    t_offset += 300  # roughly a 100 Hz update rate.
-                    data = self.reader.get_analogsignal_chunk(i_start=time + t_offset,
-                                                              i_stop=time + t_offset + sample_length).T
-                    valid = self.validate_data_sample(data)
 
                 # send to db
-                self.db_wrapper.save_depth_datum(depth=depth,
-                                                 data=data,
-                                                 is_good=np.sum(valid, axis=1) > valid_thresh,
-                                                 group_info=self.channels,
-                                                 start_time=self.rec_start_time +
-                                                 datetime.timedelta(seconds=(time + t_offset) / self.SR),
-                                                 stop_time=self.rec_start_time +
-                                                 datetime.timedelta(seconds=(time + t_offset +
-                                                                             sample_length) /
-                                                                    self.SR))
-        bar.close()
+                writer.submit('save_depth_datum',
+                              callback=lambda depth=depth: self._depth_saved(depth),
+                              depth=depth,
+                              data=data,
+                              is_good=np.sum(valid, axis=1) > valid_thresh,
+                              group_info=self.channels,
+                              start_time=self.rec_start_time +
+                              datetime.timedelta(seconds=(time + t_offset) / self.SR),
+                              stop_time=self.rec_start_time +
+                              datetime.timedelta(seconds=(time + t_offset + sample_length) / self.SR))
+
+    @staticmethod
+    def candidate_offsets(time, next_time, sample_length, buffer_length, step=300):
+        # Offsets of the windows that may be tried, in order. The window moves forward by step (roughly a 100 Hz
+        #  update rate) while it fits in buffer_length and starts before the next depth.
+        offsets = [0]
+        while offsets[-1] + sample_length < buffer_length and time + offsets[-1] + sample_length < next_time:
+            offsets.append(offsets[-1] + step)
+        return np.array(offsets)
+
+    @staticmethod
+    def first_valid_offset(validity, offsets, sample_length, valid_thresh):
+        """
+        :param validity: (n_channels, n_samples) bool array covering all the candidate windows.
+        :return: the first offset whose window has more than valid_thresh valid samples on every channel,
+            or the last offset if there is none.
+        """
+        n_channels = validity.shape[0]
+        cum_valid = np.concatenate((np.zeros((n_channels, 1), dtype=np.int64), np.cumsum(validity, axis=1)), axis=1)
+        n_valid = cum_valid[:, offsets + sample_length] - cum_valid[:, offsets]  # (n_channels, n_offsets)
+        is_good = np.all(n_valid > np.asarray(valid_thresh)[:, None], axis=0)
+        if offsets.size == 0:
+            return 0
+        return int(offsets[np.argmax(is_good)] if np.any(is_good) else offsets[-1])
 
     @staticmethod
     def validate_data_sample(data):
@@ -150,29 +345,5 @@ class NS5OfflinePlayback:
 
 
 if __name__ == '__main__':
-    from qtpy.QtWidgets import QApplication
-
-    qapp = QApplication(sys.argv)
-
-    # id_re = re.compile(r"(?P<Date>\d+\-\d+\-\d+)_(?P<Id>\d+)\-(?P<Proc>\d+)")
-    id_re = re.compile(r"(?P<Date>\d{4}[-_]?\d{2}[-_]?\d{2})[_-]+(?P<Id>\d+)[-_]?(?P<Proc>\d+).ns5")
-
-    base_dir = 'D:\\Sachs_Lab\\Data\\DBS'
-    files_dict = {}
-
-    for root, dirs, files in os.walk(base_dir, topdown=False):
-        ns5 = [x for x in files if x.endswith('.ns5')]
-        if ns5:
-            for n in ns5:
-                matches = id_re.match(n)
-                subject_id = matches.group('Id')
-                proc_id = matches.group('Proc')
-
-                if subject_id not in files_dict:
-                    files_dict[subject_id] = []
-                files_dict[subject_id].append([proc_id, os.path.join(root, n.replace('.ns5', ''))])
-
-    # select file
-    for sub, ns in files_dict.items():
-        for p, f in ns:
-            NS5OfflinePlayback(sub, p, f)
+    from neuroport_dbs.batch_import import main
+    main()
@@ -11,41 +11,43 @@ from qtpy.QtCore import Qt, QTimer, Signal
 import pyqtgraph as pg
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dbsgui'))
 # Note: If import dbsgui fails, then set the working directory to be this script's directory.
-from neuroport_dbs.dbsgui.my_widgets.custom import CustomGUI, CustomWidget, ConnectDialog, get_now_time
+from neuroport_dbs.dbsgui.my_widgets.custom import CustomGUI, CustomWidget, get_now_time
+from neuroport_dbs.dbsgui.my_models.depth_timeline import DepthTimeline, DepthTimelineSharedMemory
 
 # Import settings
 # TODO: Make some of these settings configurable via UI elements
 from neuroport_dbs.settings.defaults import WINDOWDIMS_RASTER, XRANGE_RASTER, YRANGE_RASTER, SIMOK, \
-                                            LABEL_FONT_POINT_SIZE, SAMPLINGRATE, SAMPLINGGROUPS, THEMES
+                                            LABEL_FONT_POINT_SIZE, THEMES
 
 
 class RasterGUI(CustomGUI):
+    # Class-level default because on_source_connected might be called during super().__init__
+    _spike_source = None
 
     def __init__(self):
         super(RasterGUI, self).__init__()
         self.setWindowTitle('RasterGUI')
 
-    def on_connection_established(self):
-        self.cbsdk_conn.cbsdk_config = {
-            'reset': True, 'get_events': True, 'get_comments': True,
-            'buffer_parameter': {
-                'comment_length': 10
-            }
-        }
-        # TODO: Or RAW, never both
-        group_info = self.cbsdk_conn.get_group_config(SAMPLINGGROUPS.index(str(SAMPLINGRATE)))
-        for gi_item in group_info:
-            gi_item['label'] = gi_item['label'].decode('utf-8')
-            gi_item['unit'] = gi_item['unit'].decode('utf-8')
-        self.plot_widget = RasterWidget(group_info)
+    def on_source_connected(self, data_source):
+        super().on_source_connected(data_source)
+        # Spike events come from the NSP or, for sources without spike events, from client-side detection.
+        self._spike_source = self.create_spike_source(keep_waveforms=False)
+        clock = self._spike_source.time if self._spike_source is not self._data_source else get_now_time
+        self.plot_widget = RasterWidget(self._data_source.data_stats, clock=clock)
         self.plot_widget.was_closed.connect(self.on_plot_closed)
+        self.setCentralWidget(self.plot_widget)
 
     def on_plot_closed(self):
-        self.plot_widget = None
-        self.cbsdk_conn.cbsdk_config = {'reset': True, 'get_events': False, 'get_comments': False}
+        self.stop_spike_detection()
+        if self.plot_widget.awaiting_close:
+            del self.plot_widget
+            self.plot_widget = None
+        if not self.plot_widget:
+            self._data_source.disconnect_requested()
 
     def do_plot_update(self):
-        ev_timestamps = self.cbsdk_conn.get_event_data()
+        self.update_spike_thresholds()
+        ev_timestamps = self._spike_source.get_event_data()
         ev_chan_ids = [x[0] for x in ev_timestamps]
         for chan_label in self.plot_widget.rasters:
             ri = self.plot_widget.rasters[chan_label]
@@ -56,15 +58,18 @@ class RasterGUI(CustomGUI):
             self.plot_widget.update(chan_label, data)
 
         # Fetching comments is slow!
-        comments = self.cbsdk_conn.get_comments()
-        if comments:
-            self.plot_widget.parse_comments(comments)
+        comments = self._data_source.get_comments()
+        self.plot_widget.parse_comments(comments)
 
 
 class RasterWidget(CustomWidget):
     frate_changed = Signal(str, float)
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, clock=get_now_time, **kwargs):
+        self.clock = clock  # Must be in the same units as the spike timestamps.
+        # Depth changes come from DDUGUI's shared timeline if it runs, otherwise from the DTT comments.
+        self.depth_timeline = DepthTimeline()
+        self.depth_timeline_mem = DepthTimelineSharedMemory()
         super(RasterWidget, self).__init__(*args, **kwargs)
         self.move(WINDOWDIMS_RASTER[0], WINDOWDIMS_RASTER[1])
         self.resize(WINDOWDIMS_RASTER[2], WINDOWDIMS_RASTER[3])
@@ -83,10 +88,10 @@ class RasterWidget(CustomWidget):
         # glw.useOpenGL(True)
         self.layout().addWidget(glw)
         self.rasters = {}  # Will contain one dictionary for each line/channel label.
-        for chan_ix in range(len(self.group_info)):
-            self.add_series(self.group_info[chan_ix])
+        for chan_state in self.chan_states:
+            self.add_series(chan_state)
 
-    def add_series(self, chan_info):
+    def add_series(self, chan_state):
         glw = self.findChild(pg.GraphicsLayoutWidget)
         new_plot = glw.addPlot(row=len(self.rasters), col=0)
         # Appearance settings
@@ -101,7 +106,7 @@ class RasterWidget(CustomWidget):
             new_plot.addItem(pci)
             pcis.append(pci)
         # Create text for displaying firing rate. Placeholder text is channel label.
-        frate_annotation = pg.TextItem(text=chan_info['label'],
+        frate_annotation = pg.TextItem(text=chan_state['name'],
                                        color=(255, 255, 255))
         frate_annotation.setPos(0, self.plot_config['y_range'])
         my_font = QFont()
@@ -109,12 +114,12 @@ class RasterWidget(CustomWidget):
         frate_annotation.setFont(my_font)
         new_plot.addItem(frate_annotation)
         # Store information
-        self.rasters[chan_info['label']] = {
+        self.rasters[chan_state['name']] = {
             'plot': new_plot,
             'old': pcis[0],
             'latest': pcis[1],
             'line_ix': len(self.rasters),
-            'chan_id': chan_info['chan'],
+            'chan_id': chan_state['src'],
             'frate_item': frate_annotation
         }
         self.clear()
@@ -129,7 +134,7 @@ class RasterWidget(CustomWidget):
             plot.hideAxis('left')
 
     def clear(self):
-        start_time = int(get_now_time())
+        start_time = int(self.clock())
         for key in self.rasters:
             rs = self.rasters[key]
             rs['old'].clear()
@@ -149,17 +154,13 @@ class RasterWidget(CustomWidget):
         self.frate_changed.emit(rs_key, new_frate)
 
     def parse_comments(self, comments):
-        # comments is a list of lists: [[timestamp, string, rgba],]
-        comment_strings = [x[1].decode('utf8') for x in comments]
-        dtts = []
-        for comm_str in comment_strings:
-            if 'DTT:' in comm_str:
-                dtts.append(float(comm_str[4:]))
-        if len(dtts) > 0:
-            new_dtt = dtts[-1]
-            if not self.DTT or self.DTT != new_dtt:
-                self.clear()
-                self.DTT = new_dtt
+        # comments is a list of lists: [[timestamp, string, rgba],], or None
+        changed = self.depth_timeline_mem.read_into(self.depth_timeline)
+        if changed is None:
+            changed = self.depth_timeline.add_comments(comments or [])
+        if changed:
+            self.clear()
+            self.DTT = self.depth_timeline.latest_depth
 
     def update(self, line_label, data):
         """
@@ -171,7 +172,7 @@ class RasterWidget(CustomWidget):
         rs = self.rasters[line_label]  # A dictionary of info unique to each channel
         
         # Calculate timestamp of last sample in bottom row
-        now_time = int(get_now_time())
+        now_time = int(self.clock())
         new_r0_tmin = now_time - (now_time % self.x_lim)
 
         # Process data
@@ -5,19 +5,23 @@ from qtpy.QtWidgets import QComboBox, QLineEdit, QLabel, QDialog, QVBoxLayout, Q
                            QCheckBox, QTabWidget, QTextEdit
 from qtpy.QtCore import QDate, QRegExp, Qt, Signal
 from qtpy.QtGui import QRegExpValidator
-from serf.tools.db_wrap import DBWrapper
+from neuroport_dbs.dbsgui.workers.db_lookup import DBLookup
 
 # Settings
-from neuroport_dbs.settings.defaults import BUFFERLENGTH, SAMPLELENGTH, DELAYBUFFER, OVERWRITEDEPTH
+from neuroport_dbs.settings.defaults import BUFFERLENGTH, SAMPLELENGTH, DELAYBUFFER, OVERWRITEDEPTH, DB_LOOKUP_TIMEOUT
 
 
 class SubjectWidget(QWidget):
     subject_change = Signal(int)
 
-    def __init__(self, subject_settings):
+    def __init__(self, subject_settings, db_lookup):
         super(SubjectWidget, self).__init__()
 
-        self.subject_enums = DBWrapper().return_enums('subject')
+        # Lookups that are not cached yet fill the widgets when they arrive (on_db_loaded).
+        self.db_lookup = db_lookup
+        self.db_lookup.loaded.connect(self.on_db_loaded)
+        self._requested = None  # (subject id, list of callables) of the details being loaded
+        self.subject_enums = self.db_lookup.get('return_enums', 'subject') or {}
 
         subject_layout = QGridLayout(self)
         subject_layout.setColumnMinimumWidth(2, 60)
@@ -26,7 +30,7 @@ class SubjectWidget(QWidget):
         self.id_combo = QComboBox()
         self.id_combo.setEditable(True)
         self.id_combo.addItem('')
-        self.id_combo.addItems(DBWrapper().list_all_subjects())
+        self.id_combo.addItems(self.db_lookup.get('list_all_subjects') or [])
         self.id_combo.currentIndexChanged.connect(self.load_subject)
         self.id_combo.lineEdit().editingFinished.connect(self.check_subject)
 
@@ -55,7 +59,7 @@ class SubjectWidget(QWidget):
         # Subject Settings
         self.subject_settings = subject_settings
         if not self.subject_settings:
-            self.update_settings_from_db(-1)
+            self.update_settings_from_db(-1, self.update_subject)
 
         self.update_subject()
 
@@ -70,25 +74,59 @@ class SubjectWidget(QWidget):
         else:
             self.dob_calendar.setSelectedDate(QDate.currentDate())
 
-    def update_settings_from_db(self, idx):
-        for key, value in DBWrapper().load_subject_details(idx).items():
+    def update_settings_from_db(self, idx, on_loaded=None):
+        # Copies the details of subject idx into the settings, then calls on_loaded. Later if they are not cached.
+        if self._requested is None or self._requested[0] != idx:
+            self._requested = (idx, [])
+        if on_loaded is not None:
+            self._requested[1].append(on_loaded)
+        details = self.db_lookup.get('load_subject_details', idx)
+        if details is not None:
+            self.apply_subject_details(idx, details)
+
+    def apply_subject_details(self, idx, details):
+        if self._requested is None or self._requested[0] != idx:
+            return  # Superseded by another subject.
+        callbacks = self._requested[1]
+        self._requested = None
+        for key, value in details.items():
             self.subject_settings[key] = value
+        for on_loaded in callbacks:
+            on_loaded()
+
+    def on_db_loaded(self, key, result):
+        name, args = key[0], key[1]
+        if name == 'return_enums' and args == ('subject',):
+            self.subject_enums = result
+            self.sex_combo.clear()
+            self.sex_combo.addItems(self.subject_enums['sex'] if 'sex' in self.subject_enums.keys() else [])
+            if self.read_dict_value(self.subject_settings, 'sex') != '':
+                self.sex_combo.setCurrentText(self.read_dict_value(self.subject_settings, 'sex'))
+        elif name == 'list_all_subjects':
+            curr_id = self.id_combo.currentText()
+            self.id_combo.blockSignals(True)
+            self.id_combo.clear()
+            self.id_combo.addItem('')
+            self.id_combo.addItems(result)
+            self.id_combo.setCurrentText(curr_id)
+            self.id_combo.blockSignals(False)
+        elif name == 'load_subject_details':
+            self.apply_subject_details(args[0], result)
 
     def load_subject(self):
         # id is a unique and mandatory field
-        self.check_subject()
-        self.update_subject()
+        self.check_subject(update_widgets=True)
 
-    def check_subject(self):
+    def check_subject(self, update_widgets=False):
         # when changing the id in the combobox, can be modifying or entering an existing subject id. Check to load data
         # if so.
         curr_id = self.id_combo.currentText()
-        if curr_id != '':
-            self.update_settings_from_db(curr_id)
-            self.subject_change.emit(self.subject_settings['subject_id'])
-        else:
-            self.update_settings_from_db(-1)
-            self.subject_change.emit(-1)
+
+        def on_loaded():
+            self.subject_change.emit(self.subject_settings['subject_id'] if curr_id != '' else -1)
+            if update_widgets:
+                self.update_subject()
+        self.update_settings_from_db(curr_id if curr_id != '' else -1, on_loaded)
 
     @staticmethod
     def read_dict_value(dictionary, value):
@@ -103,24 +141,28 @@ class SubjectWidget(QWidget):
 
 
 class ProcedureWidget(QWidget):
-    def __init__(self, procedure_settings):
+    def __init__(self, procedure_settings, db_lookup):
         super(ProcedureWidget, self).__init__()
 
+        # Lookups that are not cached yet fill the widgets when they arrive (on_db_loaded).
+        self.db_lookup = db_lookup
+        self.db_lookup.loaded.connect(self.on_db_loaded)
+        self._requested_procedure = None  # procedure id of the details being loaded
+        self._requested_subject = None  # (subject id, block signals) of the procedures being listed
+
         # Settings
         self.procedure_settings = procedure_settings
 
-        # populate with defaults if empty
-        if not self.procedure_settings:
-            self.update_settings_from_db(-1)
-
-        self.proc_enums = DBWrapper().return_enums('procedure')
+        self.proc_enums = self.db_lookup.get('return_enums', 'procedure') or {}
+        self.enum_combos = {}
+        self.all_procedures = []
         proc_layout = QGridLayout(self)
 
         row = 0
         proc_layout.addWidget(QLabel("Previous procedures: "), row, 0, 1, 1)
         self.prev_proc = QComboBox()
         self.prev_proc.setEnabled(True)
-        self.check_all_procedures(None, False)
+        self.check_all_procedures(None, True)
         self.prev_proc.currentIndexChanged.connect(self.procedure_selection_change)
         proc_layout.addWidget(self.prev_proc, row, 1, 1, 3)
 
@@ -207,11 +249,41 @@ class ProcedureWidget(QWidget):
         row += 1
         proc_layout.addWidget(QWidget(), row, 1, 1, 3)
 
+        # populate with defaults if empty
+        if not self.procedure_settings:
+            self.update_settings_from_db(-1)
+
         self.update_procedure()
 
+    def on_db_loaded(self, key, result):
+        name, args = key[0], key[1]
+        if name == 'return_enums' and args == ('procedure',):
+            self.proc_enums = result
+            for enum_name, combo in self.enum_combos.items():
+                combo.clear()
+                combo.addItems(self.proc_enums[enum_name] if enum_name in self.proc_enums.keys() else [])
+                combo.setCurrentText('none')
+                if self.read_dict_value(enum_name) not in [None, '']:
+                    combo.setCurrentText(str(self.read_dict_value(enum_name)))
+        elif name == 'list_all_procedures':
+            self.fill_procedures(args[0], result)
+        elif name == 'load_procedure_details':
+            self.apply_procedure_details(args[0], result)
+
     def check_all_procedures(self, subject_id, block):
+        # Fills the previous procedures of subject_id; later if they are not cached.
+        self._requested_subject = (subject_id, block)
+        procedures = self.db_lookup.get('list_all_procedures', subject_id)
+        if procedures is not None:
+            self.fill_procedures(subject_id, procedures)
+
+    def fill_procedures(self, subject_id, procedures):
+        if self._requested_subject is None or self._requested_subject[0] != subject_id:
+            return  # Superseded by another subject.
+        block = self._requested_subject[1]
+        self._requested_subject = None
         self.prev_proc.blockSignals(block)
-        self.all_procedures = DBWrapper().list_all_procedures(subject_id)
+        self.all_procedures = procedures
         self.prev_proc.clear()
         self.prev_proc.addItem('')
         self.prev_proc.addItems(
@@ -223,6 +295,7 @@ class ProcedureWidget(QWidget):
         combo = QComboBox()
         combo.addItems(self.proc_enums[enum_name] if enum_name in self.proc_enums.keys() else [])
         combo.setCurrentText('none')
+        self.enum_combos[enum_name] = combo
         return combo
 
     def coord_line_edit(self):
@@ -255,10 +328,20 @@ class ProcedureWidget(QWidget):
                 self.all_procedures[self.prev_proc.currentIndex()-1].procedure_id)
         else:
             self.update_settings_from_db(-1)
-        self.update_procedure()
 
     def update_settings_from_db(self, idx):
-        self.procedure_settings.update(DBWrapper().load_procedure_details(idx, exclude=['subject', 'procedure_id']))
+        # Copies the details of procedure idx into the settings and the widgets. Later if they are not cached.
+        self._requested_procedure = idx
+        details = self.db_lookup.get('load_procedure_details', idx, exclude=['subject', 'procedure_id'])
+        if details is not None:
+            self.apply_procedure_details(idx, details)
+
+    def apply_procedure_details(self, idx, details):
+        if self._requested_procedure != idx:
+            return  # Superseded by another procedure.
+        self._requested_procedure = None
+        self.procedure_settings.update(details)
+        self.update_procedure()
 
     def update_procedure(self):
         self.target_name.setText(self.read_dict_value('target_name'))
@@ -395,35 +478,51 @@ class BufferWidget(QWidget):
 
 
 class FeaturesWidget(QWidget):
-    def __init__(self, features_settings):
+    def __init__(self, features_settings, db_lookup):
         super(FeaturesWidget, self).__init__()
 
-        # Settings
-        self.feature_categories = DBWrapper().all_features.keys()
-        self.features_settings = features_settings
-        if not self.features_settings:
-            self.features_settings['features'] = {}
-
-            # Check if default values are defined
-            for cat in self.feature_categories:
-                # defaults to true, compute all features
-                self.features_settings['features'][cat] = True
-
+        self.db_lookup = db_lookup
+        self.db_lookup.loaded.connect(self.on_db_loaded)
         self.features_widgets = {}
 
-        features_layout = QGridLayout(self)
+        self.features_layout = QGridLayout(self)
 
         # Add an option to toggle all features
         self.all_features = QCheckBox('All')
         self.all_features.setChecked(False)
         self.all_features.clicked.connect(self.toggle_all)
-        features_layout.addWidget(self.all_features, 0, 0, 1, 1)
-        if 'features' in self.features_settings.keys():
-            for idx, (label, sett) in enumerate(self.features_settings['features'].items()):
-                self.features_widgets[label] = QCheckBox(label)
-                self.features_widgets[label].setChecked(sett)
-                self.features_widgets[label].clicked.connect(self.toggle)
-                features_layout.addWidget(self.features_widgets[label], idx+1, 0, 1, 1)
+        self.features_layout.addWidget(self.all_features, 0, 0, 1, 1)
+
+        # Settings
+        self.features_settings = features_settings
+        self._awaiting_categories = not self.features_settings
+        if not self.features_settings:
+            self.features_settings['features'] = {}
+
+            # Check if default values are defined; the categories are added when loaded if they are not cached.
+            all_features = self.db_lookup.get('all_features')
+            if all_features is not None:
+                self.set_categories(all_features.keys())
+        elif 'features' in self.features_settings.keys():
+            self.add_feature_widgets()
+
+    def on_db_loaded(self, key, result):
+        if key[0] == 'all_features' and self._awaiting_categories:
+            self.set_categories(result.keys())
+
+    def set_categories(self, feature_categories):
+        self._awaiting_categories = False
+        for cat in feature_categories:
+            # defaults to true, compute all features
+            self.features_settings['features'][cat] = True
+        self.add_feature_widgets()
+
+    def add_feature_widgets(self):
+        for idx, (label, sett) in enumerate(self.features_settings['features'].items()):
+            self.features_widgets[label] = QCheckBox(label)
+            self.features_widgets[label].setChecked(sett)
+            self.features_widgets[label].clicked.connect(self.toggle)
+            self.features_layout.addWidget(self.features_widgets[label], idx+1, 0, 1, 1)
 
     def toggle_all(self):
         for label, sett in self.features_widgets.items():
@@ -452,17 +551,20 @@ class SettingsDialog(QDialog):
         # Widgets to show/edit parameters.
         self.settings_layout = QVBoxLayout(self)
 
+        # Database lookups run in the background and are cached across dialogs.
+        self.db_lookup = DBLookup(self)
+
         tab_widget = QTabWidget(self)
-        self.subject_widget = SubjectWidget(self.subject_settings)
+        self.subject_widget = SubjectWidget(self.subject_settings, self.db_lookup)
         tab_widget.addTab(self.subject_widget, 'Subject')
 
-        self.proc_widget = ProcedureWidget(self.procedure_settings)
+        self.proc_widget = ProcedureWidget(self.procedure_settings, self.db_lookup)
         tab_widget.addTab(self.proc_widget, 'Procedure')
 
         self.buff_widget = BufferWidget(self.buffer_settings)
         tab_widget.addTab(self.buff_widget, 'Buffer')
 
-        self.feat_widget = FeaturesWidget(self.features_settings)
+        self.feat_widget = FeaturesWidget(self.features_settings, self.db_lookup)
         tab_widget.addTab(self.feat_widget, 'Features')
 
         self.settings_layout.addWidget(tab_widget)
@@ -484,6 +586,11 @@ class SettingsDialog(QDialog):
         self.settings_layout.addWidget(buttons, alignment=Qt.AlignHCenter)
 
     def update_settings(self):
+        # Lookups that are still loading (e.g., when the dialog is accepted right away) are waited for once, and their
+        #  results are applied here instead of by the event loop.
+        for key, result in self.db_lookup.wait(DB_LOOKUP_TIMEOUT).items():
+            for widget in [self.subject_widget, self.proc_widget, self.feat_widget]:
+                widget.on_db_loaded(key, result)
         self.subject_widget.to_dict()
         self.proc_widget.to_dict()
         self.buff_widget.to_dict()
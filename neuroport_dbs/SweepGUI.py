@@ -11,11 +11,12 @@ sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'db
 # Note: If import dbsgui fails, then set the working directory to be this script's directory.
 from neuroport_dbs.settings.defaults import THEMES
 from neuroport_dbs.dbsgui.my_widgets.custom import CustomWidget, get_now_time, CustomGUI
+from neuroport_dbs.dbsgui.my_models.shared_thresholds import ThresholdSharedMemory
 
 # Import settings
 # TODO: Make some of these settings configurable via UI elements
 from neuroport_dbs.settings.defaults import WINDOWDIMS_SWEEP, WINDOWDIMS_LFP, NPLOTSEGMENTS, XRANGE_SWEEP, uVRANGE, \
-                                            FILTERCONFIG, DSFAC
+                                            FILTERCONFIG, DSFAC, UNIT_SCALING
 
 
 class SweepGUI(CustomGUI):
@@ -96,7 +97,7 @@ class SweepGUI(CustomGUI):
 
 
 class SweepWidget(CustomWidget):
-    UNIT_SCALING = 0.25  # Data are 16-bit integers from -8192 uV to +8192 uV. We want plot scales in uV.
+    UNIT_SCALING = UNIT_SCALING  # Data are 16-bit integers from -8192 uV to +8192 uV. We want plot scales in uV.
 
     def __init__(self, *args, **kwargs):
         self._monitor_group = None  # QtWidgets.QButtonGroup(parent=self)
@@ -105,6 +106,8 @@ class SweepWidget(CustomWidget):
         # add a shared memory object to track the currently monitored channel
         #  - Used by features/depth
         self.monitored_shared_mem = QtCore.QSharedMemory()
+        # Threshold lines are shared with the client-side spike detection of Raster and Waveform GUIs.
+        self.threshold_shared_mem = ThresholdSharedMemory(owner=True)
 
         super(SweepWidget, self).__init__(*args, **kwargs)
         self.refresh_axes()  # Even though super __init__ calls this, extra refresh is intentional
@@ -257,7 +260,8 @@ class SweepWidget(CustomWidget):
                 cbsdkconn = CbSdkConnection()
                 if cbsdkconn.is_connected:
                     cbsdkconn.set_channel_info(ss_info['chan_id'], {'spkthrlevel': new_thresh})
-                # TODO: shared mem?
+                ss_info['thresh_set'] = True
+        self.update_threshold_memory()
         # TODO: If (new required) option is set, also set the other lines.
 
     def update_config(self, config):
@@ -357,6 +361,19 @@ class SweepWidget(CustomWidget):
             gain = chan_state['gain'] if 'gain' in chan_state else self.UNIT_SCALING
             if 'spkthrlevel' in chan_state:
                 ss_info['thresh_line'].setValue(chan_state['spkthrlevel'] * gain)
+                ss_info['thresh_set'] = True
+        self.update_threshold_memory()
+
+    def update_threshold_memory(self):
+        # In data-source channel order. NaN for lines never set, so the detector estimates its own threshold.
+        thresholds = []
+        for chan_state in self.chan_states:
+            ss_info = self.segmented_series.get(chan_state['name'])
+            if ss_info is not None and ss_info.get('thresh_set', False):
+                thresholds.append(ss_info['thresh_line'].value())
+            else:
+                thresholds.append(np.nan)
+        self.threshold_shared_mem.write(thresholds)
 
     def reset_audio(self):
         if self.pya_stream:
@@ -3,62 +3,101 @@ chadwick.boulay@gmail.com
 """
 import sys
 import os
+import threading
 import numpy as np
+from matplotlib import cm
 import qtpy.QtCore
-from qtpy.QtGui import QColor
-from qtpy.QtWidgets import QPushButton, QLineEdit, QHBoxLayout, QLabel
+from qtpy.QtCore import QRectF, Signal
+from qtpy.QtGui import QColor, QFont
+from qtpy.QtWidgets import QPushButton, QLineEdit, QHBoxLayout, QLabel, QComboBox
 import pyqtgraph as pg
 
 # Import settings
 # TODO: Make some of these settings configurable via UI elements
 from neuroport_dbs.settings.defaults import WINDOWDIMS_WAVEFORMS, XRANGE_WAVEFORMS, uVRANGE, NWAVEFORMS, SIMOK, \
-                                            WF_COLORS, SAMPLINGGROUPS, SAMPLINGRATE, THEMES
+                                            WF_COLORS, THEMES, WF_DENSITY_NBINS, WF_DENSITY_HALFLIFE, \
+                                            ISOLATION_NWAVEFORMS, ISOLATION_NPCS, \
+                                            ISOLATION_INTERVAL, REFRACTORYPERIOD, UNIT_SCALING
 
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dbsgui'))
 # Note: If import dbsgui fails, then set the working directory to be this script's directory.
-from neuroport_dbs.dbsgui.my_widgets.custom import CustomGUI, CustomWidget, ConnectDialog
+from neuroport_dbs.dbsgui.my_widgets.custom import CustomGUI, CustomWidget
+from neuroport_dbs.dbsgui.my_models.waveform_store import WaveformStore, WaveformDensity
+from neuroport_dbs.dbsgui.workers import WaveformAcquisition, UnitIsolationWorker
+from neuroport_dbs.dbsgui.my_models.depth_timeline import DepthTimeline, DepthTimelineSharedMemory
 
 
 class WaveformGUI(CustomGUI):
+    # Class-level defaults because on_source_connected might be called during super().__init__
+    _wf_worker = None
+    _isolation_worker = None
 
     def __init__(self):
         super(WaveformGUI, self).__init__()
         self.setWindowTitle('WaveformGUI')
 
-    def on_connection_established(self):
-        self.cbsdk_conn.cbsdk_config = {
-            'reset': True, 'get_events': False, 'get_comments': True,
-            'buffer_parameter': {
-                'comment_length': 10
-            }
-        }
-        group_info = self.cbsdk_conn.get_group_config(SAMPLINGGROUPS.index(str(SAMPLINGRATE)))
-        for gi_item in group_info:
-            gi_item['label'] = gi_item['label'].decode('utf-8')
-            gi_item['unit'] = gi_item['unit'].decode('utf-8')
-        self.plot_widget = WaveformWidget(group_info)
+    def on_source_connected(self, data_source):
+        super().on_source_connected(data_source)
+        src_dict = self._data_source.data_stats
+        self.plot_widget = WaveformWidget(src_dict)
         self.plot_widget.was_closed.connect(self.on_plot_closed)
-        self.wf_config = self.cbsdk_conn.get_sys_config()  # {'spklength': 48, 'spkpretrig': 10, 'sysfreq': 30000}
+        self.setCentralWidget(self.plot_widget)
+
+        # Unit isolation metrics are computed from the same waveform stream on their own thread.
+        self._isolation_worker = UnitIsolationWorker(src_dict['channel_names'], src_dict['srate'],
+                                                     interval=ISOLATION_INTERVAL, n_wfs=ISOLATION_NWAVEFORMS,
+                                                     n_components=ISOLATION_NPCS, refractory=REFRACTORYPERIOD)
+        self.plot_widget.was_cleared.connect(self._isolation_worker.clear)
+        self._isolation_worker.start()
+
+        # Waveforms come from the NSP or, for sources without spike events, from client-side detection.
+        #  The spike timestamps are only used for the ISI violations of the isolation metrics.
+        spike_source = self.create_spike_source()
+
+        # Fetch the waveforms, spike timestamps and comments of all channels on a background thread.
+        #  The worker copies new waveforms straight into the widget's per-unit stores.
+        self._wf_worker = WaveformAcquisition(spike_source.get_waveforms,
+                                              {_['name']: _['src'] for _ in src_dict['chan_states']},
+                                              self.plot_widget.ingest,
+                                              fetch_comments=self._data_source.get_comments,
+                                              fetch_events=spike_source.get_event_data,
+                                              consumers=[self._isolation_worker.submit])
+        self._wf_worker.start()
 
     def on_plot_closed(self):
-        self.plot_widget = None
-        self.cbsdk_conn.cbsdk_config = {'reset': True, 'get_events': False, 'get_comments': False}
+        if self._wf_worker is not None:
+            self._wf_worker.stop()
+            self._wf_worker = None
+        if self._isolation_worker is not None:
+            self._isolation_worker.stop()
+            self._isolation_worker = None
+        self.stop_spike_detection()
+        if self.plot_widget.awaiting_close:
+            del self.plot_widget
+            self.plot_widget = None
+        if not self.plot_widget:
+            self._data_source.disconnect_requested()
 
     def do_plot_update(self):
-        for label in self.plot_widget.wf_info:
-            this_info = self.plot_widget.wf_info[label]
-            temp_wfs, unit_ids = self.cbsdk_conn.get_waveforms(this_info['chan_id'])
-            self.plot_widget.update(label, [temp_wfs, unit_ids])
+        self.update_spike_thresholds()
+        # Only draw what changed since the last frame; the fetching happened on the worker thread.
+        self.plot_widget.draw_batch(self._wf_worker.take_batch())
+        for line_label, unit_metrics in self._isolation_worker.take_metrics().items():
+            self.plot_widget.show_isolation(line_label, unit_metrics)
 
-        # Fetching comments is SLOW!
-        comments = self.cbsdk_conn.get_comments()
-        if comments:
-            self.plot_widget.parse_comments(comments)
+        comments = self._wf_worker.take_comments()
+        self.plot_widget.parse_comments(comments)
 
 
 class WaveformWidget(CustomWidget):
+    was_cleared = Signal()
+    UNIT_SCALING = UNIT_SCALING  # Data are 16-bit integers from -8192 uV to +8192 uV. We want plot scales in uV.
 
     def __init__(self, *args, **kwargs):
+        self._tiled_x = {'key': None, 'x': None}
+        # Depth changes come from DDUGUI's shared timeline if it runs, otherwise from the DTT comments.
+        self.depth_timeline = DepthTimeline()
+        self.depth_timeline_mem = DepthTimelineSharedMemory()
         super(WaveformWidget, self).__init__(*args, **kwargs)
         # super calls self.create_control_panel(), self.create_plots(**kwargs), self.refresh_axes()
         self.move(WINDOWDIMS_WAVEFORMS[0], WINDOWDIMS_WAVEFORMS[1])
@@ -86,6 +125,14 @@ class WaveformWidget(CustomWidget):
         cntrl_layout.addWidget(self.n_spikes_edit)
         cntrl_layout.addStretch()
 
+        # Display mode: overlay of the last N Spikes, or decaying density of all spikes.
+        cntrl_layout.addWidget(QLabel("Mode "))
+        self.mode_combo = QComboBox()
+        self.mode_combo.addItems(['Overlay', 'Density'])
+        self.mode_combo.currentTextChanged.connect(self.on_mode_combo_changed)
+        cntrl_layout.addWidget(self.mode_combo)
+        cntrl_layout.addStretch()
+
         # Clear button
         clear_button = QPushButton("Clear")
         clear_button.clicked.connect(self.clear)
@@ -101,17 +148,22 @@ class WaveformWidget(CustomWidget):
             'y_range': uVRANGE,
             'theme': theme,
             'color_iterator': -1,
-            'n_wfs': NWAVEFORMS
+            'n_wfs': NWAVEFORMS,
+            'display_mode': 'Overlay'
         }
+        # Lookup table for the density images
+        colormap = cm.get_cmap("inferno")
+        colormap._init()
+        self.density_lut = (colormap._lut * 255).view(np.ndarray)  # Convert matplotlib colormap from 0-1 to 0-255
         # Create and add GraphicsLayoutWidget
         glw = pg.GraphicsLayoutWidget(parent=self)
         # self.glw.useOpenGL(True)
         self.layout().addWidget(glw)
         self.wf_info = {}  # Will contain one dictionary for each line/channel label.
-        for chan_ix in range(len(self.group_info)):
-            self.add_series(self.group_info[chan_ix])
+        for chan_state in self.chan_states:
+            self.add_series(chan_state)
 
-    def add_series(self, chan_info):
+    def add_series(self, chan_state):
         glw = self.findChild(pg.GraphicsLayoutWidget)
         new_plot = glw.addPlot(row=len(self.wf_info), col=0)
 
@@ -120,10 +172,40 @@ class WaveformWidget(CustomWidget):
         # self.plot_config['color_iterator'] = (self.plot_config['color_iterator'] + 1) % len(my_theme['pencolors'])
         # pen_color = QColor(my_theme['pencolors'][self.plot_config['color_iterator']])
 
-        self.wf_info[chan_info['label']] = {
+        # One curve per sorted unit. Each curve draws all of the unit's waveforms in a single call
+        #  using a `connect` array that breaks the line between waveforms.
+        unit_curves = []
+        for unit_color in WF_COLORS:
+            c = pg.PlotCurveItem()
+            c.setPen(QColor(unit_color))
+            new_plot.addItem(c)
+            unit_curves.append(c)
+
+        # Image for the density display mode. Hidden in overlay mode.
+        density_img = pg.ImageItem()
+        density_img.setLookupTable(self.density_lut)
+        density_img.setVisible(self.plot_config['display_mode'] == 'Density')
+        new_plot.addItem(density_img)
+
+        # Text for the unit isolation readout.
+        isolation_text = pg.TextItem(text='', color=(255, 255, 255))
+        isolation_text.setPos(self.plot_config['x_range'][0], self.plot_config['y_range'])
+        my_font = QFont()
+        my_font.setPointSize(8)
+        isolation_text.setFont(my_font)
+        new_plot.addItem(isolation_text)
+
+        self.wf_info[chan_state['name']] = {
             'plot': new_plot,
             'line_ix': len(self.wf_info),
-            'chan_id': chan_info['chan']
+            'chan_id': chan_state['src'],
+            'lock': threading.Lock(),  # The stores are filled from the acquisition thread.
+            'curves': unit_curves,
+            'store': WaveformStore(len(WF_COLORS), self.plot_config['n_wfs']),
+            'density': WaveformDensity(self.plot_config['y_range'], n_bins=WF_DENSITY_NBINS,
+                                       half_life=WF_DENSITY_HALFLIFE),
+            'density_img': density_img,
+            'isolation_text': isolation_text
         }
 
     def refresh_axes(self):
@@ -133,10 +215,21 @@ class WaveformWidget(CustomWidget):
             plot.setYRange(-self.plot_config['y_range'], self.plot_config['y_range'])
             plot.hideAxis('bottom')
             plot.hideAxis('left')
+            self.wf_info[wf_key]['isolation_text'].setPos(self.plot_config['x_range'][0], self.plot_config['y_range'])
+            with self.wf_info[wf_key]['lock']:
+                self.wf_info[wf_key]['density'].set_range(self.plot_config['y_range'])
+            self.wf_info[wf_key]['density_img'].clear()
 
     def clear(self):
         for line_label in self.wf_info:
-            self.wf_info[line_label]['plot'].clear()
+            with self.wf_info[line_label]['lock']:
+                self.wf_info[line_label]['store'].clear()
+                self.wf_info[line_label]['density'].clear()
+            for c in self.wf_info[line_label]['curves']:
+                c.clear()
+            self.wf_info[line_label]['density_img'].clear()
+            self.wf_info[line_label]['isolation_text'].setText('')
+        self.was_cleared.emit()
 
     def on_range_edit_editingFinished(self):
         self.plot_config['y_range'] = float(self.range_edit.text())
@@ -144,41 +237,116 @@ class WaveformWidget(CustomWidget):
 
     def on_n_spikes_edit_editingFinished(self):
         self.plot_config['n_wfs'] = int(self.n_spikes_edit.text())
+        for line_label in self.wf_info:
+            with self.wf_info[line_label]['lock']:
+                self.wf_info[line_label]['store'].resize(n_wfs=self.plot_config['n_wfs'])
+        self.clear()
         self.refresh_axes()
 
+    def on_mode_combo_changed(self, mode):
+        self.plot_config['display_mode'] = mode
+        for line_label in self.wf_info:
+            wf_info = self.wf_info[line_label]
+            for c in wf_info['curves']:
+                c.setVisible(mode == 'Overlay')
+            wf_info['density_img'].setVisible(mode == 'Density')
+            # Both representations are always kept up to date, so only need to redraw the visible one.
+            if mode == 'Density':
+                self.draw_density(line_label)
+            else:
+                for unit_ix in range(len(wf_info['curves'])):
+                    self.draw_unit(line_label, unit_ix)
+
+    def show_isolation(self, line_label, unit_metrics):
+        # unit_metrics is {unit_ix: {'n', 'snr', 'l_ratio', 'isi_violations'}} from UnitIsolation.metrics()
+        lines = []
+        for unit_ix in sorted(unit_metrics):
+            m = unit_metrics[unit_ix]
+            line = "u{}: SNR {:.1f}".format(unit_ix, m['snr'])
+            if m['l_ratio'] is not None:
+                line += "  L {:.2g}".format(m['l_ratio'])
+            if m['isi_violations'] is not None:
+                line += "  ISI {:.1f}%".format(100 * m['isi_violations'])
+            lines.append(line)
+        self.wf_info[line_label]['isolation_text'].setText("\n".join(lines))
+
     def parse_comments(self, comments):
-        # comments is a list of lists: [[timestamp, string, rgba],]
-        comment_strings = [x[1].decode('utf8') for x in comments]
-        dtts = []
-        for comm_str in comment_strings:
-            if 'DTT:' in comm_str:
-                dtts.append(float(comm_str[4:]))
-        if len(dtts) > 0:
-            new_dtt = dtts[-1]
-            if not self.DTT or self.DTT != new_dtt:
-                self.clear()
-                self.DTT = new_dtt
+        # comments is a list of lists: [[timestamp, string, rgba],], or None
+        changed = self.depth_timeline_mem.read_into(self.depth_timeline)
+        if changed is None:
+            changed = self.depth_timeline.add_comments(comments or [])
+        if changed:
+            self.clear()
+            self.DTT = self.depth_timeline.latest_depth
+
+    def get_tiled_x(self, spk_length, n_wfs):
+        # x-values for n_wfs back-to-back waveforms, shared by all curves.
+        key = (spk_length, n_wfs)
+        if self._tiled_x['key'] != key:
+            x = (1000000 / self.samplingRate) * np.arange(spk_length) + self.plot_config['x_range'][0]
+            self._tiled_x = {'key': key, 'x': np.tile(x, n_wfs)}
+        return self._tiled_x['x']
+
+    def draw_unit(self, line_label, unit_ix):
+        store = self.wf_info[line_label]['store']
+        with self.wf_info[line_label]['lock']:
+            # Copy because the acquisition thread keeps writing into the store.
+            y = store.unit_waveforms(unit_ix).ravel().copy()
+            connect = store.connect[:y.size]
+            x = self.get_tiled_x(store.spk_length, store.n_wfs)[:y.size]
+        self.wf_info[line_label]['curves'][unit_ix].setData(x=x, y=y, connect=connect)
+
+    def draw_density(self, line_label, decay=False):
+        density = self.wf_info[line_label]['density']
+        img = self.wf_info[line_label]['density_img']
+        with self.wf_info[line_label]['lock']:
+            if decay:
+                density.decay()
+            hist = density.hist.copy()
+            peak = density.peak
+        img.setImage(hist, levels=(0, max(peak, 1.)))
+        x_width = (1000000 / self.samplingRate) * density.spk_length
+        img.setRect(QRectF(self.plot_config['x_range'][0], -density.y_range, x_width, 2 * density.y_range))
+
+    def ingest(self, line_label, wfs, unit_ids):
+        """
+        Copy new waveforms into the stores of a plot series. Does not touch any Qt item so it
+        is safe to call from a worker thread.
+        :return: (list of unit indices with new waveforms, True if the density changed)
+        """
+        wfs = self.UNIT_SCALING * np.asarray(wfs)
+        with self.wf_info[line_label]['lock']:
+            touched = self.wf_info[line_label]['store'].add(wfs, unit_ids)
+            density_changed = self.wf_info[line_label]['density'].add(wfs)
+        return touched, density_changed
+
+    def draw(self, line_label, touched, density_changed):
+        if self.plot_config['display_mode'] == 'Density':
+            if density_changed:
+                self.draw_density(line_label)
+        else:
+            for unit_ix in touched:
+                self.draw_unit(line_label, unit_ix)
+
+    def draw_batch(self, batch):
+        # batch is the summary returned by WaveformAcquisition.take_batch()
+        if self.plot_config['display_mode'] == 'Density':
+            # All channels are redrawn on every frame so the counts of quiet channels decay too.
+            for line_label in self.wf_info:
+                self.draw_density(line_label, decay=True)
+        else:
+            for line_label, entry in batch.items():
+                self.draw(line_label, entry['units'], entry['density'])
 
     def update(self, line_label, data):
         """
 
         :param line_label: Label of the plot series
-        :param data: Replace data in the plot with these data
+        :param data: [waveforms, unit_ids] to add to the plot series
         :return:
         """
         wfs, unit_ids = data
-        x = (1000000 / self.samplingRate) * np.arange(wfs.shape[1]) + self.plot_config['x_range'][0]
-        for ix in range(wfs.shape[0]):
-            if np.sum(np.nonzero(wfs[ix])) > 0:
-                c = pg.PlotCurveItem()
-                pen_color = QColor(WF_COLORS[unit_ids[ix]])
-                c.setPen(pen_color)
-                self.wf_info[line_label]['plot'].addItem(c)
-                c.setData(x=x, y=0.25*wfs[ix])
-        data_items = self.wf_info[line_label]['plot'].listDataItems()
-        if len(data_items) > self.plot_config['n_wfs']:
-            for di in data_items[:-self.plot_config['n_wfs']]:
-                self.wf_info[line_label]['plot'].removeItem(di)
+        self.draw(line_label, *self.ingest(line_label, wfs, unit_ids))
 
 
 def main():
@@ -0,0 +1,261 @@
+"""
+Batch import of archived .ns5 recordings into the database, in parallel and resumable, without Qt dialogs.
+
+Each file is imported by NS5OfflinePlayback in a pool of processes. The subjects and procedures are loaded or created
+first, once each and in this process, so that the imports of a procedure's files do not race to create it.
+Every saved depth is recorded in a journal (one JSON line per completed unit) so a run that is interrupted resumes
+where it stopped.
+
+    dbs-import /data/DBS --jobs 8
+    dbs-import rec.ns5 --subject-id 123 --procedure-id 4 --config import.json
+
+The config file is JSON with optional "subject", "procedure", "buffer" and "features" objects, e.g.,
+    {"procedure": {"type": "surgical"}, "buffer": {"sample_length": "4.000", "validity": 90.0}}
+Flags override the config file.
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+# id_re = re.compile(r"(?P<Date>\d+\-\d+\-\d+)_(?P<Id>\d+)\-(?P<Proc>\d+)")
+ID_RE = re.compile(r"(?P<Date>\d{4}[-_]?\d{2}[-_]?\d{2})[_-]+(?P<Id>\d+)[-_]?(?P<Proc>\d+).ns5")
+BASE_DIR = 'D:\\Sachs_Lab\\Data\\DBS'
+JOURNAL_NAME = 'ns5_import_journal.jsonl'
+# Sections of the config file, and the keys of its "buffer" section. Subject and procedure keys are database fields.
+SETTINGS_SECTIONS = ['subject', 'procedure', 'buffer', 'features']
+BUFFER_KEYS = ['sampling_rate', 'buffer_length', 'sample_length', 'delay_buffer', 'overwrite_depth', 'run_buffer',
+               'validity']
+
+
+class ImportJournal(object):
+    """
+    Append-only record of the completed (file, depth) units and files.
+    Lines are short and written with a single append, so several processes can write to the same journal.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        :return: (set of completed files, dict {file: set of completed depth strings})
+        """
+        done_files, done_depths = set(), {}
+        if not os.path.exists(self.path):
+            return done_files, done_depths
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Truncated by a crash.
+                if 'depth' in entry:
+                    done_depths.setdefault(entry['file'], set()).add(entry['depth'])
+                else:
+                    done_files.add(entry['file'])
+        return done_files, done_depths
+
+    def _append(self, entry):
+        with self._lock, open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+
+    def depth_done(self, f_name, depth):
+        self._append({'file': f_name, 'depth': "{:.3f}".format(depth)})
+
+    def file_done(self, f_name):
+        self._append({'file': f_name})
+
+
+def find_ns5_files(base_dir, id_re=ID_RE):
+    """
+    :return: list of (subject_id, procedure_id, file path without extension) for every .ns5 under base_dir.
+    """
+    files = []
+    for root, dirs, f_names in os.walk(base_dir, topdown=False):
+        for n in f_names:
+            if not n.endswith('.ns5'):
+                continue
+            matches = id_re.match(n)
+            if matches is None:
+                print("Skipping {}: cannot parse subject and procedure.".format(n))
+                continue
+            files.append((matches.group('Id'), matches.group('Proc'), os.path.join(root, n.replace('.ns5', ''))))
+    return sorted(files, key=lambda x: x[2])
+
+
+def import_file(sub_id, proc_id, f_name, journal_path, skip_depths=(), settings=None, native_reader=True):
+    """
+    Imports one file in a worker process.
+    :param settings: settings overrides passed on to NS5OfflinePlayback.
+    :param native_reader: False to read the file through neo.
+    :return: dict with the number of depths saved, the bytes read and the elapsed seconds.
+    """
+    from neuroport_dbs.ImportNS5FeaturesGUI import NS5OfflinePlayback
+    journal = ImportJournal(journal_path)
+
+    def on_depth_done(depth):
+        journal.depth_done(f_name, depth)
+        print("{}: {:.3f}".format(os.path.basename(f_name), depth), flush=True)
+
+    t_start = time.monotonic()
+    playback = NS5OfflinePlayback(sub_id, proc_id, f_name, show_progress=False, skip_depths=skip_depths,
+                                  on_depth_done=on_depth_done, settings=settings or {},
+                                  native_reader=native_reader)
+    journal.file_done(f_name)
+    return {'file': f_name, 'n_depths': playback.n_depths_done, 'n_bytes': playback.bytes_read,
+            'seconds': time.monotonic() - t_start}
+
+
+def resolve_procedures(files, settings=None):
+    """
+    Loads or creates the subject and procedure of the files, once per procedure.
+    :param files: list of (subject_id, procedure_id, file path without extension).
+    :return: dict {(subject_id, procedure_id): settings with the resolved 'subject' and 'procedure', or None if it
+        failed}.
+    """
+    from serf.tools.db_wrap import DBWrapper
+    from neuroport_dbs.ImportNS5FeaturesGUI import NS5OfflinePlayback
+    db_wrapper = DBWrapper()
+    procedures = {}
+    for sub_id, proc_id in sorted(set((sub_id, proc_id) for sub_id, proc_id, _ in files)):
+        try:
+            procedures[(sub_id, proc_id)] = NS5OfflinePlayback.resolve_procedure(db_wrapper, sub_id, proc_id, settings)
+        except Exception as e:
+            print("Subject {} procedure {} failed: {}".format(sub_id, proc_id, e))
+            procedures[(sub_id, proc_id)] = None
+    return procedures
+
+
+def run_batch(files, journal_path, n_workers=None, settings=None, native_reader=True):
+    """
+    :param files: list of (subject_id, procedure_id, file path without extension).
+    :param journal_path: checkpoint journal; completed files and depths are skipped.
+    :param n_workers: number of processes. None for one per CPU core.
+    :param settings: settings overrides applied to every file (see NS5OfflinePlayback).
+    :param native_reader: False to read the files through neo.
+    :return: dict of aggregate statistics.
+    """
+    journal = ImportJournal(journal_path)
+    done_files, done_depths = journal.load()
+    todo = [f for f in files if f[2] not in done_files]
+    print("{} files, {} already imported, {} to do.".format(len(files), len(files) - len(todo), len(todo)))
+
+    totals = {'n_files': 0, 'n_failed': 0, 'n_depths': 0, 'n_bytes': 0}
+    t_start = time.monotonic()
+    procedures = resolve_procedures(todo, settings) if todo else {}
+    resolved = [f for f in todo if procedures[f[:2]] is not None]
+    totals['n_failed'] = len(todo) - len(resolved)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(),
+                                                mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(import_file, sub_id, proc_id, f_name, journal_path,
+                               done_depths.get(f_name, set()), procedures[(sub_id, proc_id)], native_reader): f_name
+                   for sub_id, proc_id, f_name in resolved}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                totals['n_failed'] += 1
+                print("{} failed: {}".format(futures[future], e))
+                continue
+            totals['n_files'] += 1
+            totals['n_depths'] += result['n_depths']
+            totals['n_bytes'] += result['n_bytes']
+            elapsed = time.monotonic() - t_start
+            print("{} ({}/{}): {} depths in {:.1f} s. Total: {:.1f} MB/s, {:.2f} depths/s".format(
+                result['file'], totals['n_files'] + totals['n_failed'], len(todo), result['n_depths'],
+                result['seconds'], totals['n_bytes'] / 1e6 / elapsed, totals['n_depths'] / elapsed))
+    totals['seconds'] = time.monotonic() - t_start
+    return totals
+
+
+def load_settings(args):
+    # Config file first, then flags. Raises ValueError for an unknown section or buffer key.
+    settings = {section: {} for section in SETTINGS_SECTIONS}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise ValueError("{}: expected a JSON object of {}.".format(args.config, ', '.join(SETTINGS_SECTIONS)))
+        for key, value in config.items():
+            if key not in settings:
+                raise ValueError("{}: unknown section '{}'; expected {}.".format(
+                    args.config, key, ', '.join(SETTINGS_SECTIONS)))
+            if not isinstance(value, dict):
+                raise ValueError("{}: '{}' must be a JSON object.".format(args.config, key))
+            unknown = [_ for _ in value if _ not in BUFFER_KEYS] if key == 'buffer' else []
+            if unknown:
+                raise ValueError("{}: unknown buffer settings {}; expected {}.".format(
+                    args.config, ', '.join(unknown), ', '.join(BUFFER_KEYS)))
+            settings[key].update(value)
+    if args.target_name:
+        settings['procedure']['target_name'] = args.target_name
+    if args.type:
+        settings['procedure']['type'] = args.type
+    for key in ['buffer_length', 'sample_length', 'delay_buffer']:
+        if getattr(args, key) is not None:
+            settings['buffer'][key] = '{:.3f}'.format(getattr(args, key))
+    if args.validity is not None:
+        settings['buffer']['validity'] = args.validity
+    return settings
+
+
+def collect_files(paths, subject_id=None, procedure_id=None):
+    # Folders are searched for .ns5 files. The subject and procedure ids come from the flags or the file names.
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = find_ns5_files(path)
+        else:
+            name = os.path.basename(path)
+            matches = ID_RE.match(name)
+            found = [(matches.group('Id'), matches.group('Proc'), path[:-len('.ns5')])] if matches else \
+                [(None, None, path[:-len('.ns5')] if path.endswith('.ns5') else path)]
+        for sub_id, proc_id, f_name in found:
+            sub_id, proc_id = subject_id or sub_id, procedure_id or proc_id
+            if sub_id is None or proc_id is None:
+                print("Skipping {}: use --subject-id and --procedure-id.".format(f_name))
+                continue
+            files.append((sub_id, proc_id, f_name))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import archived .ns5 recordings into the database.")
+    parser.add_argument('paths', nargs='*', default=[BASE_DIR], help=".ns5 files or folders searched for them.")
+    parser.add_argument('-j', '--jobs', '--workers', dest='jobs', type=int, default=None,
+                        help="Number of processes (default: 1 per core).")
+    parser.add_argument('--journal', default=None,
+                        help="Checkpoint journal (default: {} in the first folder).".format(JOURNAL_NAME))
+    parser.add_argument('--config', default=None, help="JSON file of settings.")
+    parser.add_argument('--subject-id', default=None, help="Subject id, instead of the one in the file names.")
+    parser.add_argument('--procedure-id', default=None, help="Procedure id, instead of the one in the file names.")
+    parser.add_argument('--target-name', default=None, help="Procedure target name (default: Proc<procedure id>).")
+    parser.add_argument('--type', default=None, help="Procedure type (default: surgical).")
+    parser.add_argument('--buffer-length', type=float, default=None, help="Depth buffer size (s).")
+    parser.add_argument('--sample-length', type=float, default=None, help="Depth sample size (s).")
+    parser.add_argument('--delay-buffer', type=float, default=None, help="Delay of the depth recording (s).")
+    parser.add_argument('--validity', type=float, default=None, help="Validity threshold (%%) of all electrodes.")
+    parser.add_argument('--neo', action='store_true', help="Read the files through neo instead of memory-mapping.")
+    args = parser.parse_args()
+
+    first_dir = next((p for p in args.paths if os.path.isdir(p)), os.path.dirname(os.path.abspath(args.paths[0])))
+    journal_path = args.journal or os.path.join(first_dir, JOURNAL_NAME)
+    try:
+        settings = load_settings(args)
+    except ValueError as e:
+        parser.error(str(e))
+    files = collect_files(args.paths, args.subject_id, args.procedure_id)
+    totals = run_batch(files, journal_path, n_workers=args.jobs, settings=settings, native_reader=not args.neo)
+    print("Imported {n_files} files ({n_failed} failed), {n_depths} depths, {mb:.0f} MB in {seconds:.0f} s".format(
+        mb=totals['n_bytes'] / 1e6, **totals))
+
+
+if __name__ == '__main__':
+    main()
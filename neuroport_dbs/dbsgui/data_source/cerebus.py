@@ -18,7 +18,15 @@ class CerebusDataSource(IDataSource):
             conn_params[key] = scoped_settings.value(key, orig_value)
         self._cbsdk_conn.con_params = conn_params
         self._cbsdk_conn.connect()
-        self._cbsdk_conn.cbsdk_config = {'reset': True, 'get_continuous': True}
+        self._cbsdk_conn.cbsdk_config = {
+            'reset': True,
+            'get_continuous': scoped_settings.value("get_continuous", 'true') == 'true',
+            'get_events': scoped_settings.value("get_events", 'false') == 'true',
+            'get_comments': scoped_settings.value("get_comments", 'false') == 'true',
+            'buffer_parameter': {
+                'comment_length': 10
+            }
+        }
         self._group_ix = SAMPLINGGROUPS.index(sampling_group)
         self._group_info = self._decode_group_info(self._cbsdk_conn.get_group_config(self._group_ix))
         self._on_connect_cb(self)
@@ -49,6 +57,10 @@ class CerebusDataSource(IDataSource):
                 'spkthrlevel': ch_info['spkthrlevel']
             })
         # TODO: more chan_states, extra?
+        sys_config = self._cbsdk_conn.get_sys_config()  # {'spklength': 48, 'spkpretrig': 10, 'sysfreq': 30000}
+        if sys_config:
+            extra['spklength'] = sys_config['spklength']
+            extra['spkpretrig'] = sys_config['spkpretrig']
 
         return {'srate': srate, 'channel_names': chan_names, 'chan_states': chan_states, **extra}
 
@@ -59,5 +71,19 @@ class CerebusDataSource(IDataSource):
     def get_continuous_data(self):
         return self._cbsdk_conn.get_continuous_data()
 
+    @property
+    def has_spike_events(self):
+        return True
+
+    def get_event_data(self):
+        return self._cbsdk_conn.get_event_data()
+
+    def get_waveforms(self, chan_id):
+        return self._cbsdk_conn.get_waveforms(chan_id)
+
+    def get_comments(self):
+        return self._cbsdk_conn.get_comments()
+
     def disconnect_requested(self):
-        self._cbsdk_conn.cbsdk_config = {'reset': True, 'get_continuous': False}
+        self._cbsdk_conn.cbsdk_config = {'reset': True, 'get_continuous': False, 'get_events': False,
+                                         'get_comments': False}
@@ -20,3 +20,23 @@ class IDataSource(QtCore.QObject):
 
     def get_continuous_data(self):
         raise NotImplementedError("Sub-classes must implement a `get_continuous_data` method.")
+
+    @property
+    def has_spike_events(self):
+        # Sources without their own spike detection can be wrapped in workers.SpikeDetection.
+        return False
+
+    @property
+    def is_highpassed(self):
+        # True if get_continuous_data already returns high-pass filtered data, so spike detection does not filter again.
+        return False
+
+    def get_event_data(self):
+        raise NotImplementedError("Sub-classes that provide spike events must implement a `get_event_data` method.")
+
+    def get_waveforms(self, chan_id):
+        raise NotImplementedError("Sub-classes that provide spike waveforms must implement a `get_waveforms` method "
+                                  "returning (waveforms, unit_ids).")
+
+    def get_comments(self):
+        return []
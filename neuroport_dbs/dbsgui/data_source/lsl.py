@@ -141,7 +141,7 @@ class LSLDataSource(IDataSource):
             for k in range(info.channel_count()):
                 ch_name = ch.child_value("label") or str(k)
                 chan_names.append(ch_name)
-                ch_state = {'name': ch_name, 'vis': True}
+                ch_state = {'name': ch_name, 'src': k, 'vis': True}
                 ch_unit = ch.child_value("unit")
                 if ch_unit:
                     ch_state['unit'] = ch_unit
@@ -177,6 +177,16 @@ class LSLDataSource(IDataSource):
         data, timestamps = self.hp_filter(data, timestamps)
         return data, timestamps
 
+    @property
+    def is_highpassed(self):
+        return True  # fetch_data applies hp_filter.
+
+    def get_continuous_data(self):
+        data, timestamps = self.fetch_data()
+        if len(timestamps) == 0:
+            return None
+        return [[ch_ix, data[ch_ix]] for ch_ix in range(data.shape[0])]
+
     @QtCore.Slot()
     def update_requested(self) -> None:
         """
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class DepthSpectrogram(object):
+    """
+    Columns (e.g., spectra) measured at sparse depths, kept as a depth-sorted (n_depths, n_rows) array.
+    The image is rendered on demand on a display grid (one column per pixel) by linear interpolation between
+    neighbouring depths. The last render is cached and, after an insert, only the pixels between the neighbours
+    of the new depth are recomputed. Memory and work scale with the number of depths and pixels, not with the
+    extent of the depth range.
+    """
+
+    def __init__(self, n_rows, fill_value=0.):
+        self.n_rows = n_rows
+        self.fill_value = fill_value  # Outside the recorded depths.
+        self.depths = np.zeros(0)
+        self.columns = np.zeros((0, n_rows))
+        self._grid = None
+        self._image = None
+        self._dirty = []  # (lo, hi) depth intervals that changed since the last render
+
+    def clear(self):
+        self.depths = np.zeros(0)
+        self.columns = np.zeros((0, self.n_rows))
+        self._image = None
+        self._dirty = []
+
+    def insert(self, depth, column):
+        column = np.asarray(column, dtype=float).ravel()[:self.n_rows]
+        ix = np.searchsorted(self.depths, depth)
+        if ix < self.depths.shape[0] and self.depths[ix] == depth:
+            self.columns[ix, :column.size] = column
+        else:
+            new_col = np.full(self.n_rows, self.fill_value)
+            new_col[:column.size] = column
+            self.depths = np.insert(self.depths, ix, depth)
+            self.columns = np.insert(self.columns, ix, new_col, axis=0)
+        # Only the pixels between the neighbours of the new depth change.
+        lo = self.depths[ix - 1] if ix > 0 else -np.inf
+        hi = self.depths[ix + 1] if ix + 1 < self.depths.shape[0] else np.inf
+        self._dirty.append((lo, hi))
+
+    def interpolate(self, x, px=None):
+        """
+        :param x: 1-D array of depths.
+        :param px: width of a pixel, if x are pixel centres. Defaults to the spacing of x.
+        :return: (x.size, n_rows) array of columns linearly interpolated at x.
+        """
+        out = np.full((x.shape[0], self.n_rows), self.fill_value)
+        n_depths = self.depths.shape[0]
+        if n_depths == 0:
+            return out
+        if n_depths == 1:
+            # A single depth is drawn in the pixel that contains it, and not at all if it is out of view.
+            if px is None:
+                px = np.abs(x[1] - x[0]) if x.shape[0] > 1 else 0.
+            offset = self.depths[0] - x
+            out[(offset >= -abs(px) / 2) & (offset < abs(px) / 2)] = self.columns[0]
+            return out
+        b_in = (x >= self.depths[0]) & (x <= self.depths[-1])
+        x_in = x[b_in]
+        ix = np.clip(np.searchsorted(self.depths, x_in, side='right') - 1, 0, n_depths - 2)
+        w = ((x_in - self.depths[ix]) / (self.depths[ix + 1] - self.depths[ix]))[:, None]
+        out[b_in] = self.columns[ix] * (1 - w) + self.columns[ix + 1] * w
+        return out
+
+    def render(self, x_range, n_px):
+        """
+        :param x_range: (first, last) depth of the display.
+        :param n_px: number of pixel columns in the display.
+        :return: (n_px, n_rows) image. Axis 0 is depth so it can be passed directly to pg.ImageItem.
+        """
+        n_px = max(2, int(n_px))
+        grid = x_range[0] + (np.arange(n_px) + 0.5) * (x_range[1] - x_range[0]) / n_px  # pixel centres
+        px = grid[1] - grid[0]
+        if self._image is None or self._grid is None or not np.array_equal(grid, self._grid):
+            self._grid = grid
+            self._image = self.interpolate(grid, px=px)
+        else:
+            for lo, hi in self._dirty:
+                b_px = (grid >= lo - px) & (grid <= hi + px)
+                if np.any(b_px):
+                    self._image[b_px] = self.interpolate(grid[b_px], px=px)
+        self._dirty = []
+        return self._image
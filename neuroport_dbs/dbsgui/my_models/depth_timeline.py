@@ -0,0 +1,166 @@
+import re
+import numpy as np
+from qtpy import QtCore
+
+
+class DepthTimeline(object):
+    """
+    Append-only, time-sorted record of the electrode depth: one (NSP timestamp, depth) entry per depth change.
+    Timestamps are in NSP samples, like the timestamps of the comments that carry the depth.
+    Lookups are bisections, so segmenting data by depth never rescans the comments.
+    """
+    DTT_PATTERN = re.compile(r'DTT:(?P<depth>-?\d*\.?\d+)')
+
+    def __init__(self, capacity=1024):
+        self._times = np.zeros(capacity, dtype=np.int64)
+        self._depths = np.zeros(capacity)
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def times(self):
+        return self._times[:self._n]
+
+    @property
+    def depths(self):
+        return self._depths[:self._n]
+
+    @property
+    def latest_depth(self):
+        return self._depths[self._n - 1] if self._n > 0 else None
+
+    def clear(self):
+        self._n = 0
+
+    def append(self, t, depth):
+        """
+        :return: True if the depth changed. Repeated depths and timestamps older than the last entry are ignored.
+        """
+        if self._n > 0 and (depth == self._depths[self._n - 1] or t < self._times[self._n - 1]):
+            return False
+        if self._n == self._times.shape[0]:
+            self._times = np.concatenate((self._times, np.zeros_like(self._times)))
+            self._depths = np.concatenate((self._depths, np.zeros_like(self._depths)))
+        self._times[self._n] = t
+        self._depths[self._n] = depth
+        self._n += 1
+        return True
+
+    def add_comments(self, comments, pattern=DTT_PATTERN):
+        """
+        :param comments: list of [timestamp, text (bytes or str), ...] as returned by the NSP or found in .nev files.
+        :param pattern: compiled regex matched at the start of the text, with a 'depth' group.
+        :return: True if any comment changed the depth.
+        """
+        changed = False
+        for com in comments:
+            text = com[1].decode('utf-8') if isinstance(com[1], bytes) else com[1]
+            match = pattern.match(text)
+            if match:
+                changed = self.append(int(com[0]), float(match.group('depth'))) or changed
+        return changed
+
+    def depth_at(self, t):
+        """
+        :return: depth at NSP timestamp t, or None if t is before the first entry.
+        """
+        ix = np.searchsorted(self.times, t, side='right') - 1
+        return self._depths[ix] if ix >= 0 else None
+
+    def segment_at(self, t):
+        """
+        :return: (t_start, t_stop, depth) of the segment containing t. t_stop is None for the current depth.
+        """
+        ix = np.searchsorted(self.times, t, side='right') - 1
+        if ix < 0:
+            return None
+        t_stop = self._times[ix + 1] if ix + 1 < self._n else None
+        return self._times[ix], t_stop, self._depths[ix]
+
+    def sample_ranges(self, depth):
+        """
+        :return: list of (t_start, t_stop) during which the electrode was at depth. t_stop is None for the current
+            depth. A depth can be visited more than once.
+        """
+        ixs = np.flatnonzero(self.depths == depth)
+        return [(self._times[ix], self._times[ix + 1] if ix + 1 < self._n else None) for ix in ixs]
+
+    @staticmethod
+    def file_path(recording_path):
+        # The timeline is stored next to the recording, e.g., /data/rec001 -> /data/rec001.depth.npz
+        return str(recording_path) + '.depth.npz'
+
+    def save(self, path):
+        np.savez(path, times=self.times, depths=self.depths)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            timeline = cls(capacity=max(1, f['times'].shape[0]))
+            timeline._times[:f['times'].shape[0]] = f['times']
+            timeline._depths[:f['depths'].shape[0]] = f['depths']
+            timeline._n = f['times'].shape[0]
+        return timeline
+
+
+class DepthTimelineSharedMemory(object):
+    """
+    A DepthTimeline shared between processes through QSharedMemory.
+    DDUGUI owns (creates) the memory and writes each depth change to it. Other processes attach and read the entries
+    they do not have yet. The memory holds the latest MAX_ENTRIES entries as a ring.
+    Layout: float64 [n_total, t_0, depth_0, t_1, depth_1, ...].
+    """
+    KEY = "DepthTimelineMemory"
+    MAX_ENTRIES = 65536
+
+    def __init__(self, owner=False):
+        self._owner = owner
+        self._n_written = 0
+        self._n_read = 0
+        self._mem = QtCore.QSharedMemory()
+        self._mem.setKey(self.KEY)
+        if owner:
+            self._mem.create(8 * (1 + 2 * self.MAX_ENTRIES))
+        else:
+            self._mem.attach(QtCore.QSharedMemory.ReadOnly)
+
+    def write(self, timeline):
+        # Only the entries added since the last write are copied.
+        if not self._mem.isAttached():
+            return
+        n_total = len(timeline)
+        if n_total < self._n_written:
+            self._n_written = 0  # The timeline was cleared.
+        first = max(self._n_written, n_total - self.MAX_ENTRIES)
+        self._mem.lock()
+        for ix in range(first, n_total):
+            offset = 8 * (1 + 2 * (ix % self.MAX_ENTRIES))
+            entry = np.array([timeline.times[ix], timeline.depths[ix]], dtype=np.float64).tobytes()
+            self._mem.data()[offset:offset + len(entry)] = memoryview(entry)
+        header = np.array([n_total], dtype=np.float64).tobytes()
+        self._mem.data()[:len(header)] = memoryview(header)
+        self._mem.unlock()
+        self._n_written = n_total
+
+    def read_into(self, timeline):
+        """
+        Appends the entries written since the last read.
+        :return: True if the depth changed, None if the memory is not available (e.g., DDUGUI not running).
+        """
+        if not self._mem.isAttached() and not self._mem.attach(QtCore.QSharedMemory.ReadOnly):
+            return None
+        self._mem.lock()
+        buffer = np.frombuffer(self._mem.data(), dtype=np.float64, count=1 + 2 * self.MAX_ENTRIES)
+        n_total = int(buffer[0])
+        if n_total < self._n_read:
+            self._n_read = 0  # The owner was restarted.
+        slots = 1 + 2 * (np.arange(max(self._n_read, n_total - self.MAX_ENTRIES), n_total) % self.MAX_ENTRIES)
+        times, depths = buffer[slots].copy(), buffer[slots + 1].copy()
+        self._mem.unlock()
+        self._n_read = n_total
+        changed = False
+        for t, depth in zip(times, depths):
+            changed = timeline.append(int(t), depth) or changed
+        return changed
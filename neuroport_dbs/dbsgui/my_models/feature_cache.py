@@ -0,0 +1,162 @@
+import collections
+import socket
+import threading
+import numpy as np
+from qtpy import QtCore, QtNetwork
+
+from neuroport_dbs.settings.defaults import FEATURES_NOTIFY_PORT, FEATURES_CACHE_MB
+
+
+def notify_feature_change(chan_lbl='', category='', port=FEATURES_NOTIFY_PORT):
+    """
+    Tell any listening FeatureChangeFeed that new data were written for (chan_lbl, category).
+    Empty strings are wildcards. Usable from any process, Qt or not. Delivery is best-effort (UDP on localhost).
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto("{}\t{}".format(chan_lbl, category).encode('utf-8'), ('127.0.0.1', port))
+    except OSError:
+        pass
+
+
+def _nbytes(data):
+    # Approximate memory footprint of a datum's data: only the arrays matter.
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, dict):
+        return sum(_nbytes(_) for _ in data.values())
+    if isinstance(data, (list, tuple)):
+        return sum(_nbytes(_) for _ in data)
+    return 64
+
+
+class FeatureDataCache(object):
+    """
+    Read-through cache of depth, mapping and feature data, keyed by (procedure_id, chan_label, category, datum_id).
+    A series (procedure_id, chan_label, category) is only read from the database when it was never loaded or when it
+    was marked stale by the change feed, and then only for datums newer than the newest one loaded.
+    Datums are evicted least-recently-used first when the cache exceeds max_bytes. An evicted datum is read again only
+    when it is asked for, together with the datums after it.
+    """
+
+    def __init__(self, load_fn, max_bytes=FEATURES_CACHE_MB * 2**20):
+        """
+        :param load_fn: callable(chan_lbl, category, gt, do_hp) returning a dict {datum_id: data} of datums > gt.
+        :param max_bytes: memory budget for the cached data.
+        """
+        self._load_fn = load_fn
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # (proc_id, chan_lbl, cat_key, datum_id) -> (data, nbytes)
+        # (proc_id, chan_lbl, cat_key) -> {'ids': set of cached datum_ids, 'evicted': set of evicted datum_ids,
+        #                                  'newest': newest datum_id loaded, 'stale': bool}
+        self._series = {}
+        self._nbytes = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _category_key(category, do_hp):
+        # Raw data differ with the high-pass filter; nothing else does.
+        return category if category != 'Raw' or do_hp else 'Raw (no HP)'
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._series.clear()
+            self._nbytes = 0
+
+    def mark_stale(self, chan_lbl='', category=''):
+        # Empty strings are wildcards.
+        with self._lock:
+            for (_, s_chan, s_cat), series in self._series.items():
+                if chan_lbl in ('', s_chan) and category in ('', s_cat, self._category_key(category, False)):
+                    series['stale'] = True
+
+    def is_stale(self, procedure_id, chan_lbl, category, do_hp=True):
+        with self._lock:
+            series = self._series.get((procedure_id, chan_lbl, self._category_key(category, do_hp)))
+            return series is None or series['stale']
+
+    def get(self, procedure_id, chan_lbl, category, gt=0, do_hp=True, load=True):
+        """
+        :return: dict {datum_id: data} of all datums > gt for the series, loading from the database only what is
+            not cached. With load=False, only what is already cached.
+        """
+        cat_key = self._category_key(category, do_hp)
+        series_key = (procedure_id, chan_lbl, cat_key)
+        with self._lock:
+            if not load and series_key not in self._series:
+                return {}
+            series = self._series.setdefault(series_key, {'ids': set(), 'evicted': set(), 'newest': 0,
+                                                          'stale': True})
+            gap = [_ for _ in series['evicted'] if _ > gt]
+            load_gt = min(gap) - 1 if gap else series['newest']
+            do_load = load and (series['stale'] or len(gap) > 0)
+            if do_load:
+                series['stale'] = False
+
+        new_data = {}
+        if do_load:
+            try:
+                new_data = self._load_fn(chan_lbl, category, load_gt, do_hp) or {}
+            except Exception:
+                with self._lock:
+                    series['stale'] = True  # Retried on the next read.
+                raise
+            with self._lock:
+                for datum_id, data in new_data.items():
+                    self._insert(series_key + (datum_id,), data)
+                    series['ids'].add(datum_id)
+                    series['evicted'].discard(datum_id)
+                series['newest'] = max([series['newest']] + list(new_data.keys()))
+                self._evict()
+
+        with self._lock:
+            result = {}
+            for datum_id in sorted(_ for _ in series['ids'].union(new_data.keys()) if _ > gt):
+                key = series_key + (datum_id,)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    result[datum_id] = self._entries[key][0]
+                else:
+                    # The series alone is larger than the budget and was just evicted.
+                    result[datum_id] = new_data[datum_id]
+            return result
+
+    def _insert(self, key, data):
+        if key in self._entries:
+            self._nbytes -= self._entries[key][1]
+        nbytes = _nbytes(data)
+        self._entries[key] = (data, nbytes)
+        self._entries.move_to_end(key)
+        self._nbytes += nbytes
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            key, (_, nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+            series = self._series.get(key[:3])
+            if series is not None:
+                series['ids'].discard(key[3])
+                series['evicted'].add(key[3])
+
+
+class FeatureChangeFeed(QtCore.QObject):
+    """
+    Receives the notifications sent with notify_feature_change and re-emits them as a Qt signal on the GUI thread.
+    """
+    changed = QtCore.Signal(str, str)  # chan_lbl, category. Empty strings are wildcards.
+
+    def __init__(self, port=FEATURES_NOTIFY_PORT, parent=None):
+        super().__init__(parent)
+        self._socket = QtNetwork.QUdpSocket(self)
+        if self._socket.bind(QtNetwork.QHostAddress(QtNetwork.QHostAddress.LocalHost), port,
+                             QtNetwork.QUdpSocket.ShareAddress | QtNetwork.QUdpSocket.ReuseAddressHint):
+            self._socket.readyRead.connect(self._on_ready_read)
+        else:
+            print("Could not listen for feature change notifications on port {}.".format(port))
+
+    def _on_ready_read(self):
+        while self._socket.hasPendingDatagrams():
+            datagram, _, _ = self._socket.readDatagram(self._socket.pendingDatagramSize())
+            chan_lbl, _, category = bytes(datagram).decode('utf-8', errors='replace').partition('\t')
+            self.changed.emit(chan_lbl, category)
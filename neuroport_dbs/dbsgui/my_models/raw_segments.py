@@ -0,0 +1,158 @@
+import bisect
+import collections
+import tempfile
+import numpy as np
+
+from neuroport_dbs.settings.defaults import RAWSEGMENTS_IN_RAM
+
+
+class RawSegmentStore(object):
+    """
+    Memory-bounded store of the raw data segment recorded at each depth.
+    Segments are kept as int16 with a per-segment gain. The most recently used max_in_ram segments stay in RAM;
+    the others are spilled to a temporary file and paged back in through a memory map when they are needed again
+    (e.g., when scrolling back up the trajectory). The file space of replaced segments is reused by later spills.
+    """
+
+    def __init__(self, max_in_ram=RAWSEGMENTS_IN_RAM, spill_dir=None):
+        self.max_in_ram = max(1, max_in_ram)
+        self._spill_dir = spill_dir
+        self._spill_file = None
+        self._spill_end = 0
+        self._free = []  # sorted (offset, nbytes) of the spill file regions no longer in use
+        self._ram = collections.OrderedDict()  # depth -> int16 array, in LRU order
+        self._on_disk = {}  # depth -> (offset in bytes, n_samples), only if the disk copy is current
+        self._gains = {}  # depth -> gain
+        self.depths = np.zeros(0)  # sorted
+
+    def __len__(self):
+        return self.depths.shape[0]
+
+    def __contains__(self, depth):
+        return depth in self._gains
+
+    def clear(self):
+        self._ram.clear()
+        self._on_disk.clear()
+        self._gains.clear()
+        self.depths = np.zeros(0)
+        if self._spill_file is not None:
+            self._spill_file.close()  # Deletes the file.
+            self._spill_file = None
+        self._spill_end = 0
+        self._free = []
+
+    def put(self, depth, data):
+        """
+        Store (or replace) the segment at depth. data are floats in uV.
+        """
+        data = np.asarray(data, dtype=float).ravel()
+        peak = np.max(np.abs(data)) if data.size > 0 else 0.
+        gain = peak / np.iinfo(np.int16).max if peak > 0 else 1.
+        if depth not in self._gains:
+            self.depths = np.insert(self.depths, np.searchsorted(self.depths, depth), depth)
+        self._gains[depth] = gain
+        self._release(depth)
+        self._ram[depth] = np.round(data / gain).astype(np.int16)
+        self._ram.move_to_end(depth)
+        self._spill()
+
+    def get(self, depth):
+        """
+        :return: float32 array in uV of the segment at depth.
+        """
+        if depth not in self._ram:
+            offset, n_samples = self._on_disk[depth]
+            self._ram[depth] = np.array(np.memmap(self._spill_file, dtype=np.int16, mode='r',
+                                                  offset=offset, shape=(n_samples,)))
+            self._spill()
+        self._ram.move_to_end(depth)
+        return self._ram[depth].astype(np.float32) * np.float32(self._gains[depth])
+
+    def _spill(self):
+        # Move least recently used segments out of RAM. Segments already on disk are simply dropped.
+        while len(self._ram) > self.max_in_ram:
+            depth, data = self._ram.popitem(last=False)
+            if depth in self._on_disk:
+                continue
+            if self._spill_file is None:
+                self._spill_file = tempfile.TemporaryFile(prefix='rawsegments_', dir=self._spill_dir)
+            offset = self._allocate(data.nbytes)
+            self._spill_file.seek(offset)
+            self._spill_file.write(data.tobytes())
+            self._spill_file.flush()
+            self._on_disk[depth] = (offset, data.shape[0])
+
+    def _allocate(self, nbytes):
+        # First free region that is large enough, else the end of the file.
+        for ix, (offset, free_nbytes) in enumerate(self._free):
+            if free_nbytes >= nbytes:
+                if free_nbytes > nbytes:
+                    self._free[ix] = (offset + nbytes, free_nbytes - nbytes)
+                else:
+                    del self._free[ix]
+                return offset
+        offset = self._spill_end
+        self._spill_end += nbytes
+        return offset
+
+    def _release(self, depth):
+        # The disk copy of the segment at depth is out of date: free its region, merged with its free neighbours.
+        if depth not in self._on_disk:
+            return
+        offset, n_samples = self._on_disk.pop(depth)
+        nbytes = n_samples * np.dtype(np.int16).itemsize
+        ix = bisect.bisect(self._free, (offset, nbytes))
+        if ix < len(self._free) and self._free[ix][0] == offset + nbytes:
+            nbytes += self._free.pop(ix)[1]
+        if ix > 0 and sum(self._free[ix - 1]) == offset:
+            ix -= 1
+            offset, nbytes = self._free[ix][0], self._free.pop(ix)[1] + nbytes
+        if offset + nbytes == self._spill_end:
+            # Free space at the end of the file is given back.
+            self._spill_end = offset
+            self._spill_file.truncate(offset)
+        else:
+            self._free.insert(ix, (offset, nbytes))
+
+    def __del__(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+
+
+class MinMaxPyramid(object):
+    """
+    Min/max decimation of a segment at bin sizes min_bin, 2 * min_bin, 4 * min_bin, ...
+    Each level interleaves the min and max of every bin so it draws like the full data at one bin per pixel.
+    """
+
+    def __init__(self, data, min_bin=64):
+        data = np.asarray(data, dtype=np.float32).ravel()
+        self.n_samples = data.shape[0]
+        self.levels = []  # list of (bin_size, interleaved min/max array)
+        n_bins = self.n_samples // min_bin
+        if n_bins < 2:
+            return
+        binned = data[:n_bins * min_bin].reshape(n_bins, min_bin)
+        mins, maxs = binned.min(axis=1), binned.max(axis=1)
+        bin_size = min_bin
+        while mins.shape[0] >= 2:
+            self.levels.append((bin_size, np.column_stack((mins, maxs)).ravel()))
+            n_pairs = mins.shape[0] // 2
+            mins = np.minimum(mins[:2 * n_pairs:2], mins[1:2 * n_pairs:2])
+            maxs = np.maximum(maxs[:2 * n_pairs:2], maxs[1:2 * n_pairs:2])
+            bin_size *= 2
+
+    def level_for(self, n_px):
+        """
+        :return: (x, y) of the coarsest level with at least one bin per pixel, or None if the full data are needed.
+        """
+        best = None
+        for bin_size, minmax in self.levels:
+            if minmax.shape[0] // 2 >= n_px:
+                best = (bin_size, minmax)
+        if best is None:
+            return None
+        bin_size, minmax = best
+        x = (np.arange(minmax.shape[0]) // 2) * bin_size + bin_size / 2
+        return x, minmax
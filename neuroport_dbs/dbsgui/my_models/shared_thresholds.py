@@ -0,0 +1,43 @@
+import numpy as np
+from qtpy import QtCore
+
+
+class ThresholdSharedMemory(object):
+    """
+    Per-channel spike thresholds (in uV) shared between processes through QSharedMemory.
+    SweepGUI owns (creates) the memory and writes to it when a threshold line is moved. Other processes
+    (e.g., the client-side spike detector in RasterGUI and WaveformGUI) attach and read it.
+    Layout: float64 [n_channels, thresh_0, ..., thresh_n-1]. Channels are in data-source order.
+    """
+    KEY = "ThresholdMemory"
+    MAX_CHANNELS = 256
+
+    def __init__(self, owner=False):
+        self._owner = owner
+        self._mem = QtCore.QSharedMemory()
+        self._mem.setKey(self.KEY)
+        if owner:
+            self._mem.create(8 * (1 + self.MAX_CHANNELS))
+        else:
+            self._mem.attach(QtCore.QSharedMemory.ReadOnly)
+
+    def write(self, thresholds):
+        if not self._mem.isAttached():
+            return
+        thresholds = np.asarray(thresholds, dtype=np.float64)[:self.MAX_CHANNELS]
+        to_write = np.concatenate(([thresholds.shape[0]], thresholds)).tobytes()
+        self._mem.lock()
+        self._mem.data()[:len(to_write)] = memoryview(to_write)
+        self._mem.unlock()
+
+    def read(self):
+        """
+        :return: array of thresholds in uV, or None if the memory is not available (e.g., SweepGUI not running).
+        """
+        if not self._mem.isAttached() and not self._mem.attach(QtCore.QSharedMemory.ReadOnly):
+            return None
+        self._mem.lock()
+        values = np.frombuffer(self._mem.data(), dtype=np.float64, count=1 + self.MAX_CHANNELS).copy()
+        self._mem.unlock()
+        n_channels = int(values[0])
+        return values[1:1 + n_channels] if n_channels > 0 else None
@@ -0,0 +1,147 @@
+import numpy as np
+from scipy import signal
+
+
+class ThresholdDetector(object):
+    """
+    Streaming, multi-channel threshold-crossing spike detector.
+    Chunks of continuous data are (optionally) high-pass filtered, scanned for threshold crossings
+    with a per-channel refractory period, and a waveform snippet is cut around every spike.
+    Crossings too close to the end of a chunk to cut a full snippet are carried over to the next chunk,
+    so a spike is never missed or reported twice across chunk boundaries.
+    All the per-sample work is vectorized across channels; only spikes that violate the refractory
+    period are visited one at a time.
+    """
+
+    def __init__(self, n_channels, srate, thresholds=None, gains=None, sos=None,
+                 refractory=0.0015, n_pre=10, n_post=38, auto_threshold=-4.5, noise_duration=1.0, settle_duration=0.1):
+        """
+        :param n_channels: number of channels in each chunk.
+        :param srate: sampling rate in Hz.
+        :param thresholds: per-channel thresholds (after gain). Negative values detect downward crossings.
+            NaN thresholds are estimated from the data as auto_threshold * noise SD if auto_threshold is not None.
+        :param gains: per-channel factor to convert the incoming data to the threshold units (e.g., uV).
+        :param sos: second-order sections of a filter to apply to the data before detection, or None.
+        :param refractory: seconds. Minimum interval between two spikes on the same channel.
+        :param n_pre: number of samples in the snippet before the crossing.
+        :param n_post: number of samples in the snippet from the crossing onwards.
+        :param auto_threshold: multiple of the noise SD used for thresholds that are not set.
+        :param noise_duration: seconds of data from which the noise SD is estimated. Thresholds that are not set stay
+            NaN (no detection) until then.
+        :param settle_duration: seconds at the start of the data (e.g., the filter's transient) left out of the
+            noise estimate.
+        """
+        self.n_channels = n_channels
+        self.srate = srate
+        self.n_pre = max(1, n_pre)
+        self.n_post = max(1, n_post)
+        self.refractory_samples = int(round(refractory * srate))
+        self.auto_threshold = auto_threshold
+        self._noise_samples = max(1, int(round(noise_duration * srate)))
+        self._settle_samples = int(round(settle_duration * srate))
+        self.gains = np.ones(n_channels) if gains is None else np.asarray(gains, dtype=float)
+        self.thresholds = np.full(n_channels, np.nan)
+        if thresholds is not None:
+            self.set_thresholds(thresholds)
+        self._sos = sos
+        self._zi = None
+        self.reset()
+
+    def reset(self):
+        self._tail = np.zeros((self.n_channels, 0))
+        self._tail_start = 0  # Absolute sample index of the first sample in self._tail
+        self._last_spike = np.full(self.n_channels, -np.iinfo(np.int64).max // 2, dtype=np.int64)
+        if self._sos is not None:
+            self._zi = np.zeros((self._sos.shape[0], self.n_channels, 2))
+        self._noise = []  # Chunks of data collected for the noise estimate.
+        self._noise_len = 0
+
+    @property
+    def sample_count(self):
+        # Absolute index of the next sample to be received.
+        return self._tail_start + self._tail.shape[1]
+
+    def set_thresholds(self, thresholds):
+        thresholds = np.asarray(thresholds, dtype=float)
+        self.thresholds[:thresholds.shape[0]] = thresholds[:self.n_channels]
+
+    def _estimate_thresholds(self, data):
+        # data is the next (filtered) chunk; its first sample has the absolute index sample_count.
+        b_unset = np.isnan(self.thresholds)
+        if self.auto_threshold is None or not np.any(b_unset):
+            return
+        data = data[:, max(0, self._settle_samples - self.sample_count):]
+        data = data[:, :self._noise_samples - self._noise_len]
+        if data.shape[1] == 0:
+            return
+        self._noise.append(data)
+        self._noise_len += data.shape[1]
+        if self._noise_len < self._noise_samples:
+            return
+        noise = np.concatenate(self._noise, axis=1)
+        noise_sd = np.median(np.abs(noise[b_unset]), axis=1) / 0.6745
+        self.thresholds[b_unset] = self.auto_threshold * noise_sd
+        self._noise, self._noise_len = [], 0
+
+    def process(self, data):
+        """
+        :param data: (n_channels, n_samples) chunk of continuous data. Must immediately follow the previous chunk.
+        :return: list with one (timestamps, waveforms) tuple per channel. timestamps are absolute sample indices
+            of the threshold crossings and waveforms is a (n_spikes, n_pre + n_post) array in threshold units.
+        """
+        data = np.asarray(data, dtype=float) * self.gains[:, None]
+        if self._sos is not None:
+            data, self._zi = signal.sosfilt(self._sos, data, axis=1, zi=self._zi)
+        self._estimate_thresholds(data)
+
+        buf = np.concatenate((self._tail, data), axis=1)
+        buf_len = buf.shape[1]
+        scan_stop = buf_len - self.n_post
+        spk_ch = np.zeros(0, dtype=int)
+        spk_ix = np.zeros(0, dtype=int)
+        if scan_stop > self.n_pre:
+            thr = self.thresholds[:, None]
+            x0 = buf[:, self.n_pre - 1:scan_stop - 1]
+            x1 = buf[:, self.n_pre:scan_stop]
+            b_cross = np.where(thr < 0, (x0 > thr) & (x1 <= thr), (x0 < thr) & (x1 >= thr))
+            spk_ch, spk_ix = np.nonzero(b_cross)  # Sorted by channel then by sample.
+            spk_ix = spk_ix + self.n_pre
+            spk_ch, spk_ix = self._apply_refractory(spk_ch, spk_ix)
+
+        # Cut snippets: crossing at sample n_pre of each snippet.
+        win = spk_ix[:, None] + np.arange(-self.n_pre, self.n_post)[None, :]
+        wfs = buf[spk_ch[:, None], win]
+        timestamps = spk_ix + self._tail_start
+
+        # Keep enough samples to cut snippets for crossings near the end of this chunk.
+        tail_len = min(buf_len, self.n_pre + self.n_post)
+        self._tail = buf[:, buf_len - tail_len:]
+        self._tail_start += buf_len - tail_len
+
+        result = []
+        for ch_ix in range(self.n_channels):
+            b_ch = spk_ch == ch_ix
+            result.append((timestamps[b_ch], wfs[b_ch]))
+        return result
+
+    def _apply_refractory(self, spk_ch, spk_ix):
+        if spk_ch.size == 0:
+            return spk_ch, spk_ix
+        spk_abs = spk_ix + self._tail_start
+        b_same = np.concatenate(([False], spk_ch[1:] == spk_ch[:-1]))
+        prev_abs = np.where(b_same, np.concatenate(([0], spk_abs[:-1])), self._last_spike[spk_ch])
+        b_keep = np.ones(spk_ch.size, dtype=bool)
+        b_conflict = (spk_abs - prev_abs) < self.refractory_samples
+        # Only channels with a conflict need the sequential pass.
+        for ch_ix in np.unique(spk_ch[b_conflict]):
+            last = self._last_spike[ch_ix]
+            for k in np.nonzero(spk_ch == ch_ix)[0]:
+                if spk_abs[k] - last < self.refractory_samples:
+                    b_keep[k] = False
+                else:
+                    last = spk_abs[k]
+        spk_ch, spk_ix, spk_abs = spk_ch[b_keep], spk_ix[b_keep], spk_abs[b_keep]
+        # Last kept spike per channel. spk_ch is sorted so the last occurrence is the latest spike.
+        b_last = np.concatenate((spk_ch[1:] != spk_ch[:-1], [True]))
+        self._last_spike[spk_ch[b_last]] = spk_abs[b_last]
+        return spk_ch, spk_ix
@@ -0,0 +1,154 @@
+import numpy as np
+from scipy import stats
+
+
+class IncrementalPCA(object):
+    """
+    Principal components of a waveform stream from exponentially-weighted running moments.
+    Memory is bounded by the (spk_length, spk_length) second moment regardless of how many
+    waveforms have been seen.
+    """
+
+    def __init__(self, n_components=3, half_life=2000):
+        self.n_components = n_components
+        self._decay = 0.5 ** (1 / half_life)  # per waveform
+        self._s0 = 0.
+        self._s1 = None
+        self._s2 = None
+        self._components = None
+
+    def partial_fit(self, wfs):
+        wfs = np.asarray(wfs, dtype=float)
+        if self._s1 is None or self._s1.shape[0] != wfs.shape[1]:
+            self._s0 = 0.
+            self._s1 = np.zeros(wfs.shape[1])
+            self._s2 = np.zeros((wfs.shape[1], wfs.shape[1]))
+        decay = self._decay ** wfs.shape[0]
+        self._s0 = decay * self._s0 + wfs.shape[0]
+        self._s1 = decay * self._s1 + wfs.sum(axis=0)
+        self._s2 = decay * self._s2 + wfs.T @ wfs
+        self._components = None  # Recomputed lazily.
+
+    @property
+    def mean(self):
+        return self._s1 / self._s0
+
+    @property
+    def components(self):
+        if self._components is None and self._s0 > 0:
+            mean = self.mean
+            cov = self._s2 / self._s0 - np.outer(mean, mean)
+            evals, evecs = np.linalg.eigh(cov)  # ascending
+            self._components = evecs[:, ::-1][:, :self.n_components].T
+        return self._components
+
+    def transform(self, wfs):
+        return (np.asarray(wfs, dtype=float) - self.mean) @ self.components.T
+
+
+class UnitIsolation(object):
+    """
+    Rolling unit-isolation metrics for a single channel.
+    Keeps the last n_wfs waveforms with their unit ids, the channel's incremental PCA, and the last n_wfs spike
+    timestamps of each unit. Timestamps come from the event stream and need not be paired with the waveforms.
+    `metrics` returns, for each unit with enough spikes:
+        'snr': peak-to-peak of the mean waveform over twice the SD of the residuals,
+        'l_ratio': L-ratio of the unit's cluster in PC space against all other spikes on the channel,
+        'isi_violations': fraction of inter-spike intervals shorter than the refractory period
+                          (None if no timestamps were provided).
+                          Timestamps and refractory * srate are in samples of the same clock.
+    """
+
+    def __init__(self, n_wfs=1000, n_components=3, refractory=0.0015, srate=30000, min_spikes=20):
+        self.n_wfs = n_wfs
+        self.min_spikes = min_spikes
+        self._refractory_samples = refractory * srate
+        self.pca = IncrementalPCA(n_components=n_components)
+        self._wfs = None
+        self._unit_ids = np.full(n_wfs, -1, dtype=int)
+        self._timestamps = {}  # unit_ix -> sorted array of its last n_wfs timestamps
+        self._write_ix = 0
+        self._count = 0
+
+    def clear(self):
+        self._unit_ids[:] = -1
+        self._timestamps = {}
+        self._write_ix = 0
+        self._count = 0
+
+    def add(self, wfs, unit_ids, unit_timestamps=None):
+        """
+        :param wfs: (n_spikes, n_samples) waveforms, or None.
+        :param unit_ids: unit id of each waveform.
+        :param unit_timestamps: list of timestamp arrays indexed by unit id, as in the 'timestamps' of the NSP's event
+            data, or None.
+        """
+        if wfs is not None and len(wfs) > 0:
+            self.add_waveforms(wfs, unit_ids)
+        if unit_timestamps is not None:
+            self.add_timestamps(unit_timestamps)
+
+    def add_waveforms(self, wfs, unit_ids):
+        wfs = np.asarray(wfs, dtype=float)
+        unit_ids = np.asarray(unit_ids, dtype=int)
+        b_keep = np.any(wfs != 0, axis=1)
+        wfs, unit_ids = wfs[b_keep], unit_ids[b_keep]
+        if wfs.shape[0] == 0:
+            return
+        if self._wfs is None or self._wfs.shape[1] != wfs.shape[1]:
+            self._wfs = np.zeros((self.n_wfs, wfs.shape[1]))
+            self.clear()
+
+        self.pca.partial_fit(wfs)
+
+        wfs, unit_ids = wfs[-self.n_wfs:], unit_ids[-self.n_wfs:]
+        write_ix = (self._write_ix + np.arange(wfs.shape[0])) % self.n_wfs
+        self._wfs[write_ix] = wfs
+        self._unit_ids[write_ix] = unit_ids
+        self._write_ix = (write_ix[-1] + 1) % self.n_wfs
+        self._count = min(self._count + wfs.shape[0], self.n_wfs)
+
+    def add_timestamps(self, unit_timestamps):
+        for unit_ix, ts in enumerate(unit_timestamps):
+            ts = np.asarray(ts, dtype=float).ravel()
+            if ts.size == 0:
+                continue
+            if unit_ix in self._timestamps:
+                ts = np.concatenate((self._timestamps[unit_ix], ts))
+            self._timestamps[unit_ix] = np.sort(ts)[-self.n_wfs:]
+
+    def metrics(self):
+        if self._count < self.min_spikes or self.pca.components is None:
+            return {}
+        wfs = self._wfs[:self._count]
+        unit_ids = self._unit_ids[:self._count]
+        features = self.pca.transform(wfs)
+        n_dims = features.shape[1]
+
+        result = {}
+        for unit_ix in np.unique(unit_ids):
+            b_unit = unit_ids == unit_ix
+            n_unit = np.sum(b_unit)
+            if n_unit < self.min_spikes:
+                continue
+            unit_wfs = wfs[b_unit]
+            mean_wf = unit_wfs.mean(axis=0)
+            resid_sd = np.std(unit_wfs - mean_wf)
+            snr = np.ptp(mean_wf) / (2 * resid_sd) if resid_sd > 0 else np.inf
+
+            l_ratio = None
+            if np.any(~b_unit) and n_unit > n_dims:
+                unit_feats = features[b_unit]
+                cov = np.cov(unit_feats, rowvar=False)
+                delta = features[~b_unit] - unit_feats.mean(axis=0)
+                d2 = np.sum((delta @ np.linalg.pinv(cov)) * delta, axis=1)
+                l_ratio = np.sum(stats.chi2.sf(d2, n_dims)) / n_unit
+
+            isi_violations = None
+            unit_ts = self._timestamps.get(int(unit_ix), np.zeros(0))
+            if unit_ts.size > 1:
+                isi_violations = np.mean(np.diff(unit_ts) < self._refractory_samples)
+
+            result[int(unit_ix)] = {'n': int(n_unit), 'snr': snr, 'l_ratio': l_ratio,
+                                    'isi_violations': isi_violations}
+        return result
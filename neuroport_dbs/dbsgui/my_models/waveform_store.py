@@ -0,0 +1,139 @@
+import time
+import numpy as np
+
+
+class WaveformStore(object):
+    """
+    Fixed-capacity store of spike waveforms for a single channel.
+    Each sorted unit gets its own ring of n_wfs waveforms. Memory is allocated once as a
+    (n_units, n_wfs, spk_length) array so the cost of keeping and drawing the waveforms does not
+    depend on the spike rate.
+    """
+
+    def __init__(self, n_units, n_wfs, spk_length=48, dtype=np.float32):
+        self.n_units = n_units
+        self._dtype = dtype
+        self._data = None
+        self._write_ix = None
+        self._count = None
+        self.connect = None
+        self.resize(n_wfs, spk_length)
+
+    def resize(self, n_wfs=None, spk_length=None):
+        # (Re-)allocating clears the store.
+        self.n_wfs = n_wfs if n_wfs is not None else self.n_wfs
+        self.spk_length = spk_length if spk_length is not None else self.spk_length
+        self._data = np.zeros((self.n_units, self.n_wfs, self.spk_length), dtype=self._dtype)
+        self._write_ix = np.zeros(self.n_units, dtype=int)
+        self._count = np.zeros(self.n_units, dtype=int)
+        # pyqtgraph `connect` array: join every sample to the next except the last sample of each waveform.
+        connect = np.ones((self.n_wfs, self.spk_length), dtype=bool)
+        connect[:, -1] = False
+        self.connect = connect.ravel()
+
+    def clear(self):
+        self._write_ix[:] = 0
+        self._count[:] = 0
+
+    def count(self, unit_ix):
+        return self._count[unit_ix]
+
+    def add(self, wfs, unit_ids):
+        """
+        Copy new waveforms into the per-unit rings, overwriting the oldest waveforms when full.
+        :param wfs: (n_spikes, spk_length) array of waveforms.
+        :param unit_ids: (n_spikes,) array of sorted unit ids.
+        :return: list of unit indices that received new waveforms.
+        """
+        wfs = np.asarray(wfs)
+        unit_ids = np.asarray(unit_ids, dtype=int)
+        if wfs.ndim != 2 or wfs.shape[0] == 0:
+            return []
+        if wfs.shape[1] != self.spk_length:
+            self.resize(spk_length=wfs.shape[1])
+
+        # Drop empty (all-zero) waveforms and units we have no ring for.
+        b_keep = np.any(wfs != 0, axis=1) & (unit_ids >= 0) & (unit_ids < self.n_units)
+        wfs, unit_ids = wfs[b_keep], unit_ids[b_keep]
+
+        touched = []
+        for unit_ix in np.unique(unit_ids):
+            unit_wfs = wfs[unit_ids == unit_ix][-self.n_wfs:]  # Older ones would be overwritten anyway.
+            n_new = unit_wfs.shape[0]
+            write_ix = (self._write_ix[unit_ix] + np.arange(n_new)) % self.n_wfs
+            self._data[unit_ix, write_ix] = unit_wfs
+            self._write_ix[unit_ix] = (write_ix[-1] + 1) % self.n_wfs
+            self._count[unit_ix] = min(self._count[unit_ix] + n_new, self.n_wfs)
+            touched.append(int(unit_ix))
+        return touched
+
+    def unit_waveforms(self, unit_ix):
+        """
+        Returns a (count, spk_length) view of the stored waveforms for unit_ix.
+        Rows are in ring order, not chronological order, which does not matter for an overlay.
+        """
+        return self._data[unit_ix, :self._count[unit_ix]]
+
+
+class WaveformDensity(object):
+    """
+    Amplitude x time 2-D histogram of every waveform seen on a channel.
+    Old counts decay exponentially so the image follows slow changes in the unit(s) while the memory
+    and rendering cost stay fixed at (spk_length, n_bins) regardless of the spike count.
+    `peak` is the highest count when waveforms were last added; drawn against it, a quiet channel fades out.
+    """
+
+    def __init__(self, y_range, n_bins=128, half_life=10.0, spk_length=48):
+        self.n_bins = n_bins
+        self.half_life = half_life  # seconds
+        self.y_range = y_range
+        self.hist = None
+        self.peak = 0.
+        self._t_last = None
+        self.resize(spk_length)
+
+    def resize(self, spk_length=None):
+        # Axis 0 is time so the array can be passed directly to pg.ImageItem.
+        self.spk_length = spk_length if spk_length is not None else self.spk_length
+        self.hist = np.zeros((self.spk_length, self.n_bins), dtype=np.float32)
+        self.peak = 0.
+        self._t_last = time.monotonic()
+
+    def set_range(self, y_range):
+        self.y_range = y_range
+        self.clear()
+
+    def clear(self):
+        self.hist[:] = 0
+        self.peak = 0.
+        self._t_last = time.monotonic()
+
+    def decay(self):
+        now = time.monotonic()
+        if self.half_life > 0:
+            self.hist *= 0.5 ** ((now - self._t_last) / self.half_life)
+        self._t_last = now
+
+    def add(self, wfs):
+        """
+        :param wfs: (n_spikes, spk_length) array of waveforms, already scaled to plot units.
+        :return: True if any waveform was added.
+        """
+        wfs = np.asarray(wfs)
+        if wfs.ndim != 2 or wfs.shape[0] == 0:
+            return False
+        if wfs.shape[1] != self.spk_length:
+            self.resize(spk_length=wfs.shape[1])
+        wfs = wfs[np.any(wfs != 0, axis=1)]
+        if wfs.shape[0] == 0:
+            return False
+
+        self.decay()
+        # Bin all samples of all waveforms at once. Flat index into hist is time_ix * n_bins + amp_ix.
+        amp_ix = np.floor((wfs + self.y_range) * (self.n_bins / (2 * self.y_range))).astype(int)
+        flat_ix = np.arange(self.spk_length)[None, :] * self.n_bins + amp_ix
+        b_valid = (amp_ix >= 0) & (amp_ix < self.n_bins)
+        counts = np.bincount(flat_ix[b_valid], minlength=self.hist.size)
+        self.hist += counts.reshape(self.hist.shape)
+        self.peak = float(self.hist.max())
+        return True
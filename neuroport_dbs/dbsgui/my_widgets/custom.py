@@ -7,6 +7,8 @@ from cerebuswrapper import CbSdkConnection
 import neuroport_dbs
 import neuroport_dbs.dbsgui.data_source
 from neuroport_dbs.settings import defaults
+from neuroport_dbs.dbsgui.my_models.shared_thresholds import ThresholdSharedMemory
+from neuroport_dbs.dbsgui.workers import SpikeDetection
 
 
 def get_now_time():
@@ -23,6 +25,9 @@ class CustomGUI(QtWidgets.QMainWindow):
     """
     This application is for monitoring continuous activity from a MER data source.
     """
+    # Class-level defaults because on_source_connected might be called during __init__
+    _spike_detection = None
+    _threshold_mem = None
 
     def __init__(self, ini_file=None):
         super(CustomGUI, self).__init__()
@@ -81,6 +86,43 @@ class CustomGUI(QtWidgets.QMainWindow):
         self._data_source = data_source
         # ... continue in child class ...
 
+    def create_spike_source(self, keep_waveforms=True, keep_events=True):
+        """
+        Returns an object with the NSP's spike API (get_waveforms, get_event_data, time): the data source itself
+        if it provides spike events, otherwise a client-side SpikeDetection running on its continuous data.
+        Detection can also be forced with `detector=true` in the [spikes] group of the ini file.
+        """
+        settings = QtCore.QSettings(str(self._settings_path), QtCore.QSettings.IniFormat)
+        force_detector = settings.value("spikes/detector", 'false') == 'true'
+        if self._data_source.has_spike_events and not force_detector:
+            return self._data_source
+
+        src_dict = self._data_source.data_stats
+        n_pre = src_dict.get('spkpretrig', 10)
+        # Data that the source already high-passed are not filtered twice.
+        filter_config = None if self._data_source.is_highpassed else defaults.FILTERCONFIG
+        self._spike_detection = SpikeDetection(self._data_source.get_continuous_data, src_dict['chan_states'],
+                                               src_dict['srate'], filter_config=filter_config,
+                                               keep_waveforms=keep_waveforms, keep_events=keep_events,
+                                               refractory=defaults.REFRACTORYPERIOD, n_pre=n_pre,
+                                               n_post=src_dict.get('spklength', 48) - n_pre,
+                                               auto_threshold=defaults.SPIKETHRESHOLD)
+        self._threshold_mem = ThresholdSharedMemory()
+        self._spike_detection.start()
+        return self._spike_detection
+
+    def update_spike_thresholds(self):
+        # Follow the threshold lines in SweepGUI, if it is running.
+        if self._spike_detection is not None:
+            thresholds = self._threshold_mem.read()
+            if thresholds is not None:
+                self._spike_detection.set_thresholds_uV(thresholds)
+
+    def stop_spike_detection(self):
+        if self._spike_detection is not None:
+            self._spike_detection.stop()
+            self._spike_detection = None
+
     def update(self):
         super(CustomGUI, self).update()
         if self._data_source.is_connected and self.plot_widget:
@@ -0,0 +1,6 @@
+from neuroport_dbs.dbsgui.workers.waveforms import WaveformAcquisition
+from neuroport_dbs.dbsgui.workers.isolation import UnitIsolationWorker
+from neuroport_dbs.dbsgui.workers.spikes import SpikeDetection
+from neuroport_dbs.dbsgui.workers.features import FeaturePrefetch
+from neuroport_dbs.dbsgui.workers.db_writer import DBBatchWriter
+from neuroport_dbs.dbsgui.workers.db_lookup import DBLookup
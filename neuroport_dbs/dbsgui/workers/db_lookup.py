@@ -0,0 +1,97 @@
+import concurrent.futures
+import threading
+
+from qtpy.QtCore import QObject, Signal
+
+
+class DBLookup(QObject):
+    """
+    Runs DBWrapper lookups (enums, subject and procedure lists and details, feature categories) on a background thread
+    and caches their results, so the settings dialog opens without waiting on the database and fills in as results
+    arrive. The cache is shared by all instances and lasts until invalidate() is called after a write.
+    """
+    loaded = Signal(object, object)  # key, result. key: (name, args, kwargs) as given by DBLookup.key
+
+    # Lookups run in order on one thread.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    # Results that change when a subject or procedure is written.
+    WRITE_DEPENDENT = ('list_all_subjects', 'load_subject_details', 'list_all_procedures', 'load_procedure_details')
+
+    def __init__(self, parent=None):
+        super(DBLookup, self).__init__(parent)
+        self._pending = {}  # key -> future
+        self._undelivered = set()  # keys loaded but whose `loaded` is not delivered yet
+        self._pending_lock = threading.Lock()
+        self.loaded.connect(self._on_loaded)
+
+    @staticmethod
+    def key(name, *args, **kwargs):
+        return name, args, repr(sorted(kwargs.items()))
+
+    @classmethod
+    def invalidate(cls, names=WRITE_DEPENDENT):
+        """
+        Drops the cached results of the lookups in names (all if None), e.g., after a subject or procedure was created.
+        """
+        with cls._cache_lock:
+            for key in list(cls._cache.keys()):
+                if names is None or key[0] in names:
+                    del cls._cache[key]
+
+    def get(self, name, *args, **kwargs):
+        """
+        :param name: DBWrapper method, called with args and kwargs, or attribute (e.g., 'all_features').
+        :return: the cached result, or None if it is not cached. It is then loaded and sent with `loaded`.
+        """
+        key = self.key(name, *args, **kwargs)
+        with self._cache_lock:
+            if key in self._cache:
+                return self._cache[key]
+        with self._pending_lock:
+            if key not in self._pending:
+                self._pending[key] = self.executor.submit(self._load, key, args, kwargs)
+        return None
+
+    def _load(self, key, args, kwargs):
+        from serf.tools.db_wrap import DBWrapper
+        try:
+            value = getattr(DBWrapper(), key[0])
+            result = value(*args, **kwargs) if callable(value) else value
+        except Exception as e:
+            print("Database lookup {} failed: {}".format(key[0], e))
+            with self._pending_lock:
+                self._pending.pop(key, None)
+            return
+        with self._cache_lock:
+            self._cache[key] = result
+        with self._pending_lock:
+            self._undelivered.add(key)
+        try:
+            self.loaded.emit(key, result)  # Queued to the GUI thread.
+        except RuntimeError:
+            pass  # Deleted with its dialog.
+        with self._pending_lock:
+            self._pending.pop(key, None)
+
+    def _on_loaded(self, key, result):
+        with self._pending_lock:
+            self._undelivered.discard(key)
+
+    def wait(self, timeout=None):
+        """
+        Blocks, at most timeout seconds, until the pending lookups are done. `loaded` is still delivered later by the
+        event loop.
+        :return: dict {key: result} of the lookups that were pending, or whose `loaded` was not delivered yet, and are
+            now cached.
+        """
+        with self._pending_lock:
+            pending = dict(self._pending)
+        concurrent.futures.wait(list(pending.values()), timeout)
+        with self._pending_lock:
+            keys = set(pending.keys()) | self._undelivered
+            self._undelivered.clear()
+        with self._cache_lock:
+            return {key: self._cache[key] for key in keys if key in self._cache}
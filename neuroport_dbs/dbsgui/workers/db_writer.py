@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+
+from neuroport_dbs.settings.defaults import DB_WRITE_BATCH_SIZE, DB_WRITE_INTERVAL, DB_WRITE_MAX_PENDING
+
+try:
+    from django.db import transaction  # serf's ORM
+except ImportError:
+    transaction = None
+
+
+_FLUSH = object()
+_STOP = object()
+
+
+class DBBatchWriter(object):
+    """
+    Writes to the database on a background thread, in batches.
+    Writes (e.g., save_depth_datum calls) are queued and return immediately. They are run in one transaction per
+    batch, a batch being written when it has batch_size writes or when its oldest write waited interval seconds.
+    The rows of a batch are still inserted one at a time, but they are committed, and so synced to disk, once.
+    The producer (an acquisition or import loop) never waits on the database unless max_pending writes are queued.
+    """
+
+    def __init__(self, db_wrapper, batch_size=DB_WRITE_BATCH_SIZE, interval=DB_WRITE_INTERVAL,
+                 max_pending=DB_WRITE_MAX_PENDING):
+        """
+        :param db_wrapper: DBWrapper whose methods are called, with its subject and procedure already set. It should
+            not be used by another thread while writes are pending.
+        :param batch_size: max number of writes per transaction.
+        :param interval: seconds a write may wait for its batch to fill.
+        :param max_pending: number of queued writes at which submit blocks. 0 for never.
+        """
+        if transaction is None:
+            raise ImportError("DBBatchWriter needs Django, serf's ORM, to write in transactions.")
+        self.db_wrapper = db_wrapper
+        self.batch_size = batch_size
+        self.interval = interval
+        self.n_written = 0
+        self._queue = queue.Queue(max_pending or 0)
+        self._error = None
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._thread = threading.Thread(target=self._run, name='DBBatchWriter', daemon=True)
+        self._thread.start()
+
+    def submit(self, method, callback=None, **kwargs):
+        """
+        Queues db_wrapper.method(**kwargs).
+        :param callback: callable() run on the writer thread once the write is committed.
+        Raises the error of a failed batch, so the producer stops instead of queueing writes that would be lost.
+        """
+        if self._error is not None:
+            raise self._error
+        self.start()
+        self._queue.put((method, kwargs, callback))
+
+    def flush(self):
+        # Blocks until everything submitted so far is written.
+        if self.is_running:
+            self._queue.put(_FLUSH)
+            self._queue.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        """
+        Writes what is queued and stops the thread. Raises the error of a failed batch, if any.
+        """
+        if self.is_running:
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def _write(self, batch):
+        try:
+            with transaction.atomic():
+                for method, kwargs, _ in batch:
+                    getattr(self.db_wrapper, method)(**kwargs)
+        except Exception as e:
+            print("Database write of {} items failed: {}".format(len(batch), e))
+            self._error = self._error or e
+            return
+        self.n_written += len(batch)
+        for _, _, callback in batch:
+            if callback is not None:
+                callback()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.interval
+            while True:
+                if item is _STOP or item is _FLUSH:
+                    stop = item is _STOP
+                    self._queue.task_done()
+                    break
+                if self._error is None:
+                    batch.append(item)
+                else:
+                    self._queue.task_done()  # Dropped; submit raises the error.
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0., deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,127 @@
+import re
+import threading
+import time
+
+import serial
+from qtpy.QtCore import QObject, Signal
+
+
+class DDUReader(QObject):
+    """
+    Reads the depth lines of an FHC drive display unit (DDU) on a background thread.
+    Lines are parsed as soon as their bytes arrive and depth_changed is only emitted when the reading changes, so the
+    delay to the GUI (and on to the NSP and LSL) is the serial transmission time, not a polling period.
+    """
+    depth_changed = Signal(float, float, float)  # raw DDU reading, host time.time(), NSP time (NaN if unavailable)
+    version_detected = Signal(str)  # DDU firmware version, e.g., "2.20"
+    stopped = Signal(str)  # Reason, empty if stopped on request.
+
+    version_pattern = re.compile(r"([0-9]+\.[0-9]+)")
+
+    def __init__(self, port, baudrate=19200, nsp_clock=None, read_timeout=0.05, probe_timeout=1.0, parent=None):
+        """
+        :param port: serial port device, e.g., 'COM3' or '/dev/ttyUSB0'.
+        :param baudrate: DDU baud rate.
+        :param nsp_clock: callable returning the current NSP time, or None. Called on the reader thread.
+        :param read_timeout: seconds a read may block; bounds how long stop() waits for the thread.
+        :param probe_timeout: seconds to wait for the answer to the version query.
+        """
+        super(DDUReader, self).__init__(parent)
+        self._port = port
+        self._baudrate = baudrate
+        self._nsp_clock = nsp_clock
+        self._read_timeout = read_timeout
+        self._probe_timeout = probe_timeout
+        self._ser = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Opens the port and starts reading. Raises serial.SerialException if the port cannot be opened.
+        """
+        if self.is_running:
+            return
+        self._ser = serial.Serial(self._port, baudrate=self._baudrate, timeout=self._read_timeout)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='DDUReader', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+        if self._ser is not None:
+            self._ser.close()
+            self._ser = None
+
+    def _timestamps(self):
+        host_time = time.time()
+        nsp_time = float('nan')
+        if self._nsp_clock is not None:
+            try:
+                nsp_time = float(self._nsp_clock())
+            except Exception:
+                pass
+        return host_time, nsp_time
+
+    def _lines(self):
+        # Yields complete lines as they arrive. Partial lines are kept until their terminator is read.
+        buffer = b''
+        while not self._stop_event.is_set():
+            chunk = self._ser.read(self._ser.in_waiting or 1)  # Blocks for at most read_timeout.
+            if not chunk:
+                yield None  # Lets the caller check timeouts.
+                continue
+            buffer += chunk
+            *lines, buffer = re.split(b'[\r\n]', buffer)
+            for line in lines:
+                line = line.decode('utf-8', errors='replace').strip()
+                if line:
+                    yield line
+
+    def _probe_version(self, lines):
+        # Quiet printing, ask for the version and resume printing.
+        self._ser.write("AXON-\r".encode())
+        self._ser.write("V\r".encode())
+        deadline = time.monotonic() + self._probe_timeout
+        for line in lines:
+            if line is not None:
+                match = self.version_pattern.search(line)
+                if match is not None:
+                    self.version_detected.emit(match.group())
+                    break
+            if time.monotonic() > deadline:
+                break
+        self._ser.write("AXON+\r".encode())
+        # The first response to AXON+ is not a depth.
+        deadline = time.monotonic() + self._probe_timeout
+        for line in lines:
+            if line is not None or time.monotonic() > deadline:
+                break
+
+    def _run(self):
+        reason = ''
+        try:
+            lines = self._lines()
+            self._probe_version(lines)
+            last_str = None
+            for line in lines:
+                if line is None or line == last_str:
+                    continue
+                try:
+                    value = float(line)
+                except ValueError:
+                    print("DDU result: {}".format(line))
+                    continue
+                last_str = line
+                host_time, nsp_time = self._timestamps()
+                self.depth_changed.emit(value, host_time, nsp_time)
+        except (serial.SerialException, OSError) as e:
+            reason = str(e)
+        self.stopped.emit(reason)
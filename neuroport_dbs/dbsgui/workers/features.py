@@ -0,0 +1,127 @@
+import threading
+import time
+
+from neuroport_dbs.settings.defaults import FEATURES_PREFETCH_INTERVAL
+
+
+class FeaturePrefetch(object):
+    """
+    Keeps every (channel, category) series of a procedure warm in a FeatureDataCache on a background thread and
+    collects the new datums of each series for the GUI to push to the matching plot widget.
+    All database reads happen on this thread, so the GUI thread never waits on the database.
+    """
+
+    def __init__(self, cache, interval=0.1, refresh_interval=FEATURES_PREFETCH_INTERVAL, foreground_only=('Raw',)):
+        """
+        :param cache: FeatureDataCache through which all series are read.
+        :param interval: seconds between passes over the stale series.
+        :param refresh_interval: seconds between fallback re-checks of every series, for writers that do not notify.
+        :param foreground_only: categories that are only prefetched for the current series. Raw data of every channel
+            would not fit in the cache together, and evicting them from each other would reload them on every pass.
+        """
+        self.cache = cache
+        self._interval = interval
+        self._refresh_interval = refresh_interval
+        self._foreground_only = foreground_only
+        self._procedure_id = None
+        self._series = []  # list of (chan_lbl, category, do_hp)
+        self._current = None
+        self._pushed = {}  # series -> newest datum_id handed to the GUI
+        self._deltas = {}  # series -> {datum_id: data} not yet taken by the GUI
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='FeaturePrefetch', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def set_series(self, procedure_id, series):
+        """
+        :param procedure_id: procedure whose data are prefetched.
+        :param series: list of (chan_lbl, category, do_hp) to keep warm.
+        """
+        with self._lock:
+            if procedure_id != self._procedure_id:
+                self._pushed = {}
+                self._deltas = {}
+            self._procedure_id = procedure_id
+            self._series = list(series)
+
+    def set_current(self, chan_lbl, category, do_hp=True):
+        # The displayed series is refreshed first in each pass.
+        with self._lock:
+            self._current = (chan_lbl, category, do_hp)
+
+    def request(self, chan_lbl, category, do_hp=True):
+        # Send the full series again, e.g., after the plot was cleared.
+        series = (chan_lbl, category, do_hp)
+        with self._lock:
+            self._pushed.pop(series, None)
+            self._deltas.pop(series, None)
+            if series not in self._series:
+                self._series.append(series)
+        self.cache.mark_stale(chan_lbl, category)
+
+    def take_deltas(self):
+        """
+        :return: dict {(chan_lbl, category, do_hp): {datum_id: data}} of datums not yet taken.
+        """
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        return deltas
+
+    def _run(self):
+        last_refresh = time.monotonic()
+        while not self._stop_event.is_set():
+            if time.monotonic() - last_refresh > self._refresh_interval:
+                self.cache.mark_stale()
+                last_refresh = time.monotonic()
+            try:
+                self.prefetch_stale()
+            except Exception as e:
+                # E.g., the database connection was lost. The series that failed are still stale and retried.
+                print("Feature prefetch failed: {}".format(e))
+            self._stop_event.wait(self._interval)
+
+    def prefetch_stale(self):
+        with self._lock:
+            procedure_id = self._procedure_id
+            series_list = [_ for _ in self._series if _[1] not in self._foreground_only]
+            if self._current in self._series:
+                if self._current in series_list:
+                    series_list.remove(self._current)
+                series_list.insert(0, self._current)
+        if procedure_id is None:
+            return
+
+        for series in series_list:
+            if self._stop_event.is_set():
+                return
+            chan_lbl, category, do_hp = series
+            with self._lock:
+                pushed = self._pushed.get(series)
+            if pushed is not None and not self.cache.is_stale(procedure_id, chan_lbl, category, do_hp=do_hp):
+                continue
+            new_data = self.cache.get(procedure_id, chan_lbl, category, gt=pushed or 0, do_hp=do_hp)
+            with self._lock:
+                if procedure_id != self._procedure_id:
+                    return
+                if new_data:
+                    self._deltas.setdefault(series, {}).update(new_data)
+                    self._pushed[series] = max(new_data.keys())
+                else:
+                    self._pushed.setdefault(series, 0)
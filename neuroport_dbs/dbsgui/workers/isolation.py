@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+
+from neuroport_dbs.dbsgui.my_models.unit_isolation import UnitIsolation
+
+
+class UnitIsolationWorker(object):
+    """
+    Maintains a UnitIsolation model per channel on a background thread.
+    Waveforms and spike timestamps are queued with `submit` (cheap, callable from any thread) and the isolation metrics
+    are recomputed at most every `interval` seconds for the channels that received new waveforms.
+    The queue is bounded: when the worker falls behind, the oldest submissions are dropped.
+    The GUI collects the latest results with `take_metrics`; nothing here touches the render path.
+    """
+
+    def __init__(self, labels, srate, interval=1.0, max_queue=1000, **isolation_kwargs):
+        self._models = {lbl: UnitIsolation(srate=srate, **isolation_kwargs) for lbl in labels}
+        self._interval = interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._generation = 0  # Incremented by clear(). Submissions of older generations are dropped.
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='UnitIsolationWorker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, line_label, wfs, unit_ids, unit_timestamps=None):
+        # Arguments as in UnitIsolation.add
+        item = (self._generation, line_label, wfs, unit_ids, unit_timestamps)
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()  # Drop the oldest.
+                except queue.Empty:
+                    pass
+
+    def clear(self):
+        # The models are cleared on the worker thread so they are never shared.
+        self._generation += 1
+
+    def _run(self):
+        changed = set()
+        generation = self._generation
+        t_next = time.monotonic() + self._interval
+        while not self._stop_event.is_set():
+            try:
+                item = self._queue.get(timeout=max(0., t_next - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if generation != self._generation:
+                generation = self._generation
+                for model in self._models.values():
+                    model.clear()
+                changed = set(self._models.keys())
+            if item is not None and item[0] == generation and item[1] in self._models:
+                self._models[item[1]].add(*item[2:])
+                changed.add(item[1])
+
+            if time.monotonic() >= t_next:
+                new_metrics = {lbl: self._models[lbl].metrics() for lbl in changed}
+                with self._lock:
+                    self._metrics.update(new_metrics)
+                changed = set()
+                t_next = time.monotonic() + self._interval
+
+    def take_metrics(self):
+        """
+        :return: dict of {line_label: {unit_ix: {'n', 'snr', 'l_ratio', 'isi_violations'}}}
+            for channels whose metrics were recomputed since the previous call.
+        """
+        with self._lock:
+            metrics, self._metrics = self._metrics, {}
+        return metrics
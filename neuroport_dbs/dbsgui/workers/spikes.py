@@ -0,0 +1,144 @@
+import collections
+import threading
+import time
+import numpy as np
+from scipy import signal
+
+from neuroport_dbs.settings.defaults import UNIT_SCALING
+from neuroport_dbs.dbsgui.my_models.spike_detector import ThresholdDetector
+
+
+class SpikeDetection(object):
+    """
+    Detects spikes client-side in the continuous data of any data source, on a background thread.
+    It offers the same spike API as the NSP (`get_waveforms(chan_id)` and `get_event_data()`), so the
+    Raster and Waveform GUIs work unchanged with sources that do not provide spike events (e.g., LSL, replay).
+    Waveforms and timestamps are in the data source's raw units and sample clock, like the NSP's.
+    """
+
+    def __init__(self, fetch_continuous, chan_states, srate, filter_config=None,
+                 keep_waveforms=True, keep_events=True, max_chunks=100, interval=0.005, **detector_kwargs):
+        """
+        :param fetch_continuous: callable returning a list of [chan_id, 1-D data array], or None.
+            All channels are assumed to be delivered together.
+        :param chan_states: list of channel dicts with at least 'name' and 'src', optionally 'gain' (uV per unit).
+            Channels without a 'gain' use UNIT_SCALING, as SweepGUI does, so the thresholds it shares match.
+        :param srate: sampling rate in Hz.
+        :param filter_config: dict with keys 'order', 'cutoff', 'type' for the pre-detection filter, or None if the
+            continuous data are already filtered.
+        :param keep_waveforms: queue waveforms for get_waveforms.
+        :param keep_events: queue timestamps for get_event_data.
+        :param max_chunks: maximum number of unclaimed detection results kept per channel.
+        :param detector_kwargs: passed on to ThresholdDetector (refractory, n_pre, n_post, auto_threshold, ...).
+        """
+        self._fetch_continuous = fetch_continuous
+        self._chan_ids = [_['src'] for _ in chan_states]
+        self._gains = np.array([_['gain'] if 'gain' in _ else UNIT_SCALING for _ in chan_states], dtype=float)
+        sos = None
+        if filter_config is not None:
+            sos = signal.butter(filter_config['order'], 2 * filter_config['cutoff'] / srate,
+                                btype=filter_config['type'], output='sos')
+        # Detection runs in uV so thresholds can be shared with SweepGUI's threshold lines.
+        self.detector = ThresholdDetector(len(self._chan_ids), srate, gains=self._gains, sos=sos, **detector_kwargs)
+        self._keep_waveforms = keep_waveforms
+        self._keep_events = keep_events
+        self._interval = interval
+        self._pending = [np.zeros(0) for _ in self._chan_ids]
+        self._waveforms = [collections.deque(maxlen=max_chunks) for _ in self._chan_ids]
+        self._events = [collections.deque(maxlen=max_chunks) for _ in self._chan_ids]
+        self._new_thresholds = None
+        self._last_thresholds = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='SpikeDetection', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def set_thresholds_uV(self, thresholds):
+        """
+        Applied on the worker thread before the next chunk. NaN entries keep the current (possibly estimated) threshold.
+        """
+        thresholds = np.asarray(thresholds, dtype=float)[:len(self._chan_ids)]
+        if self._last_thresholds is not None and np.array_equal(thresholds, self._last_thresholds, equal_nan=True):
+            return
+        self._last_thresholds = thresholds
+        self._new_thresholds = thresholds
+
+    def time(self):
+        # Equivalent of the NSP clock: index of the next sample to be processed.
+        return self.detector.sample_count
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            t_start = time.monotonic()
+            self.process_available()
+            self._stop_event.wait(max(0., self._interval - (time.monotonic() - t_start)))
+
+    def process_available(self):
+        cont_data = self._fetch_continuous()
+        if cont_data:
+            for chan_id, data in cont_data:
+                if chan_id in self._chan_ids:
+                    ch_ix = self._chan_ids.index(chan_id)
+                    self._pending[ch_ix] = np.concatenate((self._pending[ch_ix], np.asarray(data, dtype=float)))
+        n_samples = min([_.shape[0] for _ in self._pending])
+        if n_samples == 0:
+            return
+
+        new_thresholds, self._new_thresholds = self._new_thresholds, None
+        if new_thresholds is not None:
+            b_set = ~np.isnan(new_thresholds)
+            self.detector.thresholds[:new_thresholds.shape[0]][b_set] = new_thresholds[b_set]
+
+        chunk = np.vstack([_[:n_samples] for _ in self._pending])
+        self._pending = [_[n_samples:] for _ in self._pending]
+        results = self.detector.process(chunk)
+        with self._lock:
+            for ch_ix, (timestamps, wfs) in enumerate(results):
+                if timestamps.size == 0:
+                    continue
+                if self._keep_waveforms:
+                    self._waveforms[ch_ix].append(wfs / self._gains[ch_ix])  # Back to raw units, like the NSP.
+                if self._keep_events:
+                    self._events[ch_ix].append(timestamps)
+
+    def get_waveforms(self, chan_id):
+        """
+        :return: (waveforms, unit_ids) detected on chan_id since the previous call. All spikes are unit 0.
+        """
+        ch_ix = self._chan_ids.index(chan_id)
+        with self._lock:
+            chunks = list(self._waveforms[ch_ix])
+            self._waveforms[ch_ix].clear()
+        if len(chunks) == 0:
+            return np.zeros((0, self.detector.n_pre + self.detector.n_post)), np.zeros(0, dtype=int)
+        wfs = np.concatenate(chunks, axis=0)
+        return wfs, np.zeros(wfs.shape[0], dtype=int)
+
+    def get_event_data(self):
+        """
+        :return: list of [chan_id, {'timestamps': [timestamps]}] for channels with spikes since the previous call,
+            in the same format as the NSP's event data (single unit).
+        """
+        ev_data = []
+        with self._lock:
+            for ch_ix, chan_id in enumerate(self._chan_ids):
+                if len(self._events[ch_ix]) > 0:
+                    ev_data.append([chan_id, {'timestamps': [np.concatenate(list(self._events[ch_ix]))]}])
+                    self._events[ch_ix].clear()
+        return ev_data
@@ -0,0 +1,106 @@
+import threading
+import time
+
+
+class WaveformAcquisition(object):
+    """
+    Fetches the waveforms (and optionally the spike timestamps) of all channels on a background thread.
+    New waveforms are handed to `ingest` (which copies them into the per-unit stores) as soon as they
+    arrive, and a summary of what changed is accumulated until the GUI collects it with `take_batch`.
+    This keeps the data-source round trips off the GUI thread.
+    """
+
+    def __init__(self, fetch_waveforms, chan_ids, ingest, fetch_comments=None, fetch_events=None, consumers=(),
+                 interval=0.01):
+        """
+        :param fetch_waveforms: callable(chan_id) returning (waveforms, unit_ids).
+        :param chan_ids: dict of {line_label: chan_id}.
+        :param ingest: callable(line_label, waveforms, unit_ids) returning (touched_units, density_changed).
+            Called from the worker thread.
+        :param fetch_comments: optional callable() returning a list of comments.
+        :param fetch_events: optional callable() returning the NSP's event data: a list of
+            [chan_id, {'timestamps': [timestamps of unit 0, timestamps of unit 1, ...]}].
+        :param consumers: callables(line_label, waveforms, unit_ids, unit_timestamps) that also receive every new
+            waveform (e.g., UnitIsolationWorker.submit). unit_timestamps is the channel's 'timestamps' from
+            fetch_events, or None; waveforms is None when only timestamps arrived.
+            Called from the worker thread so they must not block.
+        :param interval: minimum time in seconds between polls of all channels.
+        """
+        self._fetch_waveforms = fetch_waveforms
+        self._chan_ids = dict(chan_ids)
+        self._ingest = ingest
+        self._fetch_comments = fetch_comments
+        self._fetch_events = fetch_events
+        self._consumers = list(consumers)
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._batch = {}
+        self._comments = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='WaveformAcquisition', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            t_start = time.monotonic()
+            self.fetch_all()
+            self._stop_event.wait(max(0., self._interval - (time.monotonic() - t_start)))
+
+    def fetch_all(self):
+        events = {}
+        if self._fetch_events is not None:
+            events = {chan_id: ev_dict['timestamps'] for chan_id, ev_dict in (self._fetch_events() or [])}
+        for line_label, chan_id in self._chan_ids.items():
+            wfs, unit_ids = self._fetch_waveforms(chan_id)
+            unit_timestamps = events.get(chan_id)
+            if wfs is None or len(wfs) == 0:
+                if unit_timestamps is not None:
+                    for consumer in self._consumers:
+                        consumer(line_label, None, None, unit_timestamps)
+                continue
+            touched, density_changed = self._ingest(line_label, wfs, unit_ids)
+            for consumer in self._consumers:
+                consumer(line_label, wfs, unit_ids, unit_timestamps)
+            with self._lock:
+                if line_label not in self._batch:
+                    self._batch[line_label] = {'units': set(), 'density': False}
+                entry = self._batch[line_label]
+                entry['units'].update(touched)
+                entry['density'] = entry['density'] or density_changed
+
+        if self._fetch_comments is not None:
+            comments = self._fetch_comments()
+            if comments:
+                with self._lock:
+                    self._comments.extend(comments)
+
+    def take_batch(self):
+        """
+        :return: dict of {line_label: {'units': set of unit indices with new waveforms,
+                                       'density': True if the density image changed}}
+            for all waveforms that arrived since the previous call.
+        """
+        with self._lock:
+            batch, self._batch = self._batch, {}
+        return batch
+
+    def take_comments(self):
+        with self._lock:
+            comments, self._comments = self._comments, []
+        return comments
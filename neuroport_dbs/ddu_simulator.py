@@ -0,0 +1,216 @@
+"""
+Simulates an FHC drive display unit (DDU) on a pseudo-terminal so DDUGUI can be tested without hardware.
+
+    python -m neuroport_dbs.ddu_simulator --version 2.20 --rate 10 --burst-prob 0.05 --probe-lsl
+
+Open the printed port in DDUGUI (e.g., /dev/pts/5). With --probe-lsl and/or --probe-nsp, the simulator also
+listens to what DDUGUI publishes and prints the serial-to-LSL and serial-to-comment latencies on exit (Ctrl+C).
+Linux / macOS only.
+"""
+import argparse
+import os
+import re
+import select
+import threading
+import time
+import tty
+
+import numpy as np
+
+
+class DDUSimulator(object):
+    """
+    Answers the AXON-/V/AXON+ handshake and streams depth readings on the master side of a pty.
+    Firmware < 2 prints depths in mm; firmware >= 2 prints integer um relative to 60 mm (DDUGUI's is_v2 path).
+    """
+
+    def __init__(self, version='2.20'):
+        self.version = version
+        self.is_v2 = int(version.split('.')[0]) >= 2
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._quiet = False
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.sent = {}  # depth string ("{:.3f}" in mm) -> time.time() it was last written
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._handle_commands, name='DDUSimulator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # The thread is joined first so its file descriptor cannot be reused by another pty while it reads.
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._slave)
+        os.close(self._master)
+
+    def _write_line(self, text):
+        with self._write_lock:
+            os.write(self._master, (text + '\r\n').encode())
+
+    def _handle_commands(self):
+        buffer = b''
+        while not self._stop_event.is_set():
+            if not select.select([self._master], [], [], 0.05)[0]:
+                continue
+            try:
+                buffer += os.read(self._master, 64)
+            except OSError:
+                return
+            *commands, buffer = buffer.split(b'\r')
+            for cmd in commands:
+                cmd = cmd.decode(errors='replace').strip()
+                if cmd == 'AXON-':
+                    self._quiet = True
+                elif cmd == 'V':
+                    self._write_line("FHC DDU V{}".format(self.version))
+                elif cmd == 'AXON+':
+                    self._quiet = False  # Before the answer, so readings sent after it are printed.
+                    self._write_line("AXON+")
+
+    def send_depth(self, depth):
+        """
+        :param depth: depth in mm, as DDUGUI should display it with the default DTT and offset.
+        """
+        if self._quiet:
+            return
+        reading = str(int(round((depth - 60.) * 1000))) if self.is_v2 else "{:.3f}".format(depth)
+        self.sent["{:.3f}".format(depth)] = time.time()
+        self._write_line(reading)
+
+
+def random_trajectory(start=-10., stop=10., step_um=10, rate=10., burst_prob=0., burst_len=20, burst_rate=500.,
+                      rng=None):
+    """
+    Yields (depth in mm, seconds until the next reading) for a drive that advances from start to stop.
+    A burst is burst_len readings at burst_rate, as when the drive is turned quickly.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    depth = start
+    while depth < stop:
+        n_steps = burst_len if rng.random() < burst_prob else 1
+        for _ in range(n_steps):
+            depth = min(round(depth + step_um / 1000. * rng.integers(1, 4), 3), stop)
+            yield depth, 1 / (burst_rate if n_steps > 1 else rate)
+
+
+def scripted_trajectory(path, rate=10.):
+    # One depth (mm) per line, optionally preceded by the seconds to wait after it: "<depth> [<delay>]".
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if parts:
+                yield float(parts[0]), float(parts[1]) if len(parts) > 1 else 1 / rate
+
+
+class LatencyProbe(object):
+    """
+    Matches what DDUGUI publishes (LSL samples or DTT comments) with what the simulator sent.
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.latencies = {'lsl': [], 'nsp': []}
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self, lsl=True, nsp=False):
+        if lsl:
+            self._threads.append(threading.Thread(target=self._probe_lsl, daemon=True))
+        if nsp:
+            self._threads.append(threading.Thread(target=self._probe_nsp, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(1.0)
+
+    def _record(self, key, depth, received):
+        sent = self.simulator.sent.get("{:.3f}".format(depth))
+        if sent is not None:
+            self.latencies[key].append(received - sent)
+
+    def _probe_lsl(self):
+        import pylsl
+        streams = pylsl.resolve_byprop('name', 'electrode_depth', timeout=10)
+        if not streams:
+            print("No electrode_depth LSL stream found.")
+            return
+        inlet = pylsl.StreamInlet(streams[0])
+        while not self._stop_event.is_set():
+            sample, _ = inlet.pull_sample(timeout=0.1)
+            if sample is not None:
+                self._record('lsl', sample[0], time.time())
+
+    def _probe_nsp(self, interval=0.005):
+        # The comment latency includes up to `interval` of polling.
+        from cerebuswrapper import CbSdkConnection
+        cbsdk_conn = CbSdkConnection()
+        cbsdk_conn.connect()
+        cbsdk_conn.cbsdk_config = {'reset': True, 'get_events': False, 'get_comments': True,
+                                   'buffer_parameter': {'comment_length': 10}}
+        rexp = re.compile(r'DTT:(?P<depth>-?\d*\.?\d+)')
+        while not self._stop_event.is_set():
+            for com in cbsdk_conn.get_comments() or []:
+                match = rexp.match(com[1].decode('utf-8'))
+                if match:
+                    self._record('nsp', float(match.group('depth')), time.time())
+            self._stop_event.wait(interval)
+
+    def report(self):
+        for key, values in self.latencies.items():
+            if values:
+                values = 1000 * np.asarray(values)
+                print("serial-to-{}: n={} median={:.1f} ms p95={:.1f} ms max={:.1f} ms".format(
+                    key.upper(), values.size, np.median(values), np.percentile(values, 95), values.max()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FHC DDU simulator on a pseudo-terminal.")
+    parser.add_argument('--version', default='2.20', help="Firmware version to report, e.g., 1.10 or 2.20.")
+    parser.add_argument('--rate', type=float, default=10., help="Readings per second outside bursts.")
+    parser.add_argument('--burst-rate', type=float, default=500., help="Readings per second during bursts.")
+    parser.add_argument('--burst-prob', type=float, default=0., help="Probability that a step starts a burst.")
+    parser.add_argument('--burst-len', type=int, default=20, help="Number of readings in a burst.")
+    parser.add_argument('--step-um', type=int, default=10, help="Smallest depth step in um.")
+    parser.add_argument('--start', type=float, default=-10., help="Start depth in mm.")
+    parser.add_argument('--stop', type=float, default=10., help="Stop depth in mm.")
+    parser.add_argument('--script', default=None, help="File of depths to play instead of a random trajectory.")
+    parser.add_argument('--wait', type=float, default=10., help="Seconds to wait for DDUGUI to open the port.")
+    parser.add_argument('--probe-lsl', action='store_true', help="Measure serial-to-LSL latency.")
+    parser.add_argument('--probe-nsp', action='store_true', help="Measure serial-to-comment latency.")
+    args = parser.parse_args()
+
+    simulator = DDUSimulator(version=args.version)
+    simulator.start()
+    print("DDU simulator (firmware {}) on {}".format(args.version, simulator.port))
+
+    probe = LatencyProbe(simulator)
+    probe.start(lsl=args.probe_lsl, nsp=args.probe_nsp)
+    time.sleep(args.wait)
+
+    trajectory = scripted_trajectory(args.script, rate=args.rate) if args.script else \
+        random_trajectory(args.start, args.stop, step_um=args.step_um, rate=args.rate, burst_prob=args.burst_prob,
+                          burst_len=args.burst_len, burst_rate=args.burst_rate)
+    try:
+        for depth, delay in trajectory:
+            simulator.send_depth(depth)
+            time.sleep(delay)
+        time.sleep(1.)  # Let the last readings through.
+    except KeyboardInterrupt:
+        pass
+    finally:
+        probe.stop()
+        simulator.stop()
+        probe.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,19 @@
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from matplotlib import cm
 import numpy as np
 
 # use the same GUI format as the other ones
 from qtpy.QtWidgets import QGridLayout, QWidget, QVBoxLayout, QApplication
-from qtpy.QtCore import QEvent, Qt
-from qtpy.QtGui import QColor, QFont
+from qtpy.QtCore import QEvent, Qt, QTimer, QRectF, Signal
+from qtpy.QtGui import QColor, QFont, QGuiApplication
 
 import pyqtgraph as pg
 
 from neuroport_dbs.settings.defaults import THEMES, DEPTHRANGE, DEPTHTARGET, NPLOTSRAW
+from neuroport_dbs.dbsgui.my_models.depth_spectrogram import DepthSpectrogram
+from neuroport_dbs.dbsgui.my_models.raw_segments import RawSegmentStore, MinMaxPyramid
 pen_colors = THEMES['dark']['pencolors']
 
 # Plot settings dictionaries
@@ -77,22 +82,135 @@ class BasePlotWidget(QWidget):
 
         self.line = None
         self.text = None
+        self.scatter = None
+        self.error_bars = None
 
         self.data = {}
+        self.init_points()
+        self._n_open_updates = 0  # nesting depth of begin_update
+        self._needs_redraw = False
+        # Image plots: one column per depth, interpolated at display resolution.
+        self.spectrogram = DepthSpectrogram(int(np.ceil(self.plot_config['y_range'][1]))) \
+            if self.plot_config['image_plot'] else None
+
+        # Hover updates are coalesced to one per display frame.
+        self._hover_pos = None
+        self._hover_timer = QTimer(self)
+        self._hover_timer.setSingleShot(True)
+        screen = QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen is not None else 0
+        self._hover_timer.setInterval(int(1000 / (refresh_rate if refresh_rate > 0 else 60)))
+        self._hover_timer.timeout.connect(self.update_hover)
 
         self.configure_plot()
+        if self.spectrogram is not None:
+            # The image is re-rendered at the new resolution when the view changes.
+            self.plot.vb.sigResized.connect(self.refresh_image)
+            self.plot.vb.sigXRangeChanged.connect(self.refresh_image)
 
     def leaveEvent(self, QEvent):
         self.clear_text_line()
         super().leaveEvent(QEvent)
 
     def clear_text_line(self):
+        self._hover_timer.stop()
+        self._hover_pos = None
         if self.line:
             self.line.setValue(-999999)
         if self.text:
             self.text.setText('')
             self.text.fill.setColor(QColor(0, 0, 0, 0))
-        [x.setSymbolSize(6) for x in self.plot.curves]
+        self.highlight_row(None)
+
+    def init_points(self):
+        # All the points of the plot live in arrays with one row per depth, in order of arrival.
+        #  A depth can have several values (columns); unused columns are NaN.
+        self._row = {}  # depth -> row
+        self._sorted_depths = []  # for lookups by position
+        self._n_rows = 0
+        self._depths = np.zeros(16)
+        self._values = np.full((16, 1), np.nan)
+        self._valid = np.zeros(16, dtype=bool)
+        self._err = np.full(16, np.nan)
+        self._spot_start = np.zeros(1, dtype=int)  # row -> index of its first spot in the scatter
+        self._highlight = None  # highlighted row
+
+    def set_depth_values(self, depth, values, valid=True, err=None):
+        """
+        Add the values at a new depth or replace those of a depth already plotted. Call refresh_points to draw.
+        """
+        row = self._row.get(depth)
+        if row is None:
+            if self._n_rows == self._depths.shape[0]:
+                # Grow by doubling.
+                n_new = self._depths.shape[0]
+                self._depths = np.concatenate((self._depths, np.zeros(n_new)))
+                self._values = np.concatenate((self._values, np.full((n_new, self._values.shape[1]), np.nan)))
+                self._valid = np.concatenate((self._valid, np.zeros(n_new, dtype=bool)))
+                self._err = np.concatenate((self._err, np.full(n_new, np.nan)))
+            row = self._n_rows
+            self._n_rows += 1
+            self._row[depth] = row
+            bisect.insort(self._sorted_depths, depth)
+            self._depths[row] = depth
+
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size > self._values.shape[1]:
+            self._values = np.concatenate((self._values, np.full((self._values.shape[0],
+                                                                  values.size - self._values.shape[1]), np.nan)),
+                                          axis=1)
+        self._values[row] = np.nan
+        self._values[row, :values.size] = values
+        self._valid[row] = bool(valid)
+        self._err[row] = np.asarray(err, dtype=float).ravel()[0] if err is not None else np.nan
+
+    def create_point_items(self):
+        # One item for all the points (and one for all the error bars) instead of one per depth.
+        #  Created on first use so plots that draw their own items (e.g., raw traces) do not get them.
+        self._brushes = [pg.mkBrush(None), pg.mkBrush(self.plot_config['pen_color'])]  # [invalid, valid]
+        self.scatter = pg.ScatterPlotItem(symbol='o', size=6, pen=pg.mkPen(self.plot_config['pen_color']),
+                                          brush=self._brushes[1])
+        self.plot.addItem(self.scatter)
+        if self.plot_config['error_bars']:
+            self.error_bars = pg.ErrorBarItem(x=np.zeros(0), y=np.zeros(0), height=np.zeros(0),
+                                              pen=self.plot_config['pen_color'])
+            self.plot.addItem(self.error_bars)
+
+    def refresh_points(self):
+        # Redraw all points with a single setData.
+        if self.scatter is None:
+            self.create_point_items()
+        n_rows = self._n_rows
+        values = self._values[:n_rows]
+        b_point = ~np.isnan(values)
+        depths = np.broadcast_to(self._depths[:n_rows, None], values.shape)[b_point]
+        valid = np.broadcast_to(self._valid[:n_rows, None], values.shape)[b_point]
+        values = values[b_point]
+        x, y = (values, depths) if self.plot_config['swap_xy'] else (depths, values)
+        self.scatter.setData(x=x, y=y, brush=[self._brushes[_] for _ in valid])
+        # Spots are in row order, so the spots of a row are contiguous.
+        self._spot_start = np.concatenate(([0], np.cumsum(np.sum(b_point, axis=1))))
+        self._highlight = None  # setData reset the sizes
+
+        if self.error_bars is not None:
+            b_err = ~np.isnan(self._err[:n_rows])
+            self.error_bars.setData(x=self._depths[:n_rows][b_err], y=self._values[:n_rows, 0][b_err],
+                                    height=self._err[:n_rows][b_err])
+
+    def refresh_image(self):
+        if self.spectrogram is None or self.spectrogram.depths.shape[0] == 0:
+            return
+        x_range = self.plot.vb.viewRange()[0]
+        image = self.spectrogram.render(x_range, self.plot.vb.width())
+        self.img.setImage(image, autoLevels=False)
+        self.img.setRect(QRectF(x_range[0], 0, x_range[1] - x_range[0], image.shape[1]))
+
+    def clear_points(self):
+        self.init_points()
+        if self.scatter is not None:
+            self.scatter.clear()
+        if self.error_bars is not None:
+            self.error_bars.setData(x=np.zeros(0), y=np.zeros(0), height=np.zeros(0))
 
     def configure_plot(self):
         self.plot.setTitle(title=self.plot_config['title'], **{'color': 'w', 'size': '16pt'})
@@ -114,9 +232,6 @@ class BasePlotWidget(QWidget):
             self.img.setLookupTable(lut)
             self.img.setLevels(pos)
 
-            self.img.scale(1/1000, 1)
-            self.img.setPos(DEPTHRANGE[0], 0)
-
         if self.plot_config['marker_line'] is not None:
             self.plot.addItem(pg.InfiniteLine(angle=0 if self.plot_config['swap_xy'] else 90,
                                               pos=self.plot_config['marker_line'],
@@ -202,42 +317,49 @@ class BasePlotWidget(QWidget):
                                   y=self.plot_config['mouse_enabled'][1])
         return False
 
-    def mouse_moved(self, evt):
-        plot_coord = self.plot.vb.mapSceneToView(evt)
-        closest = -99999
-        value = None
-        curves = [x for x in self.plot.curves if x.opts['symbol']]
-        if self.plot_config['swap_xy']:
-            y_ = [(x.yData[0], x.setSymbolSize(6))[0] for x in curves]
+    def highlight_row(self, row):
+        # Only restyle the spots of the previously and the newly highlighted depths.
+        if row == self._highlight or self.scatter is None:
+            return
+        spots = self.scatter.points()
+        if self._highlight is not None:
+            for spot in spots[self._spot_start[self._highlight]:self._spot_start[self._highlight + 1]]:
+                spot.setSize(6)
+        if row is not None:
+            for spot in spots[self._spot_start[row]:self._spot_start[row + 1]]:
+                spot.setSize(12)
+        self._highlight = row
+
+    def closest_depth(self, pos):
+        # Bisection in the sorted depths.
+        ix = bisect.bisect_left(self._sorted_depths, pos)
+        candidates = self._sorted_depths[max(0, ix - 1):ix + 1]
+        return min(candidates, key=lambda d: abs(d - pos))
 
-            if y_:
-                closest = min(y_, key=lambda x: abs(x - plot_coord.y()))
-                idx = y_.index(closest)
-                value = curves[idx].xData[0]
-                curves[idx].setSymbolSize(12)
+    def mouse_moved(self, evt):
+        self._hover_pos = evt
+        if not self._hover_timer.isActive():
+            self._hover_timer.start()
+
+    def update_hover(self):
+        if self.scatter is None or self._n_rows == 0 or self._hover_pos is None:
+            return
+        plot_coord = self.plot.vb.mapSceneToView(self._hover_pos)
+        closest = self.closest_depth(plot_coord.y() if self.plot_config['swap_xy'] else plot_coord.x())
+        row = self._row[closest]
+        value = self._values[row, 0]
+        self.highlight_row(row)
 
-                self.text.setY(closest)
-                self.text.setX(0)
+        if self.plot_config['swap_xy']:
+            self.text.setY(closest)
+            self.text.setX(0)
         else:
-            # added unique since we can now have multiple points per x value
-            x_ = [(np.unique(x.xData), x.setSymbolSize(6))[0] for x in curves]
-            if x_:
-                closest = min(x_, key=lambda x: abs(x - plot_coord.x()))[0]
-                idx = x_.index(closest)
-                value = curves[idx].yData[0]
-                curves[idx].setSymbolSize(12)
-
-                self.text.setX(min(self.plot.axes['bottom']['item'].range))
-                # self.text.setX(closest)
-                self.text.setY(max(self.plot.axes['left']['item'].range))
-                # self.text.setY(value)
+            self.text.setX(min(self.plot.axes['bottom']['item'].range))
+            self.text.setY(max(self.plot.axes['left']['item'].range))
 
         self.line.setValue(closest)
-
-        if value is not None:
-            self.text.setText('x: ' + "{0:.3f}".format(closest) + '\n' + 'y: ' +
-                              "{0:.3f}".format(value))
-            self.text.fill.setColor(QColor(0, 0, 0, 175))
+        self.text.setText('x: ' + "{0:.3f}".format(closest) + '\n' + 'y: ' + "{0:.3f}".format(value))
+        self.text.fill.setColor(QColor(0, 0, 0, 175))
 
     def mouse_clicked(self, evt):
         if evt.button() == 2:
@@ -252,8 +374,47 @@ class BasePlotWidget(QWidget):
                 if self.plot_config['y_range']:
                     self.plot.setYRange(self.plot_config['y_range'][0], self.plot_config['y_range'][1], padding=0)
 
+    def begin_update(self):
+        """
+        Start a batch of update_plot calls. The data are stored as they arrive but the points, the image, the
+        ranges and the repaint are only refreshed once, by the matching commit_update. Batches can be nested.
+        """
+        self._n_open_updates += 1
+        if self._n_open_updates == 1:
+            self.setUpdatesEnabled(False)
+
+    def commit_update(self):
+        self._n_open_updates = max(0, self._n_open_updates - 1)
+        if self._n_open_updates > 0:
+            return
+        if self._needs_redraw:
+            self._needs_redraw = False
+            self.redraw()
+        self.setUpdatesEnabled(True)  # Schedules a single repaint.
+
+    def request_redraw(self):
+        # Redraw now, or once at the end of the open batch.
+        if self._n_open_updates > 0:
+            self._needs_redraw = True
+        else:
+            self.redraw()
+
+    def redraw(self):
+        if not self.plot_config['image_plot']:
+            self.refresh_points()
+        else:
+            self.refresh_image()
+
+        if self.plot_config['auto_scale']:
+            self.plot.autoRange(padding=0.05, items=self.plot.dataItems)
+            if self.plot_config['x_range']:
+                self.plot.setXRange(self.plot_config['x_range'][0], self.plot_config['x_range'][1],
+                                    padding=0)
+            # self.plot.enableAutoRange(axis=pg.ViewBox.YAxis)
+
     def update_plot(self, all_data):
         if all_data is not None:
+            self.begin_update()
             # all_data is a dict {datum_id: [depth, np array of data]}
             for idx, data in all_data.items():
                 # append data
@@ -261,64 +422,84 @@ class BasePlotWidget(QWidget):
 
                 if x not in [None, ''] and self.plot_config['y_name'] in data:
                     y = data[self.plot_config['y_name']]
-
-                    # if depth data was overwritten, we need to delete previous points and errorbars
-                    if x in self.data.keys():
-                        items = self.plot.items
-                        for i in items:
-                            if type(i) is pg.PlotDataItem:
-                                if any(i.xData == x):
-                                    self.plot.removeItem(i)
-                            if type(i) is pg.ErrorBarItem:
-                                if i.opts['x'][0] == x:
-                                    self.plot.removeItem(i)
-
                     self.data[x] = y
-
-                    if y[2]:
-                        symbol_brush = self.plot_config['pen_color']
-                    else:
-                        symbol_brush = None
+                    valid = y[2]
 
                     # post_processing receives the entire feature value array, typically:
                     # [x, y, valid].
                     # should return an array with values to plot
+                    eb = None
                     if self.plot_config['post_processing'] and not self.plot_config['error_bars']:
                         y = self.plot_config['post_processing'](x, y)
                     elif self.plot_config['post_processing'] and self.plot_config['error_bars']:
                         y, eb = self.plot_config['post_processing'](x, y)
-                        self.plot.addItem(pg.ErrorBarItem(x=[x], y=y, height=eb, pen=self.plot_config['pen_color']))
                     else:
                         y = y[1]
 
                     if not self.plot_config['image_plot']:
-                        # make sure x is a list the same size as y
-                        x = [x] * len(y)
-
-                        self.plot.plot(x=x, y=y, symbol='o', symbolSize=6, pen=None,
-                                       symbolBrush=symbol_brush, symbolPen=self.plot_config['pen_color'])
+                        # Overwritten depth data replace the previous points.
+                        self.set_depth_values(x, y, valid, err=eb)
                     else:
-                        self.img.setImage(y, autoLevels=False)
+                        self.spectrogram.insert(np.round(x, 3), y)
 
-                    if self.plot_config['auto_scale']:
-                        self.plot.autoRange(padding=0.05, items=self.plot.dataItems)
-                        if self.plot_config['x_range']:
-                            self.plot.setXRange(self.plot_config['x_range'][0], self.plot_config['x_range'][1],
-                                                padding=0)
-                        # self.plot.enableAutoRange(axis=pg.ViewBox.YAxis)
+            self.request_redraw()
+            self.commit_update()
 
     def clear_plot(self):
         # rms settings
+        self._needs_redraw = False
         self.plot.clear()
+        self.scatter = None
+        self.error_bars = None
+        self.init_points()
+        if self.spectrogram is not None:
+            self.spectrogram.clear()
         self.configure_plot()
         self.data = {}
 
 
+class PlotGroup(QWidget):
+    """
+    A widget made of several BasePlotWidgets (self.sub_plots) that all plot the same data.
+    update_plot is one transaction over all of them: one redraw per sub-plot and one repaint of the group.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PlotGroup, self).__init__(*args, **kwargs)
+        self.sub_plots = []
+        self._n_open_updates = 0  # nesting depth of begin_update
+
+    def begin_update(self):
+        self._n_open_updates += 1
+        if self._n_open_updates == 1:
+            self.setUpdatesEnabled(False)
+        for sub_plot in self.sub_plots:
+            sub_plot.begin_update()
+
+    def commit_update(self):
+        for sub_plot in self.sub_plots:
+            sub_plot.commit_update()
+        self._n_open_updates = max(0, self._n_open_updates - 1)
+        if self._n_open_updates == 0:
+            self.setUpdatesEnabled(True)
+
+    def update_plot(self, all_data):
+        self.begin_update()
+        for sub_plot in self.sub_plots:
+            sub_plot.update_plot(all_data)
+        self.commit_update()
+
+
 class NullPlotWidget(QWidget):
     def __init__(self, plot_config, *args, **kwargs):
         super(NullPlotWidget, self).__init__(*args, **kwargs)
         self.plot_config = plot_config
 
+    def begin_update(self):
+        pass
+
+    def commit_update(self):
+        pass
+
     def update_plot(self, all_data):
         pass
 
@@ -327,6 +508,10 @@ class NullPlotWidget(QWidget):
 
 
 class RawPlots(QWidget):
+    # Min/max pyramids are built off the GUI thread. One worker is shared by all channels.
+    pyramid_executor = ThreadPoolExecutor(max_workers=1)
+    pyramid_ready = Signal(float, object, int)
+
     def __init__(self, plot_config, *args, **kwargs):
         super(RawPlots, self).__init__(*args, **kwargs)
 
@@ -370,7 +555,13 @@ class RawPlots(QWidget):
         self.layout.setColumnStretch(1, 5)
 
         self.data_figures = []
-        self.depth_pdi = {}  # all depth data
+        self.segments = RawSegmentStore()  # all depth data, int16 in RAM for recent depths, on disk for the others
+        self.pyramids = {}  # depth -> MinMaxPyramid, for drawing segments at display resolution
+        self.pyramid_generation = 0  # bumped on clear so late pyramids of a previous trajectory are dropped
+        self._pyramid_lock = threading.Lock()  # no pyramid is emitted once clear_plot has returned
+        self.pyramid_ready.connect(self.on_pyramid_ready)
+        self._n_open_updates = 0
+        self._new_depth = None  # deepest depth received in the open batch
 
         self.data_texts = []
 
@@ -401,7 +592,7 @@ class RawPlots(QWidget):
         self.depth_plot.clear_text_line()
 
         # set fill area to be the first 8 depths found above the line
-        all_depths = np.sort([x for x in self.depth_pdi.keys()])
+        all_depths = self.segments.depths
         if len(all_depths) > 0:
             curr_value = self.depth_bar.value()
             diffs = abs(all_depths - curr_value)
@@ -411,39 +602,91 @@ class RawPlots(QWidget):
             self.depth_bar.setValue(all_depths[idx])
             self.plot_depth_values()
 
+    def begin_update(self):
+        # See BasePlotWidget.begin_update. The raw panels are redrawn once, for the last depth of the batch.
+        self._n_open_updates += 1
+        if self._n_open_updates == 1:
+            self.setUpdatesEnabled(False)
+            self._new_depth = None
+        self.depth_plot.begin_update()
+
+    def commit_update(self):
+        self.depth_plot.commit_update()
+        self._n_open_updates = max(0, self._n_open_updates - 1)
+        if self._n_open_updates > 0:
+            return
+        if self._new_depth is not None:
+            # move draggable bar to new depth
+            self.depth_bar.setValue(self._new_depth)
+            self.plot_depth_values()
+            self._new_depth = None
+        self.setUpdatesEnabled(True)
+
     # Update plot is only for new datum
     def update_plot(self, all_data):
-        # new_depth = -20
-        new_depth = DEPTHRANGE[0]
         if all_data is not None:
+            self.begin_update()
+            # new_depth = -20
+            new_depth = DEPTHRANGE[0] if self._new_depth is None else self._new_depth
             # all_data is a dict {datum_id: [depth, np array of data]}
             for _, depth_data in all_data.items():
-                # append data
-                if depth_data[0] not in self.depth_pdi.keys():
-                    # instead of saving Plot Data Item, save the data
-                    self.depth_pdi[depth_data[0]] = depth_data[1]
-                else:
-                    # overwritten depth data
-                    if not all(depth_data[1] == self.depth_pdi[depth_data[0]]):
-                        self.depth_pdi[depth_data[0]] = depth_data[1]
+                # append data, or replace overwritten depth data
+                self.segments.put(depth_data[0], depth_data[1])
+                self.pyramids.pop(depth_data[0], None)
+                self.pyramid_executor.submit(self.build_pyramid, depth_data[0], depth_data[1],
+                                             self.pyramid_generation)
 
                 # plot depth
-                symbol_brush = self.pen_color if depth_data[2] else None
-                self.depth_plot.plot.plot(x=[0], y=[depth_data[0]], symbol='o', symbolBrush=symbol_brush,
-                                          symbolPen=self.pen_color, symbolSize=6)
+                self.depth_plot.set_depth_values(depth_data[0], [0], depth_data[2])
 
                 if new_depth == DEPTHRANGE[0] and new_depth > depth_data[0]:
                     new_depth = depth_data[0]
                 else:
                     new_depth = max(depth_data[0], new_depth)
 
-            # move draggable bar to new depth
-            self.depth_bar.setValue(new_depth)
+            self.depth_plot.request_redraw()
+            if all_data:
+                self._new_depth = new_depth
+            self.commit_update()
+
+    def build_pyramid(self, depth, data, generation):
+        # Runs on the pyramid worker. The signal is queued to the GUI thread.
+        #  A widget that was cleared since, e.g., before it was evicted and deleted, is not touched.
+        if generation != self.pyramid_generation:
+            return
+        pyramid = MinMaxPyramid(data)
+        with self._pyramid_lock:
+            if generation == self.pyramid_generation:
+                self.pyramid_ready.emit(depth, pyramid, generation)
+
+    @classmethod
+    def shutdown_pyramids(cls):
+        # At exit, while the widgets still exist: finish the queued builds and accept no more.
+        cls.pyramid_executor.shutdown(wait=True)
+
+    def on_pyramid_ready(self, depth, pyramid, generation):
+        if generation != self.pyramid_generation or depth not in self.segments:
+            return
+        self.pyramids[depth] = pyramid
+        # Redraw if the depth is among the displayed ones.
+        all_depths = self.segments.depths
+        curr_idx = np.searchsorted(all_depths, self.depth_bar.value())
+        depth_idx = np.searchsorted(all_depths, depth)
+        if 0 <= curr_idx - depth_idx < NPLOTSRAW:
             self.plot_depth_values()
 
+    def segment_xy(self, depth, n_px):
+        # Coarsest min/max level that still has a bin per pixel, or the full segment.
+        pyramid = self.pyramids.get(depth)
+        level = pyramid.level_for(n_px) if pyramid is not None else None
+        if level is not None:
+            return level
+        to_plot = self.segments.get(depth)
+        return np.arange(to_plot.shape[0]), to_plot
+
     def plot_depth_values(self):
         # get current index of selected depth
-        all_depths = np.sort([x for x in self.depth_pdi.keys()])
+        all_depths = self.segments.depths
         curr_value = self.depth_bar.value()
 
         idx, = np.where(all_depths == curr_value)[0]
@@ -456,13 +699,14 @@ class RawPlots(QWidget):
         plot_idx = 1
         while plot_idx <= NPLOTSRAW:
             if idx >= top_idx:
-                to_plot = self.depth_pdi[all_depths[idx]]  # data
+                n_px = int(self.data_figures[-plot_idx].plot.vb.width())
+                x, y = self.segment_xy(all_depths[idx], n_px)  # data
                 if len(self.data_figures[-plot_idx].plot.dataItems) == 0:
-                    self.data_figures[-plot_idx].plot.addItem(pg.PlotDataItem(to_plot,
+                    self.data_figures[-plot_idx].plot.addItem(pg.PlotDataItem(x, y,
                                                               pen=self.pen_color,
                                                               autoDownsample=True))
                 else:
-                    self.data_figures[-plot_idx].plot.dataItems[0].setData(to_plot)
+                    self.data_figures[-plot_idx].plot.dataItems[0].setData(x, y)
 
                 self.data_texts[-plot_idx].setText("{0:.3f}".format(all_depths[idx]))
             else:
@@ -476,7 +720,11 @@ class RawPlots(QWidget):
             plot_idx += 1
 
     def clear_plot(self):
-        self.depth_pdi = {}
+        self._new_depth = None
+        self.segments.clear()
+        self.pyramids.clear()
+        with self._pyramid_lock:
+            self.pyramid_generation += 1
 
         # clear depth plot
         # self.depth_bar.setValue(-20)
@@ -485,9 +733,7 @@ class RawPlots(QWidget):
                               y=[DEPTHRANGE[0], DEPTHRANGE[0]],
                               fillLevel=DEPTHRANGE[0])
 
-        for it in self.depth_plot.plot.listDataItems():
-            if it.opts['symbol'] == 'o':
-                self.depth_plot.plot.removeItem(it)
+        self.depth_plot.clear_points()
 
         # clear data plots
         [x.plot.removeItem(x.plot.dataItems[0]) for x in self.data_figures if x.plot.dataItems]
@@ -496,7 +742,7 @@ class RawPlots(QWidget):
             txt.setText("")
 
 
-class STNPlots(QWidget):
+class STNPlots(PlotGroup):
     def __init__(self, plot_config, *args, **kwargs):
         super(STNPlots, self).__init__(*args, **kwargs)
         self.plot_config = plot_config
@@ -533,6 +779,7 @@ class STNPlots(QWidget):
                     'pen_color': pen_color}
         self.pac_plot = BasePlotWidget(pac_sett)
         self.layout.addWidget(self.pac_plot, 2, 0, 1, 1)
+        self.sub_plots = [self.rms_plot, self.bp_plot, self.pac_plot]
 
         self.layout.setRowStretch(0, 1)
         self.layout.setRowStretch(1, 1)
@@ -547,18 +794,13 @@ class STNPlots(QWidget):
         # data contains peak, mean, variance
         return data[1][:1], data[1][-1:]
 
-    def update_plot(self, all_data):
-        self.rms_plot.update_plot(all_data)
-        self.bp_plot.update_plot(all_data)
-        self.pac_plot.update_plot(all_data)
-
     def clear_plot(self):
         self.rms_plot.clear_plot()
         self.bp_plot.clear_plot()
         self.pac_plot.clear_plot()
 
 
-class LFPPlots(QWidget):
+class LFPPlots(PlotGroup):
     def __init__(self, plot_config, *args, **kwargs):
         super(LFPPlots, self).__init__(*args, **kwargs)
 
@@ -616,6 +858,7 @@ class LFPPlots(QWidget):
                         'pen_color': self.pen_color}
         self.b_ep_plot = BasePlotWidget(beta_ep_sett)
         self.layout.addWidget(self.b_ep_plot, 3, 0, 1, 1)
+        self.sub_plots = [self.spectro_plot, self.bp_plot, self.episodes_plot, self.b_ep_plot]
 
         # self.layout.addWidget(QLabel(), 4, 0, 1, 1)
         self.layout.setRowStretch(0, 1)
@@ -623,57 +866,13 @@ class LFPPlots(QWidget):
         self.layout.setRowStretch(2, 1)
         self.layout.setRowStretch(3, 1)
 
-        # 0.001 mm steps
-        self.spectrum_x = np.arange(pwr_sett['x_range'][0] * 1000,
-                                    pwr_sett['x_range'][1] * 1000, 1, dtype=np.int)
-        self.spectrum_depths = np.array(np.round(pwr_sett['x_range'][0]*1000), dtype=np.int)
-        self.spectrum_data = np.zeros((pwr_sett['y_range'][1], self.spectrum_x.shape[0]))
-
-        self.episodes_depths = np.array(np.round(pep_sett['x_range'][0] * 1000), dtype=np.int)
-        self.episodes_data = np.zeros((pep_sett['y_range'][1], self.spectrum_x.shape[0]))
-
         self.depth_data = {}
 
-    def spectrum_process(self, x, data):
+    @staticmethod
+    def spectrum_process(x, data):
         # data is a chan x values array where n values=62 representing 31 power frequency points and 31 p_episode points
-        new_depth = np.round(x*1000)
         new_values = 10 * np.log10(data[1][:data[0].shape[0]])
-        new_values = new_values[:21]  # limit to 64 Hz
-
-        prev_depths = self.spectrum_depths[self.spectrum_depths < new_depth]
-        if prev_depths.shape[0] > 0:
-            prev_depth = prev_depths.max()
-            prev_values = self.spectrum_data[:, self.spectrum_x == prev_depth].flatten()
-
-            depth_diff = new_depth - prev_depth
-            values_diff = new_values - prev_values
-
-            delta = np.arange(0, depth_diff + 1, 1) / depth_diff
-
-            self.spectrum_data[:, np.logical_and(self.spectrum_x >= prev_depth, self.spectrum_x <= new_depth)] = \
-                np.add(np.atleast_2d(prev_values).T, (np.atleast_2d(values_diff).T * delta))
-        else:
-            prev_depth = DEPTHRANGE[0]  # -20.000
-
-        next_depths = self.spectrum_depths[self.spectrum_depths > new_depth]
-        if next_depths.shape[0] > 0:
-            next_depth = next_depths.min()
-            next_values = self.spectrum_data[:, self.spectrum_x == next_depth].flatten()
-
-            depth_diff = next_depth - new_depth
-            values_diff = next_values - new_values
-
-            delta = np.arange(0, depth_diff + 1, 1) / depth_diff
-
-            self.spectrum_data[:, np.logical_and(self.spectrum_x >= new_depth, self.spectrum_x <= next_depth)] = \
-                np.add(np.atleast_2d(new_values).T, (np.atleast_2d(values_diff).T * delta))
-
-        # append new depth
-        self.spectrum_depths = np.insert(self.spectrum_depths,
-                                         np.where(self.spectrum_depths == prev_depth)[0] + 1,
-                                         new_depth)
-
-        return self.spectrum_data.T
+        return new_values[:21]  # limit to 64 Hz
 
     @staticmethod
     def beta_ep_process(x, data):
@@ -687,53 +886,11 @@ class LFPPlots(QWidget):
         pwr = np.mean(new_values[np.logical_and(data[0] >= 13, data[0] <= 30)])
         return [np.log10(pwr)]
 
-    def episodes_process(self, x, data):
+    @staticmethod
+    def episodes_process(x, data):
         # data is a chan x values array where n values=62 representing 31 power frequency points and 31 p_episode points
-        new_depth = np.round(x*1000)
         new_values = data[1][data[0].shape[0]:]
-        new_values = new_values[:21]
-        # new_values = 10*np.log10(data[1][:data[0].shape[0]])
-
-        prev_depths = self.episodes_depths[self.episodes_depths < new_depth]
-        if prev_depths.shape[0] > 0:
-            prev_depth = prev_depths.max()
-            prev_values = self.episodes_data[:, self.spectrum_x == prev_depth].flatten()
-
-            depth_diff = new_depth - prev_depth
-            values_diff = new_values - prev_values
-
-            delta = np.arange(0, depth_diff + 1, 1) / depth_diff
-
-            self.episodes_data[:, np.logical_and(self.spectrum_x >= prev_depth, self.spectrum_x <= new_depth)] = \
-                np.add(np.atleast_2d(prev_values).T, (np.atleast_2d(values_diff).T * delta))
-        else:
-            prev_depth = DEPTHRANGE[0]  # -20.000
-
-        next_depths = self.episodes_depths[self.episodes_depths > new_depth]
-        if next_depths.shape[0] > 0:
-            next_depth = next_depths.min()
-            next_values = self.episodes_data[:, self.spectrum_x == next_depth].flatten()
-
-            depth_diff = next_depth - new_depth
-            values_diff = next_values - new_values
-
-            delta = np.arange(0, depth_diff + 1, 1) / depth_diff
-
-            self.episodes_data[:, np.logical_and(self.spectrum_x >= new_depth, self.spectrum_x <= next_depth)] = \
-                np.add(np.atleast_2d(new_values).T, (np.atleast_2d(values_diff).T * delta))
-
-        # append new depth
-        self.episodes_depths = np.insert(self.episodes_depths,
-                                         np.where(self.episodes_depths == prev_depth)[0] + 1,
-                                         new_depth)
-
-        return self.episodes_data.T
-
-    def update_plot(self, all_data):
-        self.spectro_plot.update_plot(all_data)
-        self.bp_plot.update_plot(all_data)
-        self.episodes_plot.update_plot(all_data)
-        self.b_ep_plot.update_plot(all_data)
+        return new_values[:21]
 
     def clear_plot(self):
         self.spectro_plot.clear_plot()
@@ -744,7 +901,7 @@ class LFPPlots(QWidget):
         self.depth_data = {}
 
 
-class SpikePlots(QWidget):
+class SpikePlots(PlotGroup):
     def __init__(self, plot_config, *args, **kwargs):
         super(SpikePlots, self).__init__(*args, **kwargs)
 
@@ -795,6 +952,7 @@ class SpikePlots(QWidget):
 
         self.ff_plot = BasePlotWidget(ff_sett)
         self.layout.addWidget(self.ff_plot, 3, 0, 1, 1)
+        self.sub_plots = [self.rms_plot, self.rate_plot, self.burst_plot, self.ff_plot]
 
         self.layout.setRowStretch(0, 1)
         self.layout.setRowStretch(1, 1)
@@ -803,12 +961,6 @@ class SpikePlots(QWidget):
 
         self.depth_data = {}
 
-    def update_plot(self, all_data):
-        self.rms_plot.update_plot(all_data)
-        self.rate_plot.update_plot(all_data)
-        self.burst_plot.update_plot(all_data)
-        self.ff_plot.update_plot(all_data)
-
     def clear_plot(self):
         # rms settings
         self.rms_plot.clear_plot()
@@ -819,7 +971,7 @@ class SpikePlots(QWidget):
         self.depth_data = {}
 
 
-class MappingPlots(QWidget):
+class MappingPlots(PlotGroup):
     def __init__(self, plot_config, *args, **kwargs):
         super(MappingPlots, self).__init__(*args, **kwargs)
         self.plot_config = plot_config
@@ -866,6 +1018,7 @@ class MappingPlots(QWidget):
         self.custom_plot = BasePlotWidget(custom_sett)
         self.add_dashed_lines(self.custom_plot.plot)
         self.layout.addWidget(self.custom_plot, 2, 0, 1, 1)
+        self.sub_plots = [self.kin_plot, self.tact_plot, self.custom_plot]
 
         self.layout.setRowStretch(0, 1)
         self.layout.setRowStretch(1, 1)
@@ -895,11 +1048,6 @@ class MappingPlots(QWidget):
             data[1] = [0]
         return data[1]
 
-    def update_plot(self, all_data):
-        self.kin_plot.update_plot(all_data)
-        self.tact_plot.update_plot(all_data)
-        self.custom_plot.update_plot(all_data)
-
     def clear_plot(self):
         self.kin_plot.clear_plot()
         self.tact_plot.clear_plot()
@@ -0,0 +1,323 @@
+"""
+Offline recomputation of the features of stored depth data, for one procedure or the whole archive.
+
+    dbs-recompute --subject-id 123 --procedure-id 4 --features STN LFP --jobs 8
+    dbs-recompute --jobs 8
+
+Features are computed by serf, as in the live Features_Process, in a pool of processes. Each worker writes its
+results through a DBBatchWriter, in one transaction per batch of datums. A category is only recomputed for a datum if
+the datum's data or the category's definition changed since the last run. Fingerprints are kept in a journal, so an
+interrupted run resumes. Stored datums are never modified, so the raw data of a datum are only read (one channel at a
+time) the first time it is fingerprinted; later runs take its fingerprint from the journal and only read one channel
+to list the datums that still exist. A datum that fails is retried on its own, so it does not fail its whole batch.
+
+The workers compute a datum's features with DBWrapper.process_single_datum(datum_id, features), which not every serf
+release has: it is checked for before anything is computed. If it is missing, install serf from its git repository
+(see docs/for-developers.md).
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+from neuroport_dbs.settings.defaults import BASEPATH, DB_WRITE_BATCH_SIZE
+
+JOURNAL_PATH = os.path.join(BASEPATH, 'feature_fingerprints.jsonl')
+REQUIRED_API = ('process_single_datum',)  # DBWrapper methods that the serf release may not have.
+
+
+class FingerprintJournal(object):
+    """
+    Append-only record of the data fingerprint of each datum and of the input fingerprint of each computed
+    (procedure, datum, category). The last entry wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(procedure_id, datum_id, category):
+        return "{}:{}:{}".format(procedure_id, datum_id, category)
+
+    @staticmethod
+    def data_key(procedure_id, datum_id):
+        return "{}:{}".format(procedure_id, datum_id)
+
+    @staticmethod
+    def data_fingerprints(fingerprints, procedure_id):
+        """
+        :param fingerprints: as returned by load.
+        :return: dict {datum_id: data fingerprint} of the datums of procedure_id that were already fingerprinted.
+        """
+        prefix = "{}:".format(procedure_id)
+        return {int(key[len(prefix):]): fp for key, fp in fingerprints.items()
+                if key.startswith(prefix) and key.count(':') == 1}
+
+    @staticmethod
+    def outdated(fingerprints, procedure_id, data_fps, definitions, force=False):
+        """
+        :param fingerprints: as returned by load.
+        :param data_fps: dict {datum_id: data fingerprint} of the datums of procedure_id.
+        :param definitions: dict {category: definition fingerprint} of the categories to compute.
+        :param force: all categories are outdated.
+        :return: dict {tuple of categories: sorted list of datum_ids} grouping the datums by the categories whose
+            inputs changed since they were computed. Up-to-date datums are left out.
+        """
+        todo = {}
+        for datum_id, data_fp in sorted(data_fps.items()):
+            cats = tuple(cat for cat, definition_fp in definitions.items()
+                         if force or fingerprints.get(FingerprintJournal.key(procedure_id, datum_id, cat)) !=
+                         data_fp + definition_fp)
+            if cats:
+                todo.setdefault(cats, []).append(datum_id)
+        return todo
+
+    def load(self):
+        fingerprints = {}
+        if not os.path.exists(self.path):
+            return fingerprints
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Truncated by a crash.
+                fingerprints[entry['key']] = entry['fp']
+        return fingerprints
+
+    def record(self, fingerprints):
+        # :param fingerprints: dict {key: fingerprint}
+        with self._lock, open(self.path, 'a') as f:
+            f.write(''.join(json.dumps({'key': k, 'fp': v}) + '\n' for k, v in fingerprints.items()))
+
+
+def definition_fingerprint(feature):
+    """
+    :param feature: a feature category's implementation, as found in DBWrapper.all_features.
+    :return: hash of its source code, so an edited feature is recomputed.
+    """
+    try:
+        source = inspect.getsource(feature if inspect.isclass(feature) or inspect.isroutine(feature) else type(feature))
+    except (OSError, TypeError):
+        source = repr(feature)
+    return hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+
+
+def datum_fingerprints(db_wrapper, channels, gt=0):
+    """
+    :param gt: only the datums with an id greater than gt (i.e., newer) are read.
+    :return: dict {datum_id: hash of the datum's depth and data on all channels} for the current procedure.
+        Only one channel's data are in memory at a time.
+    """
+    hashes = {}
+    for chan_lbl in channels:
+        chan_data = db_wrapper.load_depth_data(chan_lbl=chan_lbl, gt=gt, do_hp=False, return_uV=True)
+        for datum_id in sorted(chan_data.keys()):
+            # {datum_id: [depth, data, ...]}
+            h = hashes.setdefault(datum_id, hashlib.blake2b(digest_size=16))
+            h.update("{}:{}".format(chan_lbl, chan_data[datum_id][0]).encode())
+            h.update(np.ascontiguousarray(chan_data[datum_id][1]).tobytes())
+        del chan_data
+    return {datum_id: h.hexdigest() for datum_id, h in hashes.items()}
+
+
+def update_data_fingerprints(db_wrapper, data_fps, channels):
+    """
+    :param data_fps: dict {datum_id: data fingerprint} of the current procedure, from the journal.
+    :return: (data_fps of the datums that still exist, e.g., not replaced by a new recording at their depth, and with
+        the new datums added; dict {datum_id: data fingerprint} of the new datums).
+    """
+    channels = list(channels)
+    if not channels:
+        return {}, {}
+    existing = db_wrapper.load_depth_data(chan_lbl=channels[0], gt=0, do_hp=False, return_uV=False).keys()
+    data_fps = {datum_id: fp for datum_id, fp in data_fps.items() if datum_id in existing}
+    new_fps = datum_fingerprints(db_wrapper, channels, gt=max(data_fps, default=0))
+    return {**data_fps, **new_fps}, new_fps
+
+
+def check_api(db_wrapper):
+    missing = [name for name in REQUIRED_API if not callable(getattr(db_wrapper, name, None))]
+    if missing:
+        raise NotImplementedError("The installed serf DBWrapper has no {}, which feature recomputation needs. Install "
+                                  "serf from https://github.com/cboulay/SERF.".format(", ".join(missing)))
+
+
+def select_procedure(db_wrapper, subject_id, procedure_id):
+    """
+    Makes procedure_id the current procedure of db_wrapper, as the settings dialog does.
+    :param subject_id: the subject's id (e.g., its hospital id) as listed by DBWrapper.list_all_subjects.
+    :param procedure_id: the procedure's database id, as listed by DBWrapper.list_all_procedures.
+    :return: the procedure settings, with the subject's database id, to select the same procedure in the workers.
+    """
+    subject_settings = db_wrapper.load_subject_details(subject_id)
+    procedure_settings = db_wrapper.load_procedure_details(procedure_id, exclude=['subject', 'procedure_id'])
+    procedure_settings['subject_id'] = db_wrapper.load_or_create_subject(subject_settings)
+    db_wrapper.load_or_create_procedure(procedure_settings)
+    return procedure_settings
+
+
+def list_procedures(db_wrapper):
+    """
+    :return: list of (subject_id, procedure_id) of the whole archive.
+    """
+    procedures = []
+    for subject_id in db_wrapper.list_all_subjects():
+        details = db_wrapper.load_subject_details(subject_id)
+        procedures += [(subject_id, proc.procedure_id)
+                       for proc in db_wrapper.list_all_procedures(details['subject_id'])]
+    return procedures
+
+
+_worker = {}  # Per-process DBWrapper and currently selected procedure id.
+
+
+def _write_datums(db_wrapper, datum_ids, categories, done, batch_size=DB_WRITE_BATCH_SIZE):
+    # Raises the error of the first batch that failed; the datums of the batches committed before it are in done.
+    from neuroport_dbs.dbsgui.workers.db_writer import DBBatchWriter
+    writer = DBBatchWriter(db_wrapper, batch_size=batch_size, max_pending=0)
+    try:
+        for datum_id in datum_ids:
+            writer.submit('process_single_datum', callback=lambda datum_id=datum_id: done.append(datum_id),
+                          datum_id=datum_id, features=categories)
+    finally:
+        writer.close()
+
+
+def compute_datums(procedure_id, procedure_settings, datum_ids, categories):
+    """
+    Recomputes categories for datum_ids of procedure_id in a worker process. Writes are committed in batches.
+    The procedure was resolved by the parent process; the worker only loads it.
+    :param procedure_settings: as returned by select_procedure.
+    :return: (list of the datum_ids whose features were committed, dict {datum_id: error} of those that failed).
+    """
+    if 'db_wrapper' not in _worker:
+        from serf.tools.db_wrap import DBWrapper
+        _worker['db_wrapper'] = DBWrapper()
+        check_api(_worker['db_wrapper'])
+    db_wrapper = _worker['db_wrapper']
+    if _worker.get('procedure_id') != procedure_id:
+        db_wrapper.load_or_create_procedure(procedure_settings)
+        _worker['procedure_id'] = procedure_id
+
+    done, failed = [], {}
+    try:
+        _write_datums(db_wrapper, datum_ids, categories, done)
+    except Exception:
+        # The failed batch was rolled back. Its datums, and the ones after, are retried one per transaction.
+        for datum_id in [_ for _ in datum_ids if _ not in done]:
+            try:
+                _write_datums(db_wrapper, [datum_id], categories, done, batch_size=1)
+            except Exception as e:
+                failed[datum_id] = str(e)
+    return done, failed
+
+
+def run_recompute(procedures, categories=None, journal_path=JOURNAL_PATH, n_workers=None, force=False,
+                  chunk_size=DB_WRITE_BATCH_SIZE):
+    """
+    :param procedures: list of (subject_id, procedure_id).
+    :param categories: feature categories to recompute. None for all.
+    :param journal_path: fingerprint journal; datums whose inputs did not change are skipped.
+    :param n_workers: number of processes. None for one per CPU core.
+    :param force: recompute even if the inputs did not change.
+    :param chunk_size: datums per pool task. Bounds the work and results held per worker.
+    :return: dict of aggregate statistics.
+    """
+    from serf.tools.db_wrap import DBWrapper
+    db_wrapper = DBWrapper()
+    check_api(db_wrapper)  # Fail before starting the pool.
+    categories = list(categories or [cat for cat in db_wrapper.all_features.keys() if cat != 'Raw'])
+    definitions = {cat: definition_fingerprint(db_wrapper.all_features[cat]) for cat in categories}
+    journal = FingerprintJournal(journal_path)
+    known = journal.load()
+
+    n_workers = n_workers or os.cpu_count() or 1
+    totals = {'n_procedures': 0, 'n_datums': 0, 'n_skipped': 0, 'n_failed': 0}
+    t_start = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers,
+                                                mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {}  # future -> (procedure id, {datum_id: data fingerprint}, categories)
+
+        def collect(wait_for):
+            done, _ = concurrent.futures.wait(list(futures.keys()), return_when=wait_for)
+            for future in done:
+                procedure_id, data_fps, cats = futures.pop(future)
+                try:
+                    datum_ids, failed = future.result()
+                except Exception as e:
+                    totals['n_failed'] += len(data_fps)
+                    print("Procedure {}: {} datums failed: {}".format(procedure_id, len(data_fps), e))
+                    continue
+                for datum_id, error in failed.items():
+                    print("Procedure {}: datum {} failed: {}".format(procedure_id, datum_id, error))
+                totals['n_failed'] += len(failed)
+                totals['n_datums'] += len(datum_ids)
+                journal.record({FingerprintJournal.key(procedure_id, datum_id, cat): data_fps[datum_id] +
+                                definitions[cat] for datum_id in datum_ids for cat in cats})
+
+        for subject_id, procedure_id in procedures:
+            procedure_settings = select_procedure(db_wrapper, subject_id, procedure_id)
+            # Only the datums added since the last run are read.
+            data_fps, new_fps = update_data_fingerprints(db_wrapper,
+                                                         FingerprintJournal.data_fingerprints(known, procedure_id),
+                                                         db_wrapper.list_channel_labels())
+            journal.record({FingerprintJournal.data_key(procedure_id, datum_id): fp
+                            for datum_id, fp in new_fps.items()})
+
+            todo = FingerprintJournal.outdated(known, procedure_id, data_fps, definitions, force=force)
+            totals['n_skipped'] += len(data_fps) - sum(len(x) for x in todo.values())
+            for cats, datum_ids in todo.items():
+                for ix in range(0, len(datum_ids), chunk_size):
+                    # Bounded number of tasks in flight.
+                    while len(futures) >= 2 * n_workers:
+                        collect(concurrent.futures.FIRST_COMPLETED)
+                    chunk = datum_ids[ix:ix + chunk_size]
+                    future = pool.submit(compute_datums, procedure_id, procedure_settings, chunk, list(cats))
+                    futures[future] = (procedure_id, {datum_id: data_fps[datum_id] for datum_id in chunk}, cats)
+            totals['n_procedures'] += 1
+            print("Procedure {} of subject {}: {} datums, {} to recompute.".format(
+                procedure_id, subject_id, len(data_fps), sum(len(x) for x in todo.values())), flush=True)
+        while futures:
+            collect(concurrent.futures.ALL_COMPLETED)
+    totals['seconds'] = time.monotonic() - t_start
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the features of stored depth data.")
+    parser.add_argument('--subject-id', default=None, help="Subject id. Without it, the whole archive.")
+    parser.add_argument('--procedure-id', type=int, default=None,
+                        help="Procedure (database) id. Without it, all the procedures of the subject.")
+    parser.add_argument('--features', nargs='+', default=None, help="Feature categories (default: all).")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Number of processes (default: 1 per core).")
+    parser.add_argument('--journal', default=JOURNAL_PATH, help="Fingerprint journal.")
+    parser.add_argument('--force', action='store_true', help="Recompute even if the inputs did not change.")
+    args = parser.parse_args()
+
+    from serf.tools.db_wrap import DBWrapper
+    db_wrapper = DBWrapper()
+    if args.subject_id is None:
+        procedures = list_procedures(db_wrapper)
+    elif args.procedure_id is None:
+        details = db_wrapper.load_subject_details(args.subject_id)
+        procedures = [(args.subject_id, proc.procedure_id)
+                      for proc in db_wrapper.list_all_procedures(details['subject_id'])]
+    else:
+        procedures = [(args.subject_id, args.procedure_id)]
+
+    totals = run_recompute(procedures, args.features, args.journal, n_workers=args.jobs, force=args.force)
+    print("{n_procedures} procedures: {n_datums} datums recomputed, {n_skipped} unchanged, {n_failed} failed "
+          "in {seconds:.0f} s".format(**totals))
+
+
+if __name__ == '__main__':
+    main()
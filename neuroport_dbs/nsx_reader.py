@@ -0,0 +1,174 @@
+"""
+Native reader for Blackrock NSx 2.2/2.3 continuous files and NEV 2.2/2.3 comments.
+
+The data section is memory-mapped; windows are zero-copy int16 (samples, channels) views, so reading a window is a
+slice and not a call into neo. Other variants (NSx 2.1 'NEURALSG', 3.0 with 64-bit timestamps, ...) raise
+UnsupportedFileError and are left to neo.rawio.BlackrockRawIO.
+"""
+import datetime
+import os
+
+import numpy as np
+
+
+class UnsupportedFileError(Exception):
+    pass
+
+
+NSX_BASIC_HEADER = np.dtype([('file_type_id', 'S8'),
+                             ('ver_major', 'u1'),
+                             ('ver_minor', 'u1'),
+                             ('bytes_in_headers', '<u4'),
+                             ('label', 'S16'),
+                             ('comment', 'S256'),
+                             ('period', '<u4'),
+                             ('timestamp_resolution', '<u4'),
+                             ('time_origin', '<u2', (8,)),
+                             ('channel_count', '<u4')])
+
+NSX_EXT_HEADER = np.dtype([('type', 'S2'),
+                           ('electrode_id', '<u2'),
+                           ('electrode_label', 'S16'),
+                           ('physical_connector', 'u1'),
+                           ('connector_pin', 'u1'),
+                           ('min_digital_val', '<i2'),
+                           ('max_digital_val', '<i2'),
+                           ('min_analog_val', '<i2'),
+                           ('max_analog_val', '<i2'),
+                           ('units', 'S16'),
+                           ('hi_freq_corner', '<u4'),
+                           ('hi_freq_order', '<u4'),
+                           ('hi_freq_type', '<u2'),
+                           ('lo_freq_corner', '<u4'),
+                           ('lo_freq_order', '<u4'),
+                           ('lo_freq_type', '<u2')])
+
+NSX_PACKET_HEADER = np.dtype([('header', 'u1'),
+                              ('timestamp', '<u4'),
+                              ('num_data_points', '<u4')])
+
+NEV_BASIC_HEADER = np.dtype([('file_type_id', 'S8'),
+                             ('ver_major', 'u1'),
+                             ('ver_minor', 'u1'),
+                             ('additional_flags', '<u2'),
+                             ('bytes_in_headers', '<u4'),
+                             ('bytes_in_data_packets', '<u4'),
+                             ('timestamp_resolution', '<u4'),
+                             ('sample_resolution', '<u4'),
+                             ('time_origin', '<u2', (8,)),
+                             ('application_to_create_file', 'S32'),
+                             ('comment_field', 'S256'),
+                             ('nb_ext_headers', '<u4')])
+
+NEV_COMMENT_ID = 0xFFFF
+NEV_COMMENT_HEADER_SIZE = 12  # timestamp, packet id, char set, flag, data
+
+
+def _read_struct(f, dtype):
+    buffer = f.read(dtype.itemsize)
+    if len(buffer) < dtype.itemsize:
+        raise UnsupportedFileError("{} is truncated.".format(f.name))
+    return np.frombuffer(buffer, dtype=dtype)[0]
+
+
+def _to_datetime(time_origin):
+    # Windows SYSTEMTIME: year, month, day of week, day, hour, minute, second, millisecond
+    year, month, _, day, hour, minute, second, ms = [int(x) for x in time_origin]
+    return datetime.datetime(year, month, day, hour, minute, second, ms * 1000)
+
+
+class NSxReader(object):
+    """
+    Memory-mapped NSx 2.2/2.3 file. Each data packet (a new one starts after each pause) is a segment.
+    Sample indices are relative to the start of a segment, as in BlackrockRawIO.get_analogsignal_chunk.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the .nsX file.
+        """
+        self.path = path
+        file_size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            basic = _read_struct(f, NSX_BASIC_HEADER)
+            version = (basic['ver_major'], basic['ver_minor'])
+            if basic['file_type_id'] != b'NEURALCD' or version not in [(2, 2), (2, 3)]:
+                raise UnsupportedFileError("{}: {} {}.{} is not supported.".format(
+                    path, basic['file_type_id'].decode(errors='replace'), basic['ver_major'], basic['ver_minor']))
+            n_channels = int(basic['channel_count'])
+            ext = np.frombuffer(f.read(n_channels * NSX_EXT_HEADER.itemsize), dtype=NSX_EXT_HEADER)
+            if ext.shape[0] != n_channels or f.tell() != basic['bytes_in_headers']:
+                raise UnsupportedFileError("{}: unexpected header size.".format(path))
+
+            # Data packets: header byte (1), timestamp, number of samples, then the samples.
+            self.segments = []  # (timestamp, byte offset of the samples, number of samples)
+            offset = int(basic['bytes_in_headers'])
+            while offset + NSX_PACKET_HEADER.itemsize <= file_size:
+                f.seek(offset)
+                packet = _read_struct(f, NSX_PACKET_HEADER)
+                if packet['header'] != 1:
+                    raise UnsupportedFileError("{}: unexpected data packet header.".format(path))
+                offset += NSX_PACKET_HEADER.itemsize
+                n_available = (file_size - offset) // (2 * n_channels)
+                # A file that was not closed properly (e.g., Central crashed) has 0 samples in its last packet.
+                n_samples = min(int(packet['num_data_points']) or n_available, n_available)
+                self.segments.append((int(packet['timestamp']), offset, n_samples))
+                offset += 2 * n_channels * n_samples
+        if not self.segments:
+            raise UnsupportedFileError("{} has no data.".format(path))
+
+        self.channel_labels = [x.decode('latin-1').rstrip('\x00').strip() for x in ext['electrode_label']]
+        self.channel_ids = ext['electrode_id'].tolist()
+        self.timestamp_resolution = int(basic['timestamp_resolution'])
+        self.sampling_rate = self.timestamp_resolution / int(basic['period'])
+        self.rec_datetime = _to_datetime(basic['time_origin'])
+        self._memmaps = [None] * len(self.segments)
+
+    def data(self, segment=0):
+        """
+        :return: read-only int16 (samples, channels) memory map of a segment.
+        """
+        if self._memmaps[segment] is None:
+            _, offset, n_samples = self.segments[segment]
+            self._memmaps[segment] = np.memmap(self.path, dtype='<i2', mode='r', offset=offset,
+                                               shape=(n_samples, len(self.channel_labels)))
+        return self._memmaps[segment]
+
+    def get_chunk(self, i_start=None, i_stop=None, segment=0):
+        """
+        :return: zero-copy int16 (samples, channels) view. Like a slice, the window is clipped at the end of the data.
+        """
+        return np.asarray(self.data(segment)[i_start:i_stop])
+
+
+def read_nev_comments(path):
+    """
+    :param path: the .nev file.
+    :return: list of (timestamp, comment str) in file order, like BlackrockRawIO's nev_data['Comments'] entries
+        (timestamp at index 0, text at index 5) reduced to the two fields that are used.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        basic = _read_struct(f, NEV_BASIC_HEADER)
+    if basic['file_type_id'] != b'NEURALEV' or (basic['ver_major'], basic['ver_minor']) not in [(2, 2), (2, 3)]:
+        raise UnsupportedFileError("{}: {} {}.{} is not supported.".format(
+            path, basic['file_type_id'].decode(errors='replace'), basic['ver_major'], basic['ver_minor']))
+    packet_size = int(basic['bytes_in_data_packets'])
+    offset = int(basic['bytes_in_headers'])
+    n_packets = (file_size - offset) // packet_size
+    if n_packets <= 0:
+        return []
+    packets = np.memmap(path, dtype=np.dtype([('timestamp', '<u4'), ('packet_id', '<u2'),
+                                              ('payload', 'u1', (packet_size - 6,))]),
+                        mode='r', offset=offset, shape=(n_packets,))
+    comments = packets[packets['packet_id'] == NEV_COMMENT_ID]
+    text_start = NEV_COMMENT_HEADER_SIZE - 6
+    char_sets = comments['payload'][:, 0]
+    result = []
+    for timestamp, char_set, text in zip(comments['timestamp'].tolist(), char_sets.tolist(),
+                                         comments['payload'][:, text_start:]):
+        # Character set 1 is UTF-16; 0 is ANSI.
+        text = text.tobytes()
+        text = text.decode('utf-16-le', errors='replace') if char_set == 1 else text.decode('latin-1')
+        result.append((timestamp, text.split('\x00', 1)[0]))
+    return result
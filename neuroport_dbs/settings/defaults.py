@@ -5,6 +5,7 @@ from qtpy.QtCore import Qt
 BASEPATH = 'C:\\Recordings'  # default path for file saving
 SAMPLINGRATE = 30000
 SAMPLINGGROUPS = ["0", "500", "1000", "2000", "10000", "30000"]  # , "RAW"]  RAW broken in cbsdk
+UNIT_SCALING = 0.25  # uV per bit of channels without a 'gain': 16-bit integers from -8192 uV to +8192 uV.
 SIMOK = False  # Make this False for production. Make this True for development when NSP/NPlayServer are unavailable.
 FILTERCONFIG = {'order': 4, 'cutoff': 250, 'type': 'highpass', 'output': 'sos'}  # high pass filter for display
 DSFAC = 100  # down-sampling factor
@@ -47,8 +48,25 @@ uVRANGE = 250  # uV. y-axis range per channel, use +- this value.
 
 YRANGE_RASTER = 8  # Number of rows.
 NPLOTSRAW = 8  # number of rows in the Raw feature plots
+RAWSEGMENTS_IN_RAM = 32  # Per channel. Raw segments of other depths are spilled to a temporary file.
+FEATURES_CACHE_MB = 512  # Memory budget of the FeaturesGUI cache of depth and feature data.
+FEATURES_NOTIFY_PORT = 50101  # localhost UDP port on which FeaturesGUI listens for new-data notifications.
+FEATURES_PROBE_INTERVAL = 2.0  # seconds. Fallback re-check of the displayed series when no notification arrives.
+FEATURES_PREFETCH_INTERVAL = 10.0  # seconds. Fallback re-check of all other series by the prefetch worker.
+FEATURES_MAX_PLOTS = 12  # Max number of (channel, feature) plot widgets kept by FeaturesGUI; LRU ones are deleted.
+DB_WRITE_BATCH_SIZE = 50  # Max number of depth/feature writes committed to the database in one transaction.
+DB_WRITE_INTERVAL = 1.0  # seconds. A partial batch of writes is committed after this long.
+DB_WRITE_MAX_PENDING = 200  # Queued writes at which producers wait for the database. 0: never wait.
+DB_LOOKUP_TIMEOUT = 10.0  # seconds. Max wait for the settings dialog's unfinished lookups when it is accepted.
 
 NWAVEFORMS = 200  # Default max number of waveforms to plot.
+WF_DENSITY_NBINS = 128  # Number of amplitude bins in the waveform density display.
+WF_DENSITY_HALFLIFE = 10.0  # seconds. Half-life of the counts in the waveform density display.
+ISOLATION_NWAVEFORMS = 1000  # Number of recent waveforms per channel used for the unit isolation metrics.
+ISOLATION_NPCS = 3  # Number of principal components in which unit separation (L-ratio) is measured.
+ISOLATION_INTERVAL = 1.0  # seconds between updates of the unit isolation metrics.
+SPIKETHRESHOLD = -4.5  # x noise SD. Initial threshold of client-side spike detection until one is set in SweepGUI.
+REFRACTORYPERIOD = 0.0015  # seconds. ISIs shorter than this count as refractory-period violations.
 
 NPLOTSEGMENTS = 20  # Divide the Sweep plot into this many segments; each segment will be updated independent of rest.
 
@@ -41,5 +41,8 @@ setup(
                         'dbs-comments=neuroport_dbs.CommentsGUI:main',
                         'dbs-ddu=neuroport_dbs.DDUGUI:main',
                         ],
+        'console_scripts': ['dbs-import=neuroport_dbs.batch_import:main',
+                            'dbs-recompute=neuroport_dbs.feature_recompute:main',
+                            ],
     }
 )
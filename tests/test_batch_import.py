@@ -0,0 +1,83 @@
+import argparse
+import json
+
+import pytest
+
+from neuroport_dbs.batch_import import ImportJournal, collect_files, find_ns5_files, load_settings, run_batch
+
+
+def test_journal_records_depths_and_files(tmp_path):
+    journal = ImportJournal(str(tmp_path / 'journal.jsonl'))
+    assert journal.load() == (set(), {})
+    journal.depth_done('rec1', -10.0)
+    journal.depth_done('rec1', -9.5004)
+    journal.depth_done('rec2', 1.0)
+    journal.file_done('rec1')
+    done_files, done_depths = journal.load()
+    assert done_files == {'rec1'}
+    assert done_depths == {'rec1': {'-10.000', '-9.500'}, 'rec2': {'1.000'}}
+
+
+def test_journal_skips_a_line_truncated_by_a_crash(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = ImportJournal(str(path))
+    journal.depth_done('rec1', -10.0)
+    with open(path, 'a') as f:
+        f.write('{"file": "rec1", "dep')
+    assert journal.load() == (set(), {'rec1': {'-10.000'}})
+
+
+def test_completed_files_are_not_imported_again(tmp_path):
+    journal = ImportJournal(str(tmp_path / 'journal.jsonl'))
+    journal.file_done('/data/rec1')
+    totals = run_batch([('1', '2', '/data/rec1')], journal.path, n_workers=1)
+    assert totals['n_files'] == 0 and totals['n_failed'] == 0
+
+
+def test_find_ns5_files(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    for name in ['2019-05-02_123-4.ns5', 'sub/20190503_123_5.ns5', 'notes.ns5', '2019-05-02_123-4.nev']:
+        (tmp_path / name).touch()
+    files = find_ns5_files(str(tmp_path))
+    assert [(sub_id, proc_id) for sub_id, proc_id, _ in files] == [('123', '4'), ('123', '5')]
+    assert files[0][2] == str(tmp_path / '2019-05-02_123-4')
+
+
+def _args(**kwargs):
+    # The dbs-import flags that load_settings reads.
+    args = dict(config=None, target_name=None, type=None, buffer_length=None, sample_length=None, delay_buffer=None,
+                validity=None)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def test_flags_override_the_config_file(tmp_path):
+    config = tmp_path / 'import.json'
+    config.write_text(json.dumps({'procedure': {'type': 'surgical', 'target_name': 'STN'},
+                                  'buffer': {'validity': 80.0}}))
+    settings = load_settings(_args(config=str(config), target_name='GPi', sample_length=4, validity=90.))
+    assert settings == {'subject': {}, 'procedure': {'type': 'surgical', 'target_name': 'GPi'},
+                        'buffer': {'validity': 90., 'sample_length': '4.000'}, 'features': {}}
+    assert load_settings(_args()) == {'subject': {}, 'procedure': {}, 'buffer': {}, 'features': {}}
+
+
+@pytest.mark.parametrize('config, message', [
+    ({'procedures': {}}, "unknown section 'procedures'"),
+    ({'buffer': {'sample_lenght': 4}}, "unknown buffer settings sample_lenght"),
+    ({'buffer': 4}, "'buffer' must be a JSON object"),
+    ([], "expected a JSON object")])
+def test_invalid_config_files(tmp_path, config, message):
+    path = tmp_path / 'import.json'
+    path.write_text(json.dumps(config))
+    with pytest.raises(ValueError, match=message):
+        load_settings(_args(config=str(path)))
+
+
+def test_collect_files(tmp_path):
+    (tmp_path / '2019-05-02_123-4.ns5').touch()
+    (tmp_path / 'other.ns5').touch()
+    named, other = str(tmp_path / '2019-05-02_123-4.ns5'), str(tmp_path / 'other.ns5')
+    # Without flags, files whose names have no ids are skipped.
+    assert collect_files([named, other]) == [('123', '4', named[:-4])]
+    assert collect_files([other], subject_id='7', procedure_id='8') == [('7', '8', other[:-4])]
+    assert collect_files([str(tmp_path)], procedure_id='9') == [('123', '9', named[:-4])]
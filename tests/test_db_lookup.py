@@ -0,0 +1,67 @@
+import sys
+import types
+
+import pytest
+
+pytest.importorskip('qtpy')
+from neuroport_dbs.dbsgui.workers.db_lookup import DBLookup
+
+
+class FakeDBWrapper(object):
+    # A lookup of each kind: write-dependent, not write-dependent, attribute, and one that fails.
+    calls = []
+    all_features = {'Raw': None, 'STN': None}
+
+    def list_all_subjects(self):
+        self.calls.append('list_all_subjects')
+        return ['123']
+
+    def return_enums(self, table):
+        self.calls.append('return_enums')
+        return {'sex': ['unspecified']} if table == 'subject' else {}
+
+    def load_subject_details(self, subject_id):
+        raise ConnectionError("database gone")
+
+
+@pytest.fixture
+def lookup(monkeypatch):
+    # DBLookup imports serf's DBWrapper when a lookup runs.
+    db_wrap = types.ModuleType('serf.tools.db_wrap')
+    db_wrap.DBWrapper = FakeDBWrapper
+    for name, module in [('serf', types.ModuleType('serf')), ('serf.tools', types.ModuleType('serf.tools')),
+                         ('serf.tools.db_wrap', db_wrap)]:
+        monkeypatch.setitem(sys.modules, name, module)
+    FakeDBWrapper.calls = []
+    DBLookup.invalidate(None)
+    yield DBLookup()
+    DBLookup.invalidate(None)
+
+
+def test_lookups_are_loaded_once_and_then_cached(lookup):
+    assert lookup.get('return_enums', 'subject') is None
+    lookup.get('return_enums', 'subject')  # Pending or cached: not loaded again.
+    assert lookup.get('all_features') is None
+    lookup.wait(5.)
+    assert lookup.get('return_enums', 'subject') == {'sex': ['unspecified']}
+    # Another instance shares the cache.
+    assert DBLookup().get('all_features') is FakeDBWrapper.all_features
+    assert FakeDBWrapper.calls == ['return_enums']
+
+
+def test_invalidate_drops_the_write_dependent_lookups(lookup):
+    lookup.get('return_enums', 'subject')
+    lookup.get('list_all_subjects')
+    lookup.wait(5.)
+    DBLookup.invalidate()
+    assert lookup.get('return_enums', 'subject') is not None
+    assert lookup.get('list_all_subjects') is None
+    lookup.wait(5.)
+    assert lookup.get('list_all_subjects') == ['123']
+    assert FakeDBWrapper.calls == ['return_enums', 'list_all_subjects', 'list_all_subjects']
+
+
+def test_a_failed_lookup_is_not_cached(lookup):
+    for _ in range(2):
+        assert lookup.get('load_subject_details', '123') is None
+        assert lookup.wait(5.) == {}
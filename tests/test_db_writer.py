@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+pytest.importorskip('qtpy')  # db_writer imports the Qt-based settings.
+django = pytest.importorskip('django')
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}})
+    django.setup()
+from django.db import transaction
+from neuroport_dbs.dbsgui.workers.db_writer import DBBatchWriter
+
+
+class FakeDBWrapper(object):
+    # save_depth_datum records the write and, once its transaction commits, the number of writes so far.
+    def __init__(self, fail_on=None):
+        self.saved = []
+        self.commits = []
+        self.fail_on = fail_on
+        self.threads = set()
+
+    def save_depth_datum(self, depth):
+        self.threads.add(threading.current_thread().name)
+        if depth == self.fail_on:
+            raise ValueError("cannot save {}".format(depth))
+        self.saved.append(depth)
+        transaction.on_commit(lambda: self.commits.append(len(self.saved)))
+
+
+def test_writes_are_committed_in_batches_on_the_writer_thread():
+    db_wrapper = FakeDBWrapper()
+    writer = DBBatchWriter(db_wrapper, batch_size=4, interval=10.)
+    done = []
+    for depth in range(10):
+        writer.submit('save_depth_datum', callback=lambda depth=depth: done.append(depth), depth=depth)
+    writer.close()
+    assert db_wrapper.saved == list(range(10)) and done == list(range(10)) and writer.n_written == 10
+    # One commit per batch of 4, and the rest on close.
+    assert sorted(set(db_wrapper.commits)) == [4, 8, 10]
+    assert db_wrapper.threads == {'DBBatchWriter'}
+
+
+def test_flush_writes_a_partial_batch():
+    db_wrapper = FakeDBWrapper()
+    writer = DBBatchWriter(db_wrapper, batch_size=50, interval=10.)
+    writer.submit('save_depth_datum', depth=1.)
+    writer.flush()
+    assert db_wrapper.saved == [1.] and db_wrapper.commits == [1]
+    writer.close()
+
+
+def test_a_failed_batch_is_rolled_back_and_raised():
+    db_wrapper = FakeDBWrapper(fail_on=2)
+    writer = DBBatchWriter(db_wrapper, batch_size=3, interval=10.)
+    done = []
+    for depth in range(3):
+        writer.submit('save_depth_datum', callback=lambda depth=depth: done.append(depth), depth=depth)
+    with pytest.raises(ValueError):
+        writer.flush()
+    assert db_wrapper.commits == [] and done == [] and writer.n_written == 0
+    with pytest.raises(ValueError):
+        writer.submit('save_depth_datum', depth=3)
+    with pytest.raises(ValueError):
+        writer.close()
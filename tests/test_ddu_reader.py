@@ -0,0 +1,54 @@
+import pytest
+
+serial = pytest.importorskip('serial')
+pytest.importorskip('qtpy')
+from neuroport_dbs.dbsgui.workers.ddu import DDUReader
+
+
+class FakeSerial(object):
+    # Returns the scripted chunks (b'' for a read that timed out), then fails as a disconnected port does.
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.written = []
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        if not self.chunks:
+            raise serial.SerialException("disconnected")
+        return self.chunks.pop(0)
+
+    def write(self, data):
+        self.written.append(data)
+
+
+def _run(chunks, nsp_clock=None):
+    reader = DDUReader('fake', nsp_clock=nsp_clock)
+    reader._ser = FakeSerial(chunks)
+    emitted = {'depth': [], 'version': [], 'stopped': []}
+    reader.depth_changed.connect(lambda *args: emitted['depth'].append(args))
+    reader.version_detected.connect(emitted['version'].append)
+    reader.stopped.connect(emitted['stopped'].append)
+    reader._run()  # On this thread, until the fake port is exhausted.
+    return reader, emitted
+
+
+def test_handshake_then_depth_changes():
+    reader, emitted = _run([b'FHC DDU V2.20\r', b'AXON+\r\n', b'-1.0', b'00\r\n-1.000\r\n', b'',
+                            b'garbage\r\n-0.990\r\n'], nsp_clock=lambda: 5.0)
+    assert reader._ser.written == [b'AXON-\r', b'V\r', b'AXON+\r']
+    assert emitted['version'] == ['2.20']
+    # A line split across reads is parsed once complete; repeated readings and non-numbers are not emitted.
+    assert [(value, nsp_time) for value, _, nsp_time in emitted['depth']] == [(-1.0, 5.0), (-0.99, 5.0)]
+    assert emitted['stopped'] == ['disconnected']
+
+
+def test_failing_nsp_clock_gives_nan():
+    def nsp_clock():
+        raise RuntimeError("not connected")
+    _, emitted = _run([b'V1.10\r\n', b'AXON+\r\n', b'12.5\r\n'], nsp_clock=nsp_clock)
+    assert emitted['version'] == ['1.10']
+    value, host_time, nsp_time = emitted['depth'][0]
+    assert value == 12.5 and host_time > 0 and nsp_time != nsp_time
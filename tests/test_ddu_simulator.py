@@ -0,0 +1,56 @@
+import os
+import select
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('termios')  # Pseudo-terminals are Linux / macOS only.
+from neuroport_dbs.ddu_simulator import DDUSimulator, random_trajectory, scripted_trajectory
+
+
+def _read_lines(fd, n, timeout=2.0):
+    buffer = b''
+    deadline = time.monotonic() + timeout
+    while buffer.count(b'\r\n') < n and time.monotonic() < deadline:
+        if select.select([fd], [], [], 0.05)[0]:
+            buffer += os.read(fd, 256)
+    return buffer.decode().split('\r\n')[:n]
+
+
+@pytest.mark.parametrize('version, reading', [('2.20', '-61000'), ('1.10', '-1.000')])
+def test_handshake_and_readings(version, reading):
+    simulator = DDUSimulator(version=version)
+    simulator.start()
+    fd = os.open(simulator.port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        os.write(fd, b'AXON-\rV\r')
+        assert _read_lines(fd, 1) == ['FHC DDU V{}'.format(version)]
+        simulator.send_depth(-2.0)  # Quiet until AXON+.
+        os.write(fd, b'AXON+\r')
+        assert _read_lines(fd, 1) == ['AXON+']
+        simulator.send_depth(-1.0)
+        assert _read_lines(fd, 1) == [reading]
+        assert list(simulator.sent.keys()) == ['-1.000']
+    finally:
+        os.close(fd)
+        simulator.stop()
+
+
+def test_random_trajectory():
+    trajectory = list(random_trajectory(-1., 1., step_um=10, rate=10., rng=np.random.default_rng(0)))
+    depths, delays = np.array(trajectory).T
+    assert depths[-1] == 1.
+    steps = np.round(np.diff(depths) * 1000)
+    assert np.all(steps > 0) and np.all(steps <= 30) and np.all(steps % 10 == 0)
+    assert np.all(delays == 0.1)
+
+    trajectory = list(random_trajectory(-1., 1., rate=10., burst_prob=1., burst_rate=500.,
+                                        rng=np.random.default_rng(0)))
+    assert all(delay == 1 / 500. for _, delay in trajectory)
+
+
+def test_scripted_trajectory(tmp_path):
+    path = tmp_path / 'depths.txt'
+    path.write_text("-1.0\n\n-0.5 0.2\n")
+    assert list(scripted_trajectory(str(path), rate=10.)) == [(-1.0, 0.1), (-0.5, 0.2)]
@@ -0,0 +1,45 @@
+import numpy as np
+
+from neuroport_dbs.dbsgui.my_models.depth_spectrogram import DepthSpectrogram
+
+
+def test_interpolation_between_depths():
+    spectrogram = DepthSpectrogram(2, fill_value=-1.)
+    spectrogram.insert(2., [10., 20.])
+    spectrogram.insert(0., [0., 0.])
+    assert spectrogram.depths.tolist() == [0., 2.]
+    out = spectrogram.interpolate(np.array([-1., 0., 1., 2., 3.]))
+    assert out.tolist() == [[-1., -1.], [0., 0.], [5., 10.], [10., 20.], [-1., -1.]]
+    # Inserting at a known depth replaces its column.
+    spectrogram.insert(2., [30.])
+    assert spectrogram.depths.tolist() == [0., 2.]
+    assert spectrogram.columns[1].tolist() == [30., 20.]
+
+
+def test_a_single_depth_is_drawn_only_when_in_view():
+    spectrogram = DepthSpectrogram(1)
+    spectrogram.insert(2.3, [1.])
+    assert np.flatnonzero(spectrogram.render((0., 10.), 10)).tolist() == [2]
+    spectrogram.clear()
+    spectrogram.insert(25., [1.])
+    assert not np.any(spectrogram.render((0., 10.), 10))
+
+
+def test_partial_render_matches_a_full_render():
+    rng = np.random.default_rng(0)
+    spectrogram = DepthSpectrogram(3)
+    for depth in rng.uniform(-5., 15., 40):
+        spectrogram.insert(depth, rng.normal(size=3))
+        image = spectrogram.render((0., 10.), 50).copy()
+        assert np.allclose(image, spectrogram.interpolate(spectrogram._grid, px=0.2))
+
+
+def test_out_of_view_depths_do_not_leave_an_edge_column():
+    spectrogram = DepthSpectrogram(1)
+    spectrogram.insert(20., [1.])
+    spectrogram.render((0., 10.), 10)
+    spectrogram.insert(30., [2.])
+    assert not np.any(spectrogram.render((0., 10.), 10))
+    spectrogram.insert(5., [4.])
+    image = spectrogram.render((0., 10.), 10)
+    assert image[:5].ravel().tolist() == [0.] * 5 and np.isclose(image[5, 0], 4. - 0.5 * 3 / 15)
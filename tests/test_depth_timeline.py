@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip('qtpy')  # depth_timeline also holds the QSharedMemory-based DepthTimelineSharedMemory.
+from neuroport_dbs.dbsgui.my_models.depth_timeline import DepthTimeline
+
+
+def test_append_keeps_only_depth_changes():
+    timeline = DepthTimeline()
+    assert timeline.latest_depth is None
+    assert timeline.append(100, -10.0)
+    assert not timeline.append(200, -10.0)  # Same depth.
+    assert timeline.append(300, -9.5)
+    assert not timeline.append(250, -9.0)  # Older than the last entry.
+    assert len(timeline) == 2
+    assert timeline.times.tolist() == [100, 300]
+    assert timeline.latest_depth == -9.5
+
+
+def test_grows_past_its_capacity():
+    timeline = DepthTimeline(capacity=2)
+    for ix in range(5):
+        timeline.append(ix * 10, float(ix))
+    assert len(timeline) == 5
+    assert timeline.depths.tolist() == [0., 1., 2., 3., 4.]
+
+
+def test_add_comments_parses_dtt_comments():
+    timeline = DepthTimeline()
+    comments = [[100, b'DTT:-10.000'], [150, 'not a depth'], [200, 'DTT:-9.5'], [300, b'DTT:.5', (255, 0, 0)]]
+    assert timeline.add_comments(comments)
+    assert timeline.times.tolist() == [100, 200, 300]
+    assert timeline.depths.tolist() == [-10.0, -9.5, 0.5]
+    assert not timeline.add_comments([[400, 'DTT:0.5']])
+
+
+def test_lookups():
+    timeline = DepthTimeline()
+    for t, depth in [(100, -10.), (200, -9.), (300, -10.)]:
+        timeline.append(t, depth)
+    assert timeline.depth_at(50) is None
+    assert timeline.depth_at(100) == -10.
+    assert timeline.depth_at(299) == -9.
+    assert timeline.segment_at(50) is None
+    assert timeline.segment_at(150) == (100, 200, -10.)
+    assert timeline.segment_at(1000) == (300, None, -10.)
+    # A depth can be visited more than once.
+    assert timeline.sample_ranges(-10.) == [(100, 200), (300, None)]
+    assert timeline.sample_ranges(-8.) == []
+
+
+def test_save_and_load(tmp_path):
+    timeline = DepthTimeline()
+    timeline.add_comments([[100, 'DTT:-10.0'], [200, 'DTT:-9.0']])
+    path = DepthTimeline.file_path(tmp_path / 'rec001')
+    assert path.endswith('rec001.depth.npz')
+    timeline.save(path)
+    loaded = DepthTimeline.load(path)
+    assert loaded.times.tolist() == [100, 200]
+    assert loaded.depths.tolist() == [-10.0, -9.0]
+    assert loaded.append(300, -8.0)  # Still appendable.
+
+    DepthTimeline().save(path)
+    assert len(DepthTimeline.load(path)) == 0
@@ -0,0 +1,92 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('qtpy')  # feature_cache also holds the Qt-based FeatureChangeFeed.
+from neuroport_dbs.dbsgui.my_models.feature_cache import FeatureDataCache
+from neuroport_dbs.dbsgui.workers.features import FeaturePrefetch
+
+
+class FakeDB(object):
+    # load_fn of a single series whose datums are {datum_id: 1 kB array}. fail_next makes the next reads raise.
+    def __init__(self, n_datums=5):
+        self.datums = {datum_id: np.full(128, datum_id, dtype=float) for datum_id in range(1, n_datums + 1)}
+        self.reads = []
+        self.fail_next = 0
+
+    def load(self, chan_lbl, category, gt, do_hp):
+        self.reads.append(gt)
+        if self.fail_next:
+            self.fail_next -= 1
+            raise ConnectionError("database gone")
+        return {datum_id: data for datum_id, data in self.datums.items() if datum_id > gt}
+
+
+def test_failed_load_leaves_the_series_stale():
+    db = FakeDB()
+    cache = FeatureDataCache(db.load)
+    db.fail_next = 1
+    with pytest.raises(ConnectionError):
+        cache.get(1, 'ch1', 'STN')
+    assert cache.is_stale(1, 'ch1', 'STN')
+    assert sorted(cache.get(1, 'ch1', 'STN').keys()) == [1, 2, 3, 4, 5]
+    assert not cache.is_stale(1, 'ch1', 'STN')
+
+
+def test_prefetch_keeps_going_after_a_failure():
+    db = FakeDB()
+    db.fail_next = 2
+    prefetch = FeaturePrefetch(FeatureDataCache(db.load), interval=0.01)
+    prefetch.set_series(1, [('ch1', 'STN', True)])
+    prefetch.start()
+    deadline = time.monotonic() + 2.
+    deltas = {}
+    while not deltas and time.monotonic() < deadline:
+        time.sleep(0.01)
+        deltas = prefetch.take_deltas()
+    assert prefetch.is_running
+    prefetch.stop()
+    assert sorted(deltas[('ch1', 'STN', True)].keys()) == [1, 2, 3, 4, 5]
+
+
+def test_only_stale_series_are_read_and_only_their_new_datums():
+    db = FakeDB()
+    cache = FeatureDataCache(db.load)
+    assert cache.get(1, 'ch1', 'STN', load=False) == {}
+    assert sorted(cache.get(1, 'ch1', 'STN').keys()) == [1, 2, 3, 4, 5]
+    assert sorted(cache.get(1, 'ch1', 'STN', gt=3).keys()) == [4, 5]
+    assert db.reads == [0]
+    db.datums[6] = np.zeros(128)
+    cache.mark_stale('ch1')
+    assert sorted(cache.get(1, 'ch1', 'STN').keys()) == [1, 2, 3, 4, 5, 6]
+    assert db.reads == [0, 5]
+
+
+def test_eviction_drops_single_datums_and_reloads_only_the_gap():
+    db = FakeDB(n_datums=10)
+    cache = FeatureDataCache(db.load, max_bytes=8 * 1024)  # 8 of the 10 datums.
+    assert sorted(cache.get(1, 'ch1', 'STN').keys()) == list(range(1, 11))
+    assert not cache.is_stale(1, 'ch1', 'STN')
+    # Reading past the evicted datums does not touch the database.
+    assert sorted(cache.get(1, 'ch1', 'STN', gt=2).keys()) == list(range(3, 11))
+    assert db.reads == [0]
+    # New datums are read after the newest one loaded, not after the newest one still cached.
+    db.datums[11] = np.zeros(128)
+    cache.mark_stale()
+    assert sorted(cache.get(1, 'ch1', 'STN', gt=10).keys()) == [11]
+    assert db.reads == [0, 10]
+    # Asking for evicted datums reloads from the first of them.
+    assert sorted(cache.get(1, 'ch1', 'STN', gt=1).keys()) == list(range(2, 12))
+    assert db.reads[-1] == 1
+
+
+def test_prefetch_reads_raw_only_for_the_current_series():
+    db = FakeDB()
+    prefetch = FeaturePrefetch(FeatureDataCache(db.load))
+    prefetch.set_series(1, [('ch1', 'Raw', True), ('ch2', 'Raw', True), ('ch1', 'STN', True)])
+    prefetch.prefetch_stale()
+    assert list(prefetch.take_deltas().keys()) == [('ch1', 'STN', True)]
+    prefetch.set_current('ch2', 'Raw')
+    prefetch.prefetch_stale()
+    assert list(prefetch.take_deltas().keys()) == [('ch2', 'Raw', True)]
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('qtpy')  # feature_recompute imports the Qt-based settings.
+from neuroport_dbs import feature_recompute
+from neuroport_dbs.feature_recompute import FingerprintJournal, datum_fingerprints, definition_fingerprint, \
+    update_data_fingerprints
+
+
+class FakeDBWrapper(object):
+    # load_depth_data of a procedure whose datums are {datum_id: (depth, {chan_lbl: data})}.
+    def __init__(self, datums):
+        self.datums = datums
+        self.loaded = []
+
+    def load_depth_data(self, chan_lbl, gt=0, do_hp=True, return_uV=True):
+        self.loaded.append((chan_lbl, gt))
+        return {datum_id: [depth, data[chan_lbl]] for datum_id, (depth, data) in self.datums.items() if datum_id > gt}
+
+    def load_or_create_procedure(self, procedure_settings):
+        self.procedure = procedure_settings
+
+    def process_single_datum(self, datum_id, features):
+        if datum_id not in self.datums:
+            raise ValueError("no datum {}".format(datum_id))
+
+
+def _datums(n, offset=0):
+    return {datum_id: (-10. + datum_id, {'ch1': np.full(4, datum_id), 'ch2': np.zeros(4)})
+            for datum_id in range(offset + 1, offset + n + 1)}
+
+
+def test_journal_last_entry_wins(tmp_path):
+    journal = FingerprintJournal(str(tmp_path / 'fps.jsonl'))
+    assert journal.load() == {}
+    journal.record({FingerprintJournal.key(4, 1, 'STN'): 'a', FingerprintJournal.data_key(4, 1): 'd'})
+    journal.record({FingerprintJournal.key(4, 1, 'STN'): 'b'})
+    with open(journal.path, 'a') as f:
+        f.write('{"key": "4:2:STN", "f')  # Truncated by a crash.
+    assert journal.load() == {'4:1:STN': 'b', '4:1': 'd'}
+
+
+def test_data_fingerprints_of_a_procedure():
+    fingerprints = {FingerprintJournal.data_key(4, 1): 'a', FingerprintJournal.data_key(4, 12): 'b',
+                    FingerprintJournal.data_key(41, 3): 'c', FingerprintJournal.key(4, 1, 'STN'): 'ax'}
+    assert FingerprintJournal.data_fingerprints(fingerprints, 4) == {1: 'a', 12: 'b'}
+    assert FingerprintJournal.data_fingerprints(fingerprints, 5) == {}
+
+
+def test_datum_fingerprints_read_only_newer_datums():
+    db_wrapper = FakeDBWrapper(_datums(5))
+    fps = datum_fingerprints(db_wrapper, ['ch1', 'ch2'])
+    assert sorted(fps.keys()) == [1, 2, 3, 4, 5]
+    assert len(set(fps.values())) == 5
+    assert datum_fingerprints(db_wrapper, ['ch1', 'ch2'], gt=3) == {4: fps[4], 5: fps[5]}
+    assert db_wrapper.loaded[-2:] == [('ch1', 3), ('ch2', 3)]
+
+    # Any change of the depth or the data changes the fingerprint.
+    db_wrapper.datums[4] = (db_wrapper.datums[4][0] + 1, db_wrapper.datums[4][1])
+    db_wrapper.datums[5][1]['ch2'][0] = 1
+    new_fps = datum_fingerprints(db_wrapper, ['ch1', 'ch2'])
+    assert [new_fps[datum_id] == fps[datum_id] for datum_id in range(1, 6)] == [True, True, True, False, False]
+
+
+def test_definition_fingerprint():
+    def feature_a(x):
+        return x + 1
+
+    def feature_b(x):
+        return x + 2
+    assert definition_fingerprint(feature_a) == definition_fingerprint(feature_a)
+    assert definition_fingerprint(feature_a) != definition_fingerprint(feature_b)
+
+
+def test_resume_recomputes_only_outdated_categories(tmp_path):
+    journal = FingerprintJournal(str(tmp_path / 'fps.jsonl'))
+    data_fps = {1: 'd1', 2: 'd2', 3: 'd3'}
+    definitions = {'STN': 's', 'LFP': 'l'}
+    assert FingerprintJournal.outdated(journal.load(), 4, data_fps, definitions) == {('STN', 'LFP'): [1, 2, 3]}
+
+    # An interrupted run committed datums 1 and 2.
+    journal.record({FingerprintJournal.key(4, datum_id, cat): data_fps[datum_id] + definitions[cat]
+                    for datum_id in [1, 2] for cat in definitions})
+    assert FingerprintJournal.outdated(journal.load(), 4, data_fps, definitions) == {('STN', 'LFP'): [3]}
+
+    # Then the LFP feature was edited and datum 2's data changed.
+    definitions['LFP'] = 'l2'
+    data_fps[2] = 'd2b'
+    assert FingerprintJournal.outdated(journal.load(), 4, data_fps, definitions) == {('LFP',): [1],
+                                                                                     ('STN', 'LFP'): [2, 3]}
+    assert FingerprintJournal.outdated(journal.load(), 5, data_fps, definitions) == {('STN', 'LFP'): [1, 2, 3]}
+    assert FingerprintJournal.outdated(journal.load(), 4, {1: 'd1'}, {'STN': 's'}) == {}
+    assert FingerprintJournal.outdated(journal.load(), 4, {1: 'd1'}, {'STN': 's'}, force=True) == {('STN',): [1]}
+
+
+def test_data_fingerprints_of_replaced_datums_are_dropped():
+    db_wrapper = FakeDBWrapper(_datums(5))
+    data_fps = datum_fingerprints(db_wrapper, ['ch1', 'ch2'])
+    # Datum 3 was replaced by a new recording at its depth, datum 6.
+    db_wrapper.datums[6] = db_wrapper.datums.pop(3)
+    data_fps, new_fps = update_data_fingerprints(db_wrapper, data_fps, ['ch1', 'ch2'])
+    assert sorted(data_fps.keys()) == [1, 2, 4, 5, 6] and list(new_fps.keys()) == [6]
+    assert db_wrapper.loaded[-3:] == [('ch1', 0), ('ch1', 5), ('ch2', 5)]
+    assert update_data_fingerprints(db_wrapper, data_fps, []) == ({}, {})
+
+
+def test_a_failing_datum_does_not_fail_its_batch(monkeypatch):
+    django = pytest.importorskip('django')
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}})
+        django.setup()
+    db_wrapper = FakeDBWrapper(_datums(5))
+    del db_wrapper.datums[3]
+    monkeypatch.setitem(feature_recompute._worker, 'db_wrapper', db_wrapper)
+    monkeypatch.setitem(feature_recompute._worker, 'procedure_id', None)
+    done, failed = feature_recompute.compute_datums(4, {'subject_id': 1}, [1, 2, 3, 4, 5], ['STN'])
+    assert sorted(done) == [1, 2, 4, 5] and list(failed.keys()) == [3]
+    assert db_wrapper.procedure == {'subject_id': 1}
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+for module in ['neo', 'regex', 'qtpy', 'serf']:
+    pytest.importorskip(module)
+from neuroport_dbs.ImportNS5FeaturesGUI import NS5OfflinePlayback
+
+
+def _first_valid_loop(validity, offsets, sample_length, valid_thresh):
+    # The window-by-window search that first_valid_offset replaces.
+    for offset in offsets:
+        n_valid = np.sum(validity[:, offset:offset + sample_length], axis=1)
+        if np.all(n_valid > np.asarray(valid_thresh)):
+            return offset
+    return offsets[-1]
+
+
+def test_candidate_offsets():
+    offsets = NS5OfflinePlayback.candidate_offsets(0, 10000, sample_length=1000, buffer_length=2000, step=300)
+    assert offsets.tolist() == [0, 300, 600, 900, 1200]
+    # The next depth comes first.
+    offsets = NS5OfflinePlayback.candidate_offsets(0, 1500, sample_length=1000, buffer_length=2000, step=300)
+    assert offsets.tolist() == [0, 300, 600]
+    # Only the first window when there is no room to move.
+    assert NS5OfflinePlayback.candidate_offsets(0, 500, 1000, 2000).tolist() == [0]
+
+
+def test_first_valid_offset_matches_the_window_loop():
+    rng = np.random.default_rng(0)
+    sample_length = 100
+    offsets = NS5OfflinePlayback.candidate_offsets(0, 10000, sample_length, 1000, step=30)
+    for _ in range(50):
+        validity = np.ones((3, offsets[-1] + sample_length), dtype=bool)
+        for ch_ix in range(3):
+            start = rng.integers(0, validity.shape[1])
+            validity[ch_ix, start:start + rng.integers(0, 400)] = False
+        valid_thresh = [90, 90, 90]
+        assert NS5OfflinePlayback.first_valid_offset(validity, offsets, sample_length, valid_thresh) == \
+            _first_valid_loop(validity, offsets, sample_length, valid_thresh)
+
+
+def test_first_valid_offset_falls_back_to_the_last_offset():
+    validity = np.zeros((2, 500), dtype=bool)
+    offsets = np.array([0, 100, 200, 300])
+    assert NS5OfflinePlayback.first_valid_offset(validity, offsets, 200, [10, 10]) == 300
+    assert NS5OfflinePlayback.first_valid_offset(validity, np.array([], dtype=int), 200, [10, 10]) == 0
+
+
+def test_validate_data_sample():
+    data = np.array([[0, 29999, 30000, -30000, -32768]], dtype=np.int16)
+    assert NS5OfflinePlayback.validate_data_sample(data).tolist() == [[True, True, False, False, False]]
+
+
+class FakeDBWrapper(object):
+    # The subject and procedure API of DBWrapper used by the headless import.
+    def __init__(self):
+        self.subjects, self.procedures = [], []
+
+    def return_enums(self, table):
+        return {'sex': ['unspecified', 'male', 'female']} if table == 'subject' else {'type': ['none', 'surgical']}
+
+    def load_subject_details(self, sub_id):
+        return {'id': sub_id, 'name': None}
+
+    def load_procedure_details(self, proc_id, exclude=()):
+        return {'type': None, 'target_name': None}
+
+    def load_or_create_subject(self, subject_settings):
+        self.subjects.append(dict(subject_settings))
+        return 7
+
+    def load_or_create_procedure(self, procedure_settings):
+        self.procedures.append(dict(procedure_settings))
+        return 11
+
+
+def test_resolve_procedure():
+    db_wrapper = FakeDBWrapper()
+    settings = {'procedure': {'type': 'surgical'}, 'buffer': {'validity': 80.}}
+    resolved = NS5OfflinePlayback.resolve_procedure(db_wrapper, '123', '4', settings)
+    assert resolved['buffer'] == {'validity': 80.}
+    assert resolved['subject']['subject_id'] == 7 and resolved['subject']['id'] == '123'
+    assert resolved['subject']['sex'] == 'unspecified'
+    procedure = resolved['procedure']
+    assert (procedure['subject_id'], procedure['procedure_id'], procedure['target_name']) == (7, 11, 'Proc4')
+    assert procedure['type'] == 'surgical' and procedure['distance_to_target'] == 0.
+    assert len(db_wrapper.procedures) == 1
+    # The resolved settings are used as they are.
+    subject_settings, procedure_settings, procedure_name = \
+        NS5OfflinePlayback.default_procedure_settings('123', '4', resolved)
+    assert procedure_settings['procedure_id'] == 11 and procedure_name == 'Proc4'
@@ -0,0 +1,128 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from neuroport_dbs.nsx_reader import NSxReader, UnsupportedFileError, read_nev_comments, NSX_BASIC_HEADER, \
+    NSX_EXT_HEADER, NSX_PACKET_HEADER, NEV_BASIC_HEADER, NEV_COMMENT_ID
+
+TIME_ORIGIN = [2019, 5, 4, 2, 13, 14, 15, 16]  # 2019-05-02 13:14:15.016, a Thursday
+LABELS = ['Ch1', 'Ch2', 'Ch3']
+
+
+def write_nsx(path, segments, labels=LABELS, version=(2, 3), file_type=b'NEURALCD', n_declared=None):
+    """
+    :param segments: list of (timestamp, int16 (samples, channels) array).
+    :param n_declared: number of samples written in the header of the last packet, if not its actual number.
+    """
+    basic = np.zeros(1, dtype=NSX_BASIC_HEADER)
+    basic['file_type_id'] = file_type
+    basic['ver_major'], basic['ver_minor'] = version
+    basic['bytes_in_headers'] = NSX_BASIC_HEADER.itemsize + len(labels) * NSX_EXT_HEADER.itemsize
+    basic['period'] = 1
+    basic['timestamp_resolution'] = 30000
+    basic['time_origin'] = TIME_ORIGIN
+    basic['channel_count'] = len(labels)
+    ext = np.zeros(len(labels), dtype=NSX_EXT_HEADER)
+    ext['type'] = b'CC'
+    ext['electrode_id'] = np.arange(1, len(labels) + 1)
+    ext['electrode_label'] = [x.encode() for x in labels]
+    with open(path, 'wb') as f:
+        f.write(basic.tobytes())
+        f.write(ext.tobytes())
+        for ix, (timestamp, data) in enumerate(segments):
+            packet = np.zeros(1, dtype=NSX_PACKET_HEADER)
+            packet['header'] = 1
+            packet['timestamp'] = timestamp
+            is_last = ix == len(segments) - 1
+            packet['num_data_points'] = n_declared if is_last and n_declared is not None else data.shape[0]
+            f.write(packet.tobytes())
+            f.write(np.ascontiguousarray(data, dtype='<i2').tobytes())
+
+
+def write_nev(path, comments, packet_size=104):
+    # comments: list of (timestamp, char set, text bytes). A spike packet is added to check it is ignored.
+    basic = np.zeros(1, dtype=NEV_BASIC_HEADER)
+    basic['file_type_id'] = b'NEURALEV'
+    basic['ver_major'], basic['ver_minor'] = 2, 3
+    basic['bytes_in_headers'] = NEV_BASIC_HEADER.itemsize
+    basic['bytes_in_data_packets'] = packet_size
+    basic['timestamp_resolution'] = 30000
+    packets = []
+    for timestamp, char_set, text in [(5, None, b'')] + list(comments):
+        packet = np.zeros(packet_size, dtype='u1')
+        packet[:4] = np.frombuffer(np.uint32(timestamp).tobytes(), dtype='u1')
+        packet_id = NEV_COMMENT_ID if char_set is not None else 1
+        packet[4:6] = np.frombuffer(np.uint16(packet_id).tobytes(), dtype='u1')
+        if char_set is not None:
+            packet[6] = char_set
+            packet[12:12 + len(text)] = np.frombuffer(text, dtype='u1')
+        packets.append(packet)
+    with open(path, 'wb') as f:
+        f.write(basic.tobytes())
+        f.write(np.concatenate(packets).tobytes())
+
+
+def test_header_and_data(tmp_path):
+    data = np.arange(30, dtype=np.int16).reshape(10, 3)
+    path = tmp_path / 'rec.ns5'
+    write_nsx(path, [(0, data)])
+    reader = NSxReader(str(path))
+    assert reader.channel_labels == LABELS
+    assert reader.channel_ids == [1, 2, 3]
+    assert reader.sampling_rate == 30000
+    assert reader.rec_datetime == datetime.datetime(2019, 5, 2, 13, 14, 15, 16000)
+    assert len(reader.segments) == 1
+    assert np.array_equal(reader.get_chunk(), data)
+    assert np.array_equal(reader.get_chunk(2, 5), data[2:5])
+    assert reader.get_chunk(8, 20).shape == (2, 3)  # Clipped like a slice.
+
+
+def test_each_packet_is_a_segment(tmp_path):
+    seg0 = np.ones((5, 3), dtype=np.int16)
+    seg1 = 2 * np.ones((7, 3), dtype=np.int16)
+    path = tmp_path / 'rec.ns5'
+    write_nsx(path, [(0, seg0), (9000, seg1)])
+    reader = NSxReader(str(path))
+    assert [(timestamp, n_samples) for timestamp, _, n_samples in reader.segments] == [(0, 5), (9000, 7)]
+    assert np.array_equal(reader.get_chunk(segment=1), seg1)
+
+
+def test_last_packet_of_an_unclosed_file(tmp_path):
+    # Central writes the number of samples when it closes the file; a crash leaves 0.
+    data = np.arange(12, dtype=np.int16).reshape(4, 3)
+    path = tmp_path / 'rec.ns5'
+    write_nsx(path, [(0, data)], n_declared=0)
+    assert np.array_equal(NSxReader(str(path)).get_chunk(), data)
+
+
+@pytest.mark.parametrize('kwargs', [{'version': (3, 0)}, {'file_type': b'NEURALSG'}])
+def test_unsupported_variants(tmp_path, kwargs):
+    path = tmp_path / 'rec.ns5'
+    write_nsx(path, [(0, np.zeros((2, 3), dtype=np.int16))], **kwargs)
+    with pytest.raises(UnsupportedFileError):
+        NSxReader(str(path))
+
+
+def test_truncated_and_empty_files(tmp_path):
+    path = tmp_path / 'rec.ns5'
+    path.write_bytes(b'NEURALCD')
+    with pytest.raises(UnsupportedFileError):
+        NSxReader(str(path))
+    write_nsx(path, [])
+    with pytest.raises(UnsupportedFileError):
+        NSxReader(str(path))
+
+
+def test_nev_comments(tmp_path):
+    path = tmp_path / 'rec.nev'
+    write_nev(path, [(100, 0, b'DTT:-10.000\x00junk'), (200, 1, 'DTT:-9.5'.encode('utf-16-le'))])
+    assert read_nev_comments(str(path)) == [(100, 'DTT:-10.000'), (200, 'DTT:-9.5')]
+
+
+def test_nev_without_packets(tmp_path):
+    path = tmp_path / 'rec.nev'
+    write_nev(path, [])
+    with open(path, 'r+b') as f:
+        f.truncate(NEV_BASIC_HEADER.itemsize)
+    assert read_nev_comments(str(path)) == []
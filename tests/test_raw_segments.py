@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('qtpy')  # raw_segments imports the Qt-based settings.
+from neuroport_dbs.dbsgui.my_models.raw_segments import MinMaxPyramid, RawSegmentStore
+
+
+def _segment(depth, n_samples=1000):
+    return np.sin(np.arange(n_samples) / 10. + depth) * 100. * (depth + 1)
+
+
+def test_spilled_segments_read_back(tmp_path):
+    store = RawSegmentStore(max_in_ram=2, spill_dir=str(tmp_path))
+    for depth in [3., 1., 2., 0.]:
+        store.put(depth, _segment(depth))
+    assert store.depths.tolist() == [0., 1., 2., 3.] and len(store) == 4 and 1. in store
+    assert len(store._ram) == 2
+    for depth in [3., 1., 2., 0., 3.]:
+        # int16 with a per-segment gain: within half a step of the peak / 32767.
+        assert np.allclose(store.get(depth), _segment(depth), atol=100. * (depth + 1) / 32767)
+    store.clear()
+    assert len(store) == 0 and store._spill_end == 0
+
+
+def test_replaced_segments_give_back_their_spill_space(tmp_path):
+    store = RawSegmentStore(max_in_ram=1, spill_dir=str(tmp_path))
+    for depth in range(4):
+        store.put(depth, _segment(depth))
+    assert store._spill_end == 3 * 2000  # The last one is in RAM.
+    for _ in range(5):
+        # Each replacement frees the old copy, which the next spill reuses.
+        for depth in range(4):
+            store.put(depth, _segment(depth + 10))
+    assert store._spill_end == 3 * 2000
+    for depth in range(4):
+        assert np.allclose(store.get(depth), _segment(depth + 10), atol=100. * (depth + 11) / 32767)
+
+
+def test_free_regions_are_merged_and_reused(tmp_path):
+    store = RawSegmentStore(max_in_ram=1, spill_dir=str(tmp_path))
+    for depth in range(5):
+        store.put(depth, _segment(depth))  # 0 to 3 are spilled to [0, 8000) of the file.
+    store.put(1, _segment(1, 10))  # Segment 4 is spilled where 1 was.
+    store.put(2, _segment(2, 10))  # The new segment 1 is spilled where 2 was.
+    assert store._free == [(4020, 1980)] and store._spill_end == 8000
+    # Segment 3's region merges with the free one before it, and the end of the file is given back.
+    store.put(3, _segment(3, 10))
+    assert store._free == [] and store._spill_end == 4040
+    for depth, n_samples in [(0, 1000), (1, 10), (2, 10), (3, 10), (4, 1000)]:
+        assert np.allclose(store.get(depth), _segment(depth, n_samples), atol=100. * (depth + 1) / 32767)
+
+
+def test_levels_halve_the_number_of_bins():
+    pyramid = MinMaxPyramid(np.arange(1024), min_bin=64)
+    assert [bin_size for bin_size, _ in pyramid.levels] == [64, 128, 256, 512]
+    assert [minmax.shape[0] for _, minmax in pyramid.levels] == [32, 16, 8, 4]
+
+
+def test_levels_interleave_bin_min_and_max():
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal(1000).astype(np.float32)
+    pyramid = MinMaxPyramid(data, min_bin=50)
+    for bin_size, minmax in pyramid.levels:
+        n_bins = minmax.shape[0] // 2
+        binned = data[:n_bins * bin_size].reshape(n_bins, bin_size)
+        assert np.array_equal(minmax[0::2], binned.min(axis=1))
+        assert np.array_equal(minmax[1::2], binned.max(axis=1))
+
+
+def test_short_segment_has_no_levels():
+    pyramid = MinMaxPyramid(np.arange(100), min_bin=64)
+    assert pyramid.levels == []
+    assert pyramid.level_for(10) is None
+
+
+def test_level_for_picks_the_coarsest_level_with_a_bin_per_pixel():
+    pyramid = MinMaxPyramid(np.arange(1024), min_bin=64)
+    x, y = pyramid.level_for(5)
+    assert y.shape[0] == 16  # 8 bins of 128 samples; there are only 4 bins of 256 samples for the 5 pixels.
+    assert x.tolist() == [64 + 128 * (ix // 2) for ix in range(16)]
+    assert pyramid.level_for(16)[1].shape[0] == 32
+    assert pyramid.level_for(17) is None  # Finer than the finest level: draw the full data.
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from neuroport_dbs.dbsgui.my_models.spike_detector import ThresholdDetector
+
+
+def _trace(n_samples, spike_ix, amplitude=-100., noise=0.):
+    # One-sample spikes on a flat (or noisy) baseline.
+    rng = np.random.default_rng(0)
+    data = noise * rng.standard_normal(n_samples)
+    data[spike_ix] += amplitude
+    return data
+
+
+def test_detects_crossings_and_cuts_snippets():
+    detector = ThresholdDetector(1, 30000, thresholds=[-50.], n_pre=5, n_post=10)
+    data = _trace(1000, [100, 400, 700])
+    timestamps, wfs = detector.process(data[None, :])[0]
+    assert timestamps.tolist() == [100, 400, 700]
+    assert wfs.shape == (3, 15)
+    assert np.all(wfs[:, 5] == -100) and np.all(wfs[:, :5] == 0)
+
+
+def test_positive_threshold_detects_upward_crossings():
+    detector = ThresholdDetector(1, 30000, thresholds=[50.], n_pre=5, n_post=10)
+    data = _trace(500, [100], amplitude=100.)
+    data[300] = -100.
+    assert detector.process(data[None, :])[0][0].tolist() == [100]
+
+
+def test_refractory_period():
+    # 1.5 ms at 30 kHz is 45 samples.
+    detector = ThresholdDetector(1, 30000, thresholds=[-50.], refractory=0.0015, n_pre=5, n_post=10)
+    timestamps, _ = detector.process(_trace(1000, [100, 120, 144, 146, 300])[None, :])[0]
+    assert timestamps.tolist() == [100, 146, 300]
+
+
+def test_chunk_boundaries_do_not_drop_or_repeat_spikes():
+    spike_ix = [20, 95, 98 + 45, 250, 399, 600, 799]
+    data = _trace(1000, spike_ix, noise=1.)
+    whole = ThresholdDetector(1, 30000, thresholds=[-50.], n_pre=5, n_post=10)
+    ts_whole, wfs_whole = whole.process(data[None, :])[0]
+
+    chunked = ThresholdDetector(1, 30000, thresholds=[-50.], n_pre=5, n_post=10)
+    results = [chunked.process(chunk[None, :])[0] for chunk in np.array_split(data, [97, 100, 101, 399, 400, 650])]
+    # A spike within n_post of the end of a chunk is only reported with the next one.
+    results.append(chunked.process(np.zeros((1, 20)))[0])
+    ts_chunked = np.concatenate([r[0] for r in results])
+    wfs_chunked = np.concatenate([r[1] for r in results])
+    assert ts_chunked.tolist() == ts_whole.tolist() == spike_ix
+    assert np.allclose(wfs_chunked, wfs_whole)
+    assert chunked.sample_count == 1020
+
+
+def test_channels_are_independent():
+    data = np.vstack([_trace(500, [100]), _trace(500, [200, 300]), _trace(500, [])])
+    detector = ThresholdDetector(3, 30000, thresholds=[-50., -50., -50.], n_pre=5, n_post=10)
+    result = detector.process(data)
+    assert [r[0].tolist() for r in result] == [[100], [200, 300], []]
+
+
+def test_gains_and_automatic_thresholds():
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal((2, 40000))
+    detector = ThresholdDetector(2, 30000, thresholds=[np.nan, -1.], gains=[2., 1.], auto_threshold=-4.5)
+    detector.process(data)
+    # Median absolute deviation estimate of the noise SD (2 after the gain).
+    assert np.isclose(detector.thresholds[0], -4.5 * 2, rtol=0.05)
+    assert detector.thresholds[1] == -1.
+
+
+def test_noise_is_estimated_after_the_filter_settles():
+    from scipy import signal
+    rng = np.random.default_rng(2)
+    # A large offset makes the high-pass filter ring at the start.
+    data = 1000. + rng.standard_normal((1, 60000))
+    sos = signal.butter(4, 2 * 250 / 30000, btype='highpass', output='sos')
+    detector = ThresholdDetector(1, 30000, sos=sos, auto_threshold=-4.5, noise_duration=1.0, settle_duration=0.1)
+    # Small chunks, as from a stream: no threshold until 1.1 s of data were seen.
+    for chunk in np.array_split(data[:, :33000 - 1], 100, axis=1):
+        detector.process(chunk)
+        assert np.isnan(detector.thresholds[0])
+    detector.process(data[:, 33000 - 1:])
+    # The filter passes most of the white noise, so its SD is a bit under 1.
+    assert -4.5 < detector.thresholds[0] < -4.0
+
+
+def test_spike_detection_serves_the_nsp_spike_api():
+    pytest.importorskip('qtpy')  # neuroport_dbs.dbsgui.workers imports the Qt-based settings.
+    from neuroport_dbs.dbsgui.workers.spikes import SpikeDetection
+
+    chunks = [[[1, _trace(1000, [100, 600])], [2, _trace(1000, [300])]]]
+    chan_states = [{'name': 'ch1', 'src': 1, 'gain': 0.5}, {'name': 'ch2', 'src': 2}]
+    spikes = SpikeDetection(lambda: chunks.pop(0) if chunks else None, chan_states, 30000,
+                            refractory=0.0015, n_pre=5, n_post=10, auto_threshold=None)
+    # A channel without a 'gain' has SweepGUI's 0.25 uV per bit, so the thresholds it shares are in the same units.
+    assert spikes.detector.gains.tolist() == [0.5, 0.25]
+    spikes.set_thresholds_uV([-40., -20.])
+    spikes.process_available()
+
+    wfs, unit_ids = spikes.get_waveforms(1)
+    assert wfs.shape == (2, 15) and unit_ids.tolist() == [0, 0]
+    assert np.all(wfs[:, 5] == -100)  # Back in raw units.
+    assert spikes.get_waveforms(1)[0].shape == (0, 15)  # Claimed.
+
+    ev_data = spikes.get_event_data()
+    assert [ev[0] for ev in ev_data] == [1, 2]
+    assert ev_data[0][1]['timestamps'][0].tolist() == [100, 600]
+    assert ev_data[1][1]['timestamps'][0].tolist() == [300]
+    assert spikes.get_event_data() == []
+    assert spikes.time() == 1000
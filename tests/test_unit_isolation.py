@@ -0,0 +1,111 @@
+import time
+
+import numpy as np
+import pytest
+
+from neuroport_dbs.dbsgui.my_models.unit_isolation import IncrementalPCA, UnitIsolation
+
+
+def _units(rng, n_per_unit=200, spk_length=32, noise=1.0):
+    # Two units with different shapes, interleaved.
+    t = np.arange(spk_length)
+    templates = np.vstack([-20 * np.exp(-(t - 10) ** 2 / 8.), 15 * np.exp(-(t - 16) ** 2 / 20.)])
+    unit_ids = np.tile([0, 1], n_per_unit)
+    wfs = templates[unit_ids] + noise * rng.standard_normal((unit_ids.size, spk_length))
+    return wfs, unit_ids
+
+
+def test_incremental_pca_matches_batch_pca():
+    rng = np.random.default_rng(0)
+    wfs = rng.standard_normal((5000, 8)) * np.array([10, 5, 1, 1, 1, 1, 1, 1])
+    pca = IncrementalPCA(n_components=2, half_life=1e9)
+    for chunk in np.array_split(wfs, 10):
+        pca.partial_fit(chunk)
+    assert np.allclose(pca.mean, wfs.mean(axis=0), atol=1e-4)
+    # The first two components are the first two axes (up to sign).
+    assert np.allclose(np.abs(pca.components), np.eye(8)[:2], atol=0.05)
+    assert pca.transform(wfs[:3]).shape == (3, 2)
+
+
+def test_well_separated_units_are_well_isolated():
+    rng = np.random.default_rng(1)
+    wfs, unit_ids = _units(rng)
+    model = UnitIsolation(n_wfs=1000, min_spikes=20)
+    model.add(wfs, unit_ids)
+    metrics = model.metrics()
+    assert sorted(metrics.keys()) == [0, 1]
+    for unit_ix in [0, 1]:
+        assert metrics[unit_ix]['n'] == 200
+        assert metrics[unit_ix]['snr'] > 5
+        assert metrics[unit_ix]['l_ratio'] < 0.01
+        assert metrics[unit_ix]['isi_violations'] is None  # No timestamps.
+
+
+def test_too_few_spikes_and_empty_waveforms():
+    rng = np.random.default_rng(2)
+    wfs, unit_ids = _units(rng, n_per_unit=10)
+    model = UnitIsolation(min_spikes=20)
+    model.add(wfs, unit_ids)
+    assert model.metrics() == {}
+    model.add(np.zeros((50, wfs.shape[1])), np.zeros(50, dtype=int))  # Dropped.
+    assert model.metrics() == {}
+
+
+def test_ring_keeps_the_last_n_wfs():
+    rng = np.random.default_rng(3)
+    wfs, unit_ids = _units(rng, n_per_unit=300)
+    model = UnitIsolation(n_wfs=100, min_spikes=20)
+    model.add(wfs[:400], unit_ids[:400])
+    model.add(wfs[400:], unit_ids[400:])
+    metrics = model.metrics()
+    assert metrics[0]['n'] + metrics[1]['n'] == 100
+
+
+def test_isi_violations_from_unit_timestamps():
+    rng = np.random.default_rng(4)
+    wfs, unit_ids = _units(rng, n_per_unit=50)
+    model = UnitIsolation(refractory=0.0015, srate=30000, min_spikes=20)
+    # Unit 0 fires every 1000 samples; unit 1 has 10 of its 49 intervals under the 45-sample refractory period.
+    ts_1 = np.cumsum(np.where(np.arange(50) % 5 == 1, 30, 1000))
+    model.add(wfs, unit_ids, unit_timestamps=[np.arange(50) * 1000, ts_1[:25]])
+    # Timestamps may arrive on their own and continue the previous ones.
+    model.add(None, None, unit_timestamps=[[], ts_1[25:]])
+    metrics = model.metrics()
+    assert metrics[0]['isi_violations'] == 0
+    assert np.isclose(metrics[1]['isi_violations'], 10 / 49)
+
+
+def test_clear():
+    rng = np.random.default_rng(5)
+    wfs, unit_ids = _units(rng)
+    model = UnitIsolation(min_spikes=20)
+    model.add(wfs, unit_ids, unit_timestamps=[np.arange(10) * 1000])
+    model.clear()
+    assert model.metrics() == {}
+
+
+
+def _worker(**kwargs):
+    pytest.importorskip('qtpy')  # The workers package imports the Qt-based settings.
+    from neuroport_dbs.dbsgui.workers.isolation import UnitIsolationWorker
+    return UnitIsolationWorker(['ch1'], 30000, **kwargs)
+
+
+def test_worker_queue_drops_the_oldest_submissions():
+    worker = _worker(max_queue=2)
+    for ix in range(3):
+        worker.submit('ch1', np.full((1, 32), ix), [0])
+    assert [item[2][0, 0] for item in list(worker._queue.queue)] == [1, 2]
+
+
+def test_worker_clear_drops_older_submissions():
+    wfs, unit_ids = _units(np.random.default_rng(6))
+    worker = _worker(interval=0.05, n_wfs=1000, min_spikes=20)
+    worker.submit('ch1', wfs, unit_ids)
+    worker.clear()
+    worker.submit('ch1', wfs, unit_ids)
+    worker.start()
+    time.sleep(0.2)
+    worker.stop()
+    metrics = worker.take_metrics()['ch1']
+    assert metrics[0]['n'] == metrics[1]['n'] == 200  # Only the waveforms submitted after clear().
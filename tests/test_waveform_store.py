@@ -0,0 +1,100 @@
+import numpy as np
+
+from neuroport_dbs.dbsgui.my_models.waveform_store import WaveformStore, WaveformDensity
+
+
+def _wfs(values, spk_length=48):
+    # One constant waveform per value, so the stored rows can be identified.
+    return np.repeat(np.asarray(values, dtype=float)[:, None], spk_length, axis=1)
+
+
+def test_add_routes_waveforms_to_their_unit():
+    store = WaveformStore(n_units=3, n_wfs=10)
+    touched = store.add(_wfs([1, 2, 3, 4]), [0, 2, 2, 0])
+    assert sorted(touched) == [0, 2]
+    assert store.count(0) == 2 and store.count(1) == 0 and store.count(2) == 2
+    assert sorted(store.unit_waveforms(0)[:, 0]) == [1, 4]
+    assert sorted(store.unit_waveforms(2)[:, 0]) == [2, 3]
+
+
+def test_ring_keeps_the_newest_waveforms():
+    store = WaveformStore(n_units=1, n_wfs=4)
+    store.add(_wfs([1, 2, 3]), [0, 0, 0])
+    store.add(_wfs([4, 5, 6]), [0, 0, 0])
+    assert store.count(0) == 4
+    assert sorted(store.unit_waveforms(0)[:, 0]) == [3, 4, 5, 6]
+
+    # A single call with more waveforms than the ring holds.
+    store.add(_wfs(np.arange(10, 20)), np.zeros(10, dtype=int))
+    assert sorted(store.unit_waveforms(0)[:, 0]) == [16, 17, 18, 19]
+
+
+def test_empty_and_out_of_range_waveforms_are_dropped():
+    store = WaveformStore(n_units=2, n_wfs=5)
+    touched = store.add(_wfs([0, 1, 2, 3]), [0, 0, 2, -1])
+    assert touched == [0]
+    assert store.count(0) == 1 and store.count(1) == 0
+    assert store.add(np.zeros((0, 48)), []) == []
+
+
+def test_new_waveform_length_resizes_and_clears():
+    store = WaveformStore(n_units=1, n_wfs=5, spk_length=48)
+    store.add(_wfs([1, 2]), [0, 0])
+    store.add(_wfs([3], spk_length=32), [0])
+    assert store.spk_length == 32
+    assert store.count(0) == 1
+    assert store.unit_waveforms(0).shape == (1, 32)
+    assert store.connect.shape == (5 * 32,)
+    assert not store.connect[31] and store.connect[30]
+
+
+def test_clear():
+    store = WaveformStore(n_units=2, n_wfs=5)
+    store.add(_wfs([1, 2]), [0, 1])
+    store.clear()
+    assert store.count(0) == 0 and store.count(1) == 0
+    assert store.unit_waveforms(0).shape == (0, 48)
+
+
+def test_density_bins_every_sample():
+    density = WaveformDensity(y_range=100, n_bins=20, half_life=0, spk_length=4)
+    assert density.add(np.array([[0., 50., -50., 99.], [0., 50., -50., 99.]]))
+    assert density.hist.shape == (4, 20)
+    assert density.hist.sum() == 8
+    # Bin width is 10: 0 -> bin 10, 50 -> 15, -50 -> 5, 99 -> 19.
+    assert density.hist[0, 10] == 2 and density.hist[1, 15] == 2
+    assert density.hist[2, 5] == 2 and density.hist[3, 19] == 2
+
+
+def test_density_ignores_out_of_range_and_empty_waveforms():
+    density = WaveformDensity(y_range=100, n_bins=20, half_life=0, spk_length=2)
+    assert not density.add(np.zeros((3, 2)))
+    assert density.add(np.array([[150., 10.]]))
+    assert density.hist.sum() == 1
+
+
+def test_density_decays_with_its_half_life():
+    density = WaveformDensity(y_range=100, n_bins=20, half_life=10.0, spk_length=2)
+    density.add(np.array([[10., 10.]]))
+    density._t_last -= 10.0  # As if 10 s went by.
+    density.decay()
+    assert np.isclose(density.hist.sum(), 1.0)
+
+
+def test_density_resize_and_set_range_clear():
+    density = WaveformDensity(y_range=100, n_bins=20, spk_length=2)
+    density.add(np.array([[10., 10., 10.]]))
+    assert density.hist.shape == (3, 20)
+    density.set_range(200)
+    assert density.y_range == 200 and density.hist.sum() == 0
+
+
+def test_density_fades_against_its_peak():
+    density = WaveformDensity(y_range=100, n_bins=20, half_life=10.0, spk_length=2)
+    density.add(np.array([[10., 10.], [10., 10.]]))
+    assert density.peak == 2
+    density._t_last -= 10.0
+    density.decay()  # Without new waveforms.
+    assert density.peak == 2 and np.isclose(density.hist.max(), 1.0)
+    density.clear()
+    assert density.peak == 0